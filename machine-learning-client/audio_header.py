@@ -0,0 +1,90 @@
+"""
+This module reads WAV, FLAC and Opus (Ogg or WebM) headers so the recognition
+config can describe the audio as it was recorded instead of assuming 16 kHz LINEAR16.
+"""
+
+import struct
+
+from google.cloud import speech
+
+Encoding = speech.RecognitionConfig.AudioEncoding
+
+# Config used when the header is not recognized, matching the web app's ffmpeg output.
+DEFAULT_AUDIO_FORMAT = {
+    "encoding": Encoding.LINEAR16,
+    "sample_rate_hertz": 16000,
+    "audio_channel_count": 1,
+}
+
+# Sample rates Google Speech accepts for Opus audio.
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# WAV format tags Google Speech can decode.
+WAV_ENCODINGS = {1: Encoding.LINEAR16, 7: Encoding.MULAW}
+
+
+def parse_wav_header(content: bytes):
+    """Reads the fmt chunk of a RIFF/WAVE file. Returns None if it is unsupported."""
+    offset = 12
+    while offset + 8 <= len(content):
+        chunk_id = content[offset : offset + 4]
+        (chunk_size,) = struct.unpack_from("<I", content, offset + 4)
+        if chunk_id == b"fmt " and offset + 24 <= len(content):
+            format_tag, channels, sample_rate = struct.unpack_from(
+                "<HHI", content, offset + 8
+            )
+            (bits_per_sample,) = struct.unpack_from("<H", content, offset + 22)
+            encoding = WAV_ENCODINGS.get(format_tag)
+            if encoding is None or (format_tag == 1 and bits_per_sample != 16):
+                return None
+            return {
+                "encoding": encoding,
+                "sample_rate_hertz": sample_rate,
+                "audio_channel_count": channels,
+            }
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def parse_flac_header(content: bytes):
+    """Reads the STREAMINFO block that follows the fLaC marker."""
+    if len(content) < 26:
+        return None
+    # STREAMINFO starts at byte 8; sample rate and channels follow 10 bytes of sizes.
+    (packed,) = struct.unpack_from(">I", content, 18)
+    return {
+        "encoding": Encoding.FLAC,
+        "sample_rate_hertz": packed >> 12,
+        "audio_channel_count": ((packed >> 9) & 0x7) + 1,
+    }
+
+
+def parse_opus_header(content: bytes, encoding):
+    """Reads the OpusHead packet, which Ogg pages and WebM CodecPrivate both carry."""
+    offset = content.find(b"OpusHead")
+    if offset < 0 or offset + 16 > len(content):
+        return None
+    channels = content[offset + 9]
+    (input_rate,) = struct.unpack_from("<I", content, offset + 12)
+    return {
+        "encoding": encoding,
+        "sample_rate_hertz": input_rate if input_rate in OPUS_SAMPLE_RATES else 48000,
+        "audio_channel_count": channels,
+    }
+
+
+def detect_audio_format(content: bytes):
+    """
+    Returns the encoding, sample rate and channel count described by the
+    audio header, or DEFAULT_AUDIO_FORMAT when the format is not recognized.
+    """
+    audio_format = None
+    if content[:4] == b"RIFF" and content[8:12] == b"WAVE":
+        audio_format = parse_wav_header(content)
+    elif content[:4] == b"fLaC":
+        audio_format = parse_flac_header(content)
+    elif content[:4] == b"OggS":
+        audio_format = parse_opus_header(content, Encoding.OGG_OPUS)
+    elif content[:4] == b"\x1a\x45\xdf\xa3":
+        audio_format = parse_opus_header(content[:4096], Encoding.WEBM_OPUS)
+    return audio_format or dict(DEFAULT_AUDIO_FORMAT)
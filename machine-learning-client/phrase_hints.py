@@ -0,0 +1,171 @@
+"""
+This module builds the speech adaptation phrase set sent to Google Cloud Speech.
+Phrases come from the exercise catalog and the voice command vocabulary, and are
+cached so that a recognition request never waits on a full catalog scan.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import certifi
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from google.cloud import speech
+
+logger = logging.getLogger(__name__)
+
+# Words the web app's parse_voice_command looks for.
+COMMAND_PHRASES = (
+    "minute",
+    "minutes",
+    "group",
+    "groups",
+    "rep",
+    "reps",
+    "kg",
+    "kgs",
+    "kilogram",
+    "kilograms",
+)
+
+# Google Speech limits for a single recognition request.
+MAX_PHRASES = 5000
+MAX_PHRASE_LENGTH = 100
+
+
+class PhraseHintCache:  # pylint: disable=too-many-instance-attributes
+    """
+    Keeps the catalog-derived phrase set in memory.
+    New exercises are fetched incrementally by _id. A new catalog version
+    (bumped by the importer, which also renames exercises in place) or a
+    change in the catalog size (deletes) triggers a full rebuild.
+    """
+
+    def __init__(self, collection, refresh_interval=60.0, boost=10.0):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self.boost = boost
+        self._lock = threading.Lock()
+        self._names = {}
+        self._seen = 0
+        self._last_id = None
+        self._version = None
+        self._checked_at = None
+        self._phrases = list(COMMAND_PHRASES)
+
+    def _catalog_version(self):
+        """The version counter the exercise importer bumps on every import."""
+        meta = self.collection.database["catalog_meta"].find_one(
+            {"_id": "exercises"}, {"version": 1}
+        )
+        return (meta or {}).get("version", 0)
+
+    def _fetch(self, query):
+        """Adds every workout name matching the query to the cache."""
+        cursor = self.collection.find(query, {"workout_name": 1}).sort("_id", 1)
+        for exercise in cursor:
+            name = exercise.get("workout_name")
+            if name:
+                self._names[exercise["_id"]] = name[:MAX_PHRASE_LENGTH]
+            self._seen += 1
+            self._last_id = exercise["_id"]
+
+    def _rebuild(self, version):
+        self._names = {}
+        self._seen = 0
+        self._last_id = None
+        self._version = version
+        self._fetch({})
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if (
+            not force
+            and self._checked_at is not None
+            and now - self._checked_at < self.refresh_interval
+        ):
+            return
+        self._checked_at = now
+
+        version = self._catalog_version()
+        if self._last_id is None or version != self._version:
+            self._rebuild(version)
+        else:
+            self._fetch({"_id": {"$gt": self._last_id}})
+            if self.collection.count_documents({}) != self._seen:
+                self._rebuild(version)
+
+        catalog = sorted(set(self._names.values()))
+        self._phrases = (list(COMMAND_PHRASES) + catalog)[:MAX_PHRASES]
+
+    def refresh(self, force=False):
+        """
+        Brings the cache in line with the catalog.
+        Does nothing if the last check was less than refresh_interval ago.
+        """
+        with self._lock:
+            self._refresh(force)
+
+    def phrases(self):
+        """Returns the current phrase list, refreshing it if it is stale."""
+        # A request never waits for another thread's refresh; it gets the
+        # phrases from before that refresh instead. Released below.
+        # pylint: disable-next=consider-using-with
+        if self._lock.acquire(blocking=False):
+            try:
+                self._refresh()
+            except PyMongoError as e:
+                logger.error("Failed to refresh phrase hints: %s", e)
+            finally:
+                self._lock.release()
+        return self._phrases
+
+    def speech_contexts(self):
+        """Returns the phrase set as Google Speech speech_contexts."""
+        return [speech.SpeechContext(phrases=self.phrases(), boost=self.boost)]
+
+
+def get_exercises_collection():
+    """
+    Connects to the exercise catalog using MONGO_URI.
+    Returns None when no database is configured.
+    """
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        return None
+    client = MongoClient(mongo_uri, tls=True, tlsCAFile=certifi.where())
+    return client["fitness_db"]["exercises"]
+
+
+class StaticPhraseHints:
+    """Phrase set used when no catalog is available: command words only."""
+
+    def __init__(self, boost=10.0):
+        self.boost = boost
+
+    def phrases(self):
+        """Returns the command vocabulary."""
+        return list(COMMAND_PHRASES)
+
+    def speech_contexts(self):
+        """Returns the command vocabulary as Google Speech speech_contexts."""
+        return [speech.SpeechContext(phrases=self.phrases(), boost=self.boost)]
+
+
+def create_phrase_hints():
+    """
+    Builds the phrase hint source configured by the environment.
+    SPEECH_CONTEXTS_REFRESH sets the catalog check interval in seconds and
+    SPEECH_CONTEXTS_BOOST the boost value.
+    """
+    boost = float(os.getenv("SPEECH_CONTEXTS_BOOST", "10"))
+    collection = get_exercises_collection()
+    if collection is None:
+        return StaticPhraseHints(boost=boost)
+    return PhraseHintCache(
+        collection,
+        refresh_interval=float(os.getenv("SPEECH_CONTEXTS_REFRESH", "60")),
+        boost=boost,
+    )
@@ -0,0 +1,287 @@
+"""
+This module is an opt-in statistical profiler for a running Flask worker.
+While it is on, a background thread samples the stacks of the requests being
+profiled every few milliseconds. Each request is chosen either at random
+(sample_rate) or kept only if it ends up slower than slow_ms. Samples are
+aggregated per route as folded stacks ("frame;frame;frame count"), the input
+format of flamegraph.pl and speedscope.
+
+The profiler is switched on and off through /admin/profiler, guarded by
+PROFILER_ADMIN_TOKEN. With PROFILE_DIR set, the settings are shared through a
+file there so every worker on the host follows the toggle, and folded output
+is written there per route and worker.
+
+The copies in web-app/ and machine-learning-client/ are generated from
+shared/ by shared/sync.py; edit this module there.
+"""
+
+import hmac
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, g, jsonify, request
+
+MAX_DEPTH = 128
+
+
+def fold_stack(frame):
+    """Returns the stack ending at frame as "file:function;...", outermost first."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _number(value, name):
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number")
+    try:
+        return float(value)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{name} must be a number") from e
+
+
+def validate_settings(settings):
+    """
+    Returns the known settings converted to their types: enabled as a bool,
+    sample_rate as a float from 0 to 1 and slow_ms as a float >= 0 or None.
+    Raises ValueError for anything else.
+    """
+    cleaned = {}
+    if "enabled" in settings:
+        enabled = settings["enabled"]
+        if isinstance(enabled, str) and enabled.lower() in ("true", "false"):
+            enabled = enabled.lower() == "true"
+        if not isinstance(enabled, bool):
+            raise ValueError("enabled must be true or false")
+        cleaned["enabled"] = enabled
+    if "sample_rate" in settings:
+        sample_rate = _number(settings["sample_rate"], "sample_rate")
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        cleaned["sample_rate"] = sample_rate
+    if "slow_ms" in settings:
+        slow_ms = settings["slow_ms"]
+        if slow_ms is not None:
+            slow_ms = _number(slow_ms, "slow_ms")
+            if math.isnan(slow_ms) or slow_ms < 0:
+                raise ValueError("slow_ms must be 0 or more")
+        cleaned["slow_ms"] = slow_ms
+    return cleaned
+
+
+def route_file_name(route):
+    """A file-name-safe version of a route pattern."""
+    return re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+
+
+class SamplingProfiler:  # pylint: disable=too-many-instance-attributes
+    """Samples the stacks of selected requests and aggregates them per route."""
+
+    def __init__(self, profile_dir=None, interval=0.005):
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.settings = {"enabled": False, "sample_rate": 0.01, "slow_ms": None}
+        self._lock = threading.Lock()
+        self._active = {}
+        self._routes = {}
+        self._thread = None
+        self._state_mtime = None
+        self._state_checked = 0.0
+
+    @property
+    def state_path(self):
+        """File holding the settings shared by the workers, or None."""
+        return (
+            os.path.join(self.profile_dir, "profiler.json")
+            if self.profile_dir
+            else None
+        )
+
+    def configure(self, **settings):
+        """
+        Updates the settings, shares them with other workers and starts sampling.
+        Raises ValueError for invalid settings.
+        """
+        self._apply(validate_settings(settings))
+        if self.state_path:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.settings, f)
+            os.replace(tmp_path, self.state_path)
+            self._state_mtime = os.stat(self.state_path).st_mtime
+
+    def _apply(self, settings):
+        was_enabled = self.settings["enabled"]
+        self.settings.update(settings)
+        if self.settings["enabled"] and self._thread is None:
+            self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+            self._thread.start()
+        if was_enabled and not self.settings["enabled"] and self.profile_dir:
+            self.dump()
+
+    def _reload(self):
+        """Picks up settings changed by another worker, at most once a second."""
+        now = time.monotonic()
+        if not self.state_path or now - self._state_checked < 1.0:
+            return
+        self._state_checked = now
+        try:
+            mtime = os.stat(self.state_path).st_mtime
+            if mtime != self._state_mtime:
+                with open(self.state_path, encoding="utf-8") as f:
+                    self._apply(validate_settings(json.load(f)))
+                self._state_mtime = mtime
+        except (OSError, TypeError, ValueError):
+            # Unreadable or invalid shared settings leave the current ones.
+            pass
+
+    def _sample_loop(self):
+        while self.settings["enabled"]:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for thread_id, (_, stacks) in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[fold_stack(frame)] += 1
+        self._thread = None
+
+    def before_request(self):
+        """Starts sampling this request if it is selected."""
+        self._reload()
+        settings = self.settings
+        if not settings["enabled"]:
+            return
+        chosen = random.random() < (settings["sample_rate"] or 0)
+        if not chosen and not settings["slow_ms"]:
+            return
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        g.profile = (chosen, time.perf_counter())
+        self._active[threading.get_ident()] = (route, Counter())
+
+    def teardown_request(self, error=None):  # pylint: disable=unused-argument
+        """Keeps the request's samples if it was chosen or turned out slow."""
+        profile = g.pop("profile", None)
+        entry = self._active.pop(threading.get_ident(), None)
+        if profile is None or entry is None:
+            return
+        chosen, started = profile
+        slow_ms = self.settings["slow_ms"]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if chosen or (slow_ms and elapsed_ms >= slow_ms):
+            route, stacks = entry
+            with self._lock:
+                self._routes.setdefault(route, Counter()).update(stacks)
+
+    def folded(self, route=None):
+        """Folded stacks of one route, or of all routes prefixed with the route."""
+        with self._lock:
+            routes = {r: Counter(s) for r, s in self._routes.items()}
+        if route is not None:
+            stacks = routes.get(route, Counter())
+        else:
+            stacks = Counter()
+            for name, route_stacks in routes.items():
+                for stack, count in route_stacks.items():
+                    stacks[f"{name};{stack}"] += count
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def summary(self):
+        """Sample counts per route."""
+        with self._lock:
+            return {route: sum(s.values()) for route, s in self._routes.items()}
+
+    def dump(self):
+        """Writes each route's folded stacks to PROFILE_DIR. Returns the paths."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        paths = []
+        for route in self.summary():
+            path = os.path.join(
+                self.profile_dir, f"{route_file_name(route)}.{os.getpid()}.folded"
+            )
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.folded(route))
+            paths.append(path)
+        return paths
+
+    def reset(self):
+        """Discards the collected samples."""
+        with self._lock:
+            self._routes.clear()
+
+    def init_app(self, app, admin_token=None):
+        """
+        Registers the request hooks and, when admin_token is set, the admin routes:
+        GET/POST /admin/profiler for status and settings, and
+        GET /admin/profiler/folded?route=... for the folded stacks.
+        """
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+        if not admin_token:
+            return
+
+        def check_token():
+            supplied = request.headers.get("X-Admin-Token", "")
+            if not hmac.compare_digest(supplied.encode(), admin_token.encode()):
+                abort(403)
+
+        def status():
+            check_token()
+            if request.method == "POST":
+                body = request.get_json(silent=True) or {}
+                if not isinstance(body, dict):
+                    return jsonify({"error": "Expected a JSON object"}), 400
+                try:
+                    settings = validate_settings(body)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+                if body.get("reset"):
+                    self.reset()
+                self.configure(**settings)
+                if body.get("dump") and self.profile_dir:
+                    self.dump()
+            return jsonify({"settings": self.settings, "samples": self.summary()})
+
+        def folded():
+            check_token()
+            return Response(
+                self.folded(request.args.get("route")), content_type="text/plain"
+            )
+
+        app.add_url_rule(
+            "/admin/profiler", "profiler_status", status, methods=["GET", "POST"]
+        )
+        app.add_url_rule("/admin/profiler/folded", "profiler_folded", folded)
+
+
+def create_profiler(environ=None):
+    """
+    Builds the profiler from PROFILE_DIR, PROFILE_SAMPLE_RATE (default 0.01),
+    PROFILE_SLOW_MS and PROFILE_INTERVAL_MS (default 5). PROFILE_ENABLED=true
+    starts it at boot.
+    """
+    environ = os.environ if environ is None else environ
+    profiler = SamplingProfiler(
+        environ.get("PROFILE_DIR"),
+        float(environ.get("PROFILE_INTERVAL_MS", "5")) / 1000,
+    )
+    slow_ms = environ.get("PROFILE_SLOW_MS")
+    profiler.settings.update(
+        sample_rate=float(environ.get("PROFILE_SAMPLE_RATE", "0.01")),
+        slow_ms=float(slow_ms) if slow_ms else None,
+    )
+    if environ.get("PROFILE_ENABLED", "false").lower() == "true":
+        profiler.configure(enabled=True)
+    return profiler
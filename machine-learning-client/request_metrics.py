@@ -0,0 +1,208 @@
+"""
+This module records per-route request metrics for a Flask app and serves
+them on /metrics in the Prometheus text format.
+Each thread writes to its own shard without locking. Shards are only merged
+when /metrics is scraped, so recording on the hot path costs a few dict updates.
+
+The copies in web-app/ and machine-learning-client/ are generated from
+shared/ by shared/sync.py; edit this module there.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+METRICS = {
+    "http_requests_total": ("counter", "Requests by route, method and status.", None),
+    "http_requests_in_progress": ("gauge", "Requests being handled.", None),
+    "http_request_duration_seconds": (
+        "histogram",
+        "Request latency by route and method.",
+        LATENCY_BUCKETS,
+    ),
+    "http_request_size_bytes": ("histogram", "Request body sizes.", SIZE_BUCKETS),
+    "http_response_size_bytes": ("histogram", "Response body sizes.", SIZE_BUCKETS),
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Shard:  # pylint: disable=too-few-public-methods
+    """Metric values written by one thread."""
+
+    __slots__ = ("values", "histograms")
+
+    def __init__(self):
+        # (name, labels) -> number
+        self.values = {}
+        # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+        self.histograms = {}
+
+    def merge_into(self, values, histograms):
+        """Adds this shard's values to the given totals."""
+        for key, value in list(self.values.items()):
+            values[key] = values.get(key, 0) + value
+        for key, counts in list(self.histograms.items()):
+            counts = list(counts)
+            total = histograms.setdefault(key, [0] * len(counts))
+            for i, count in enumerate(counts):
+                total[i] += count
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name, labels, buckets, counts):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(buckets + ("+Inf",), counts):
+        cumulative += count
+        le_labels = _format_labels(labels + (("le", str(bound)),))
+        lines.append(f"{name}_bucket{le_labels} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(counts[-1])}")
+    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return lines
+
+
+class RequestMetrics:
+    """Per-thread metric shards plus the Flask hooks that fill them."""
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics or METRICS
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        # Totals of shards whose threads have exited.
+        self._retired = _Shard()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) % 64 == 0:
+                    self._retire_dead_shards()
+        return shard
+
+    def _retire_dead_shards(self):
+        # Called with the lock held.
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                shard.merge_into(self._retired.values, self._retired.histograms)
+        self._shards = alive
+
+    def inc(self, name, labels=(), amount=1):
+        """Adds amount to a counter or gauge."""
+        values = self._shard().values
+        key = (name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """Records one observation in a histogram."""
+        buckets = self.metrics[name][2]
+        histograms = self._shard().histograms
+        key = (name, labels)
+        counts = histograms.get(key)
+        if counts is None:
+            counts = histograms[key] = [0] * (len(buckets) + 2)
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self):
+        """Returns merged ({(name, labels): value}, {(name, labels): counts})."""
+        with self._lock:
+            self._retire_dead_shards()
+            values = dict(self._retired.values)
+            histograms = {
+                key: list(counts) for key, counts in self._retired.histograms.items()
+            }
+            for _, shard in self._shards:
+                shard.merge_into(values, histograms)
+        return values, histograms
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        values, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in self.metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(
+                            f"{name}{_format_labels(labels)} {_format_value(value)}"
+                        )
+                continue
+            for (metric, labels), counts in sorted(histograms.items()):
+                if metric == name:
+                    lines.extend(_histogram_lines(name, labels, buckets, counts))
+        return "\n".join(lines) + "\n"
+
+    def before_request(self):
+        """Starts timing the request."""
+        g.metrics_started = time.perf_counter()
+        self.inc("http_requests_in_progress")
+
+    @staticmethod
+    def after_request(response):
+        """Remembers the status and size for teardown."""
+        g.metrics_status = response.status_code
+        g.metrics_response_size = response.content_length or 0
+        return response
+
+    def teardown_request(self, error=None):
+        """Records the finished request, as a 500 if it raised."""
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        self.inc("http_requests_in_progress", amount=-1)
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        status = 500 if error else g.pop("metrics_status", 500)
+        self.inc(
+            "http_requests_total",
+            (("method", request.method), ("route", route), ("status", str(status))),
+        )
+        labels = (("method", request.method), ("route", route))
+        self.observe(
+            "http_request_duration_seconds", time.perf_counter() - started, labels
+        )
+        self.observe(
+            "http_request_size_bytes", request.content_length or 0, (("route", route),)
+        )
+        self.observe(
+            "http_response_size_bytes",
+            g.pop("metrics_response_size", 0),
+            (("route", route),),
+        )
+
+    def init_app(self, app):
+        """Registers the request hooks and the /metrics route on a Flask app."""
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule(
+            "/metrics",
+            "metrics",
+            lambda: Response(self.render(), content_type=CONTENT_TYPE),
+        )
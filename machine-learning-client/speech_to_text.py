@@ -4,13 +4,51 @@ This module provides functions for speech-to-text transcription using Google Clo
 
 import os
 import json
+import logging
 from dotenv import load_dotenv
 from google.cloud import speech
 from google.oauth2 import service_account
 from flask import Flask, request, jsonify
+from phrase_hints import create_phrase_hints
+from audio_header import detect_audio_format
+from request_metrics import RequestMetrics
+from profiler import create_profiler
+from tracing import KIND_CLIENT, create_tracer
+from structured_logging import init_request_ids, setup_logging
 
 load_dotenv()
+setup_logging("machine-learning-client")
+logger = logging.getLogger(__name__)
 app = Flask(__name__)
+init_request_ids(app)
+request_metrics = RequestMetrics()
+request_metrics.init_app(app)
+tracer = create_tracer("machine-learning-client")
+tracer.init_app(app)
+profiler = create_profiler()
+profiler.init_app(app, os.getenv("PROFILER_ADMIN_TOKEN"))
+
+# Audio bodies over this size are rejected with 413: the web app's upload
+# limit plus the WAV header it adds to converted audio.
+app.config["MAX_CONTENT_LENGTH"] = int(
+    os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024 + 44))
+)
+
+SPEECH_CONTEXTS_ENABLED = os.getenv("SPEECH_CONTEXTS_ENABLED", "true").lower() == "true"
+PHRASE_HINTS = {}
+
+
+def get_speech_contexts():
+    """Returns the cached phrase hints as speech_contexts.
+    Keyword arguments:
+    argument -- None
+    Return: list of SpeechContext, empty when disabled.
+    """
+    if not SPEECH_CONTEXTS_ENABLED:
+        return []
+    if "hints" not in PHRASE_HINTS:
+        PHRASE_HINTS["hints"] = create_phrase_hints()
+    return PHRASE_HINTS["hints"].speech_contexts()
 
 
 def get_google_cloud_credentials():
@@ -32,40 +70,77 @@ def get_google_cloud_credentials():
     return credentials
 
 
-def transcribe_file(audio_file: str, credentials) -> speech.RecognizeResponse:
-    """Transcribe the audio to the text.
+def transcribe_file(
+    audio_file: str, credentials, speech_contexts=None
+) -> speech.RecognizeResponse:
+    """Transcribe the audio file to the text.
     Keyword arguments:
-    argument -- adress of the audio file, credential.
+    argument -- adress of the audio file, credential, optional phrase hints.
     Return: Transcription of the audio file.
     """
     try:
-        client = speech.SpeechClient(credentials=credentials)
         # print(f"Reading audio file: {audio_file}")
-        with open(audio_file, "rb") as f:
-            audio_content = f.read()
+        with tracer.span("read audio"):
+            with open(audio_file, "rb") as f:
+                audio_content = f.read()
+    except FileNotFoundError as e:
+        logger.error("File not found: %s", e)
+        return None
+    return transcribe_content(audio_content, credentials, speech_contexts)
+
+
+def transcribe_content(
+    audio_content: bytes, credentials, speech_contexts=None
+) -> speech.RecognizeResponse:
+    """Transcribe the audio to the text.
+    Keyword arguments:
+    argument -- audio bytes, credential, optional phrase hints.
+    Return: Transcription of the audio.
+    """
+    try:
+        client = speech.SpeechClient(credentials=credentials)
         audio = speech.RecognitionAudio(content=audio_content)
         config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=16000,
+            **detect_audio_format(audio_content),
             language_code="en-US",
+            speech_contexts=speech_contexts or [],
         )
 
         # print("Sending recognition request...")
-        response = client.recognize(config=config, audio=audio)
+        with tracer.span(
+            "google.cloud.speech.v1.Speech/Recognize",
+            KIND_CLIENT,
+            **{"audio.bytes": len(audio_content)},
+        ):
+            response = client.recognize(config=config, audio=audio)
 
         if not response.results:
-            print("No transcription results found.")
+            logger.warning("No transcription results found.")
 
         return response.results[0].alternatives[0]
 
-    except FileNotFoundError as e:
-        print(f"File not found: {e}")
     except ValueError as e:
-        print(f"Value error: {e}")
+        logger.error("Value error: %s", e)
 
     return None
 
 
+def read_audio_body():
+    """Reads the request body, or returns None if it is over MAX_CONTENT_LENGTH.
+    Keyword arguments:
+    argument -- None
+    Return: the body as bytes, or None when too large.
+    """
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    if request.content_length is not None and request.content_length > limit:
+        return None
+    # request.get_data() ignores the limit, so read at most one byte past it.
+    audio_content = request.stream.read(limit + 1)
+    if len(audio_content) > limit:
+        return None
+    return audio_content
+
+
 @app.route("/transcribe", methods=["POST"])
 def transcribe():
     """Communicate between web app and ml client.
@@ -73,15 +148,40 @@ def transcribe():
     argument -- None
     Return: Transcription of the audio file.
     """
-    data = request.json
-    audio_file = data.get("audio_file")
-    print(f"Received audio file path: {audio_file}")
-
-    if not audio_file:
-        return jsonify({"error": "Audio file path is required"}), 400
-
-    credentials = get_google_cloud_credentials()
-    result = transcribe_file(audio_file, credentials)
+    # The web app posts the audio itself as the body. A JSON body naming a file
+    # on the shared volume is still accepted.
+    if request.is_json:
+        audio_file = request.json.get("audio_file")
+        logger.info("Received audio file path: %s", audio_file)
+        if not audio_file:
+            return jsonify({"error": "Audio file path is required"}), 400
+    else:
+        audio_file = None
+        audio_content = read_audio_body()
+        if audio_content is None:
+            return jsonify({"error": "Audio is too large"}), 413
+        logger.info(
+            "Received %d bytes of audio",
+            len(audio_content),
+            extra={"audio_bytes": len(audio_content)},
+        )
+        if not audio_content:
+            return jsonify({"error": "Audio is required"}), 400
+
+    with tracer.span("load credentials"):
+        credentials = get_google_cloud_credentials()
+    with tracer.span("phrase hints"):
+        speech_contexts = get_speech_contexts()
+    phrase_count = sum(len(context.phrases) for context in speech_contexts)
+    logger.info(
+        "Transcribing with %d phrase hints",
+        phrase_count,
+        extra={"phrase_hints": phrase_count},
+    )
+    if audio_file:
+        result = transcribe_file(audio_file, credentials, speech_contexts)
+    else:
+        result = transcribe_content(audio_content, credentials, speech_contexts)
 
     if result is None:
         return jsonify({"error": "Transcription failed"}), 500
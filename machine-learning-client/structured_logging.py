@@ -0,0 +1,204 @@
+"""
+This module sets up JSON logging that never blocks a request.
+Records are put on a bounded queue by the request thread and written to stdout
+by a QueueListener thread; when the queue is full they are dropped and counted.
+Every record carries the id of the request that logged it, and repeated errors
+are rate limited per message so a failing dependency cannot flood the output.
+
+LOG_LEVEL (default INFO), LOG_QUEUE_SIZE (default 10000), LOG_ERROR_RATE_LIMIT
+(default 10) and LOG_ERROR_RATE_PERIOD in seconds (default 60) configure it.
+
+The copies in web-app/ and machine-learning-client/ are generated from
+shared/ by shared/sync.py; edit this module there.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+
+REQUEST_ID_HEADER = "X-Request-ID"
+VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# LogRecord attributes that are not user-supplied extra fields.
+RESERVED_ATTRIBUTES = set(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", None, None))
+) | {"message", "asctime", "request_id"}
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def current_request_id():
+    """The id of the request being handled, or None."""
+    return _request_id.get()
+
+
+def request_id_headers():
+    """Headers that pass the current request id on to another service."""
+    request_id = _request_id.get()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, including extra fields."""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Stamps records with the request id before they leave the request thread."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class ErrorRateLimitFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+    Lets through at most limit ERROR records per logger and message template
+    every period seconds. The next record let through reports how many were
+    suppressed.
+    """
+
+    def __init__(self, limit=10, period=60.0):
+        super().__init__()
+        self.limit = limit
+        self.period = period
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                started, count = now, 0
+            if count >= self.limit:
+                self._windows[key] = (started, count, suppressed + 1)
+                return False
+            if suppressed:
+                record.suppressed = suppressed
+            self._windows[key] = (started, count + 1, 0)
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of waiting when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Resolve the message and traceback here, but keep the extra fields
+        # as attributes so the JSON formatter can write them out.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(service, environ=None):
+    """
+    Routes the root logger through a bounded queue to a JSON stdout handler.
+    Safe to call more than once; returns the queue handler.
+    """
+    environ = os.environ if environ is None else environ
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            return handler
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter(service))
+    log_queue = queue.Queue(maxsize=int(environ.get("LOG_QUEUE_SIZE", "10000")))
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(
+        ErrorRateLimitFilter(
+            int(environ.get("LOG_ERROR_RATE_LIMIT", "10")),
+            float(environ.get("LOG_ERROR_RATE_PERIOD", "60")),
+        )
+    )
+    listener = QueueListener(log_queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root.addHandler(handler)
+    root.setLevel(environ.get("LOG_LEVEL", "INFO").upper())
+    return handler
+
+
+def init_request_ids(app):
+    """
+    Gives every request an id, taken from a valid incoming X-Request-ID header
+    or generated, and returns it in the response's X-Request-ID header.
+    """
+
+    def assign():
+        supplied = request.headers.get(REQUEST_ID_HEADER, "")
+        request_id = supplied if VALID_REQUEST_ID.match(supplied) else uuid.uuid4().hex
+        g.request_id_token = _request_id.set(request_id)
+
+    def respond(response):
+        request_id = _request_id.get()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    def clear(error=None):  # pylint: disable=unused-argument
+        token = g.pop("request_id_token", None)
+        if token is not None:
+            _request_id.reset(token)
+
+    # Put first so the id is set before, and cleared after, the other hooks run.
+    app.before_request_funcs.setdefault(None, []).insert(0, assign)
+    app.after_request(respond)
+    app.teardown_request_funcs.setdefault(None, []).insert(0, clear)
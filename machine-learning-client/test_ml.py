@@ -1,11 +1,25 @@
 """test machine learning client"""
 
 from unittest.mock import patch, MagicMock
+import filecmp
 import os
+import json
+import struct
 import pytest
+from google.cloud import speech
 from speech_to_text import get_google_cloud_credentials
 from speech_to_text import transcribe_file
-from speech_to_text import app
+from speech_to_text import app, tracer
+from tracing import SpanExporter
+from phrase_hints import PhraseHintCache, COMMAND_PHRASES
+from audio_header import detect_audio_format, DEFAULT_AUDIO_FORMAT
+
+SHARED_MODULES = (
+    "request_metrics.py",
+    "tracing.py",
+    "profiler.py",
+    "structured_logging.py",
+)
 
 
 def test_missing_service_account_json():
@@ -85,5 +99,199 @@ def test_transcribe_success(
     }
 
 
+@patch("speech_to_text.get_google_cloud_credentials")
+@patch("speech_to_text.transcribe_content")
+def test_transcribe_audio_body(
+    mock_transcribe_content, mock_get_google_cloud_credentials, client
+):  # pylint: disable=redefined-outer-name
+    """test audio posted as the request body is transcribed from memory"""
+    mock_get_google_cloud_credentials.return_value = MagicMock()
+    mock_transcribe_content.return_value = MagicMock(transcript="hi", confidence=0.5)
+
+    response = client.post(
+        "/transcribe",
+        data=b"RIFF audio",
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+    assert response.status_code == 200
+    assert mock_transcribe_content.call_args.args[0] == b"RIFF audio"
+    empty = client.post("/transcribe", data=b"", headers={"Content-Type": "audio/wav"})
+    assert empty.status_code == 400
+
+    with patch.dict(app.config, {"MAX_CONTENT_LENGTH": 4}):
+        large = client.post(
+            "/transcribe", data=b"RIFF audio", headers={"Content-Type": "audio/wav"}
+        )
+    assert large.status_code == 413
+    assert mock_transcribe_content.call_count == 1
+
+
+def test_phrase_hint_cache_incremental_refresh():
+    """test phrase hints are built from the catalog and refreshed incrementally"""
+    collection = MagicMock()
+    meta = collection.database["catalog_meta"]
+    meta.find_one.return_value = {"_id": "exercises", "version": 1}
+    collection.find.return_value.sort.return_value = [
+        {"_id": 1, "workout_name": "Romanian Deadlift"},
+        {"_id": 2, "workout_name": "Push Up"},
+        {"_id": 3},
+    ]
+    cache = PhraseHintCache(collection, refresh_interval=0)
+
+    phrases = cache.phrases()
+    assert phrases[: len(COMMAND_PHRASES)] == list(COMMAND_PHRASES)
+    assert "Romanian Deadlift" in phrases
+    collection.find.assert_called_once_with({}, {"workout_name": 1})
+
+    collection.find.return_value.sort.return_value = [
+        {"_id": 4, "workout_name": "Goblet Squat"}
+    ]
+    collection.count_documents.return_value = 4
+    phrases = cache.phrases()
+    assert "Goblet Squat" in phrases
+    collection.find.assert_called_with({"_id": {"$gt": 3}}, {"workout_name": 1})
+    assert collection.find.call_count == 2
+
+    # The importer renamed an exercise in place and bumped the version.
+    meta.find_one.return_value = {"_id": "exercises", "version": 2}
+    collection.find.return_value.sort.return_value = [
+        {"_id": 1, "workout_name": "Stiff-Leg Deadlift"},
+    ]
+    phrases = cache.phrases()
+    assert "Stiff-Leg Deadlift" in phrases
+    assert "Romanian Deadlift" not in phrases
+    collection.find.assert_called_with({}, {"workout_name": 1})
+
+
+@patch("speech_to_text.speech.SpeechClient")
+def test_transcribe_file_speech_contexts(
+    mock_speech_client, mock_credentials, mock_response
+):  # pylint: disable=redefined-outer-name
+    """test phrase hints are passed to the recognition config"""
+    mock_client_instance = mock_speech_client.return_value
+    mock_client_instance.recognize.return_value = mock_response
+
+    audio_file = "test_audio.wav"
+    with open(audio_file, "wb") as f:
+        f.write(b"fake audio content")
+
+    contexts = [speech.SpeechContext(phrases=["Romanian Deadlift"])]
+    transcribe_file(audio_file, mock_credentials, contexts)
+
+    config = mock_client_instance.recognize.call_args.kwargs["config"]
+    assert list(config.speech_contexts[0].phrases) == ["Romanian Deadlift"]
+    os.remove(audio_file)
+
+
+def test_detect_audio_format():
+    """test recognition config is read from WAV, FLAC and Opus headers"""
+    encoding = speech.RecognitionConfig.AudioEncoding
+    wav = (
+        b"RIFF\x24\x00\x00\x00WAVEfmt \x10\x00\x00\x00"
+        + struct.pack("<HHIIHH", 1, 2, 44100, 176400, 4, 16)
+        + b"data\x00\x00\x00\x00"
+    )
+    assert detect_audio_format(wav) == {
+        "encoding": encoding.LINEAR16,
+        "sample_rate_hertz": 44100,
+        "audio_channel_count": 2,
+    }
+
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\x00" * 6
+    streaminfo += struct.pack(">I", (48000 << 12) | (0 << 9) | (15 << 4))
+    flac = b"fLaC\x00\x00\x00\x22" + streaminfo + b"\x00" * 20
+    assert detect_audio_format(flac) == {
+        "encoding": encoding.FLAC,
+        "sample_rate_hertz": 48000,
+        "audio_channel_count": 1,
+    }
+
+    opus_head = b"OpusHead\x01\x01" + struct.pack("<HIHB", 312, 48000, 0, 0)
+    ogg = b"OggS" + b"\x00" * 24 + opus_head
+    assert detect_audio_format(ogg)["encoding"] == encoding.OGG_OPUS
+    assert detect_audio_format(ogg)["sample_rate_hertz"] == 48000
+    webm = b"\x1a\x45\xdf\xa3" + b"\x00" * 40 + opus_head
+    assert detect_audio_format(webm)["encoding"] == encoding.WEBM_OPUS
+
+    assert detect_audio_format(b"fake audio content") == DEFAULT_AUDIO_FORMAT
+
+
+@patch("speech_to_text.get_google_cloud_credentials")
+@patch("speech_to_text.transcribe_file")
+def test_metrics_endpoint(
+    mock_transcribe_file, mock_get_google_cloud_credentials, client
+):  # pylint: disable=redefined-outer-name
+    """test /transcribe requests are counted and timed on /metrics"""
+    mock_get_google_cloud_credentials.return_value = MagicMock()
+    mock_transcribe_file.return_value = MagicMock(transcript="hi", confidence=0.5)
+    client.post("/transcribe", json={"audio_file": "path/to/test_audio.wav"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    body = response.get_data(as_text=True)
+    assert 'http_requests_total{method="POST",route="/transcribe",status="200"}' in body
+    assert (
+        'http_request_duration_seconds_bucket{method="POST",route="/transcribe",'
+        'le="+Inf"}' in body
+    )
+
+
+@patch("speech_to_text.get_google_cloud_credentials")
+@patch("speech_to_text.transcribe_file")
+def test_transcribe_continues_trace(
+    mock_transcribe_file, mock_get_google_cloud_credentials, client, tmp_path
+):  # pylint: disable=redefined-outer-name
+    """test the web app's trace context is continued in /transcribe"""
+    mock_get_google_cloud_credentials.return_value = MagicMock()
+    mock_transcribe_file.return_value = MagicMock(transcript="hi", confidence=0.5)
+    exporter = SpanExporter("machine-learning-client", path=str(tmp_path / "s.jsonl"))
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+    with patch.object(tracer, "exporter", exporter):
+        client.post(
+            "/transcribe",
+            json={"audio_file": "path/to/test_audio.wav"},
+            headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+        )
+    exporter.flush()
+
+    with open(tmp_path / "s.jsonl", encoding="utf-8") as f:
+        spans = json.loads(f.readline())["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    names = {span["name"]: span for span in spans}
+    assert set(names) == {"load credentials", "phrase hints", "POST /transcribe"}
+    assert {span["traceId"] for span in spans} == {trace_id}
+    assert names["POST /transcribe"]["parentSpanId"] == "00f067aa0ba902b7"
+
+
+@patch("speech_to_text.get_google_cloud_credentials")
+@patch("speech_to_text.transcribe_file")
+def test_transcribe_logs_with_request_id(
+    mock_transcribe_file, mock_get_google_cloud_credentials, client, caplog
+):  # pylint: disable=redefined-outer-name
+    """test the web app's request id is echoed and the request is logged"""
+    mock_get_google_cloud_credentials.return_value = MagicMock()
+    mock_transcribe_file.return_value = MagicMock(transcript="hi", confidence=0.5)
+
+    response = client.post(
+        "/transcribe",
+        json={"audio_file": "path/to/test_audio.wav"},
+        headers={"X-Request-ID": "web-req-42"},
+    )
+
+    assert response.headers["X-Request-ID"] == "web-req-42"
+    received = [r for r in caplog.records if r.msg.startswith("Received audio")]
+    assert received[0].args == ("path/to/test_audio.wav",)
+
+
+def test_shared_modules_match_source():
+    """test the shared modules are unchanged copies of shared/"""
+    shared = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared")
+    for module in SHARED_MODULES:
+        assert filecmp.cmp(os.path.join(shared, module), module, shallow=False)
+
+
 if __name__ == "__main__":
     pytest.main()
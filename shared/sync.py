@@ -0,0 +1,59 @@
+"""
+This script copies the modules both services use from shared/ into each
+service directory. Every service is built from its own directory, so each one
+ships a copy; this directory is the only place they are edited.
+
+python shared/sync.py          copies the modules into the services
+python shared/sync.py --check  lists stale copies and exits 1 if there are any
+"""
+
+import os
+import shutil
+import sys
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SHARED_DIR)
+SERVICES = ("web-app", "machine-learning-client")
+MODULES = ("request_metrics.py", "tracing.py", "profiler.py", "structured_logging.py")
+
+
+def read_bytes(path):
+    """The file's contents, or None if it does not exist."""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def stale_copies(repo_dir=REPO_DIR):
+    """(source, copy) paths of every service copy that differs from shared/."""
+    stale = []
+    for module in MODULES:
+        source = os.path.join(repo_dir, "shared", module)
+        content = read_bytes(source)
+        for service in SERVICES:
+            copy = os.path.join(repo_dir, service, module)
+            if read_bytes(copy) != content:
+                stale.append((source, copy))
+    return stale
+
+
+def main(argv):
+    """Copies or checks the shared modules; returns the exit status."""
+    stale = stale_copies()
+    if "--check" in argv:
+        for source, copy in stale:
+            print(
+                f"{os.path.relpath(copy, REPO_DIR)} differs from "
+                f"{os.path.relpath(source, REPO_DIR)}"
+            )
+        return 1 if stale else 0
+    for source, copy in stale:
+        shutil.copyfile(source, copy)
+        print(f"updated {os.path.relpath(copy, REPO_DIR)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
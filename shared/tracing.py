@@ -0,0 +1,272 @@
+"""
+This module traces requests across the web app and the speech-to-text service.
+Trace context travels in the W3C traceparent header. Finished spans are
+exported in the OpenTelemetry OTLP/JSON format, either appended as lines to a
+file (readable by the collector's otlpjsonfile receiver) or posted to an
+OTLP/HTTP endpoint, from a background thread.
+
+Tracing is off unless TRACE_EXPORT_FILE or TRACE_EXPORT_ENDPOINT is set.
+TRACE_SAMPLE_RATIO (default 1.0) is the fraction of new traces to record;
+requests arriving with a sampled traceparent are always recorded.
+
+The copies in web-app/ and machine-learning-client/ are generated from
+shared/ by shared/sync.py; edit this module there.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header):
+    """Returns (trace_id, parent span id, sampled) or None if the header is invalid."""
+    match = TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:  # pylint: disable=too-many-instance-attributes
+    """One timed operation within a trace."""
+
+    def __init__(self, name, trace_id, parent_id=None, kind=KIND_INTERNAL):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = {}
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        """Records a key/value pair on the span."""
+        self.attributes[key] = value
+
+    def traceparent(self):
+        """The W3C traceparent header naming this span as the parent."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self):
+        """The span as an OTLP/JSON dict."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class SpanExporter:
+    """Queues finished spans and writes them in batches from a background thread."""
+
+    def __init__(self, service_name, path=None, endpoint=None, max_queue=10000):
+        self.service_name = service_name
+        self.path = path
+        self.endpoint = endpoint
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self.dropped = 0
+
+    def export(self, span):
+        """Queues a span; drops it if the queue is full."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            time.sleep(0.5)
+            self.flush()
+
+    def _drain(self):
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                return spans
+
+    def flush(self):
+        """Writes every queued span now, after any batch already being written."""
+        with self._write_lock:
+            spans = self._drain()
+            if spans:
+                self._write(spans)
+
+    def payload(self, spans):
+        """An OTLP/JSON ExportTraceServiceRequest for the spans."""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_attribute("service.name", self.service_name)]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "fitness-tracker"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def _write(self, spans):
+        body = json.dumps(self.payload(spans), separators=(",", ":"))
+        try:
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(body + "\n")
+            if self.endpoint:
+                post = urllib.request.Request(
+                    self.endpoint,
+                    data=body.encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                )
+                with urllib.request.urlopen(post, timeout=5):
+                    pass
+        except OSError as e:
+            logger.error("Failed to export %d spans: %s", len(spans), e)
+
+
+class Tracer:
+    """Starts spans, propagates their context and hands finished ones to the exporter."""
+
+    def __init__(self, exporter=None, sample_ratio=1.0):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+
+    @staticmethod
+    def current():
+        """The active span, or None when the request is not traced."""
+        return _current.get()
+
+    def headers(self):
+        """Headers that carry the active span to another service."""
+        span = _current.get()
+        return {"traceparent": span.traceparent()} if span else {}
+
+    @contextmanager
+    def span(self, name, kind=KIND_INTERNAL, **attributes):
+        """
+        Times the enclosed block as a child of the active span. Yields the span,
+        or None (doing nothing) when the current request is not traced.
+        """
+        parent = _current.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(name, parent.trace_id, parent.span_id, kind)
+        span.attributes.update(attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(span)
+
+    def _finish(self, span):
+        span.end_ns = time.time_ns()
+        self.exporter.export(span)
+
+    def before_request(self):
+        """Starts the server span, continuing the caller's trace if there is one."""
+        if self.exporter is None:
+            return
+        context = parse_traceparent(request.headers.get("traceparent"))
+        if context:
+            trace_id, parent_id, sampled = context
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+            sampled = random.random() < self.sample_ratio
+        if not sampled:
+            return
+        route = request.url_rule.rule if request.url_rule else request.path
+        span = Span(f"{request.method} {route}", trace_id, parent_id, KIND_SERVER)
+        span.set_attribute("http.method", request.method)
+        span.set_attribute("http.route", route)
+        g.trace_span, g.trace_token = span, _current.set(span)
+
+    @staticmethod
+    def after_request(response):
+        """Records the status code on the server span."""
+        span = g.get("trace_span")
+        if span is not None:
+            span.set_attribute("http.status_code", response.status_code)
+        return response
+
+    def teardown_request(self, error=None):
+        """Ends the server span."""
+        span = g.pop("trace_span", None)
+        if span is None:
+            return
+        _current.reset(g.pop("trace_token"))
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        self._finish(span)
+
+    def init_app(self, app):
+        """Registers the request hooks on a Flask app."""
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+
+def create_tracer(service_name, environ=None):
+    """Builds the tracer from TRACE_EXPORT_FILE, TRACE_EXPORT_ENDPOINT and TRACE_SAMPLE_RATIO."""
+    environ = os.environ if environ is None else environ
+    path = environ.get("TRACE_EXPORT_FILE")
+    endpoint = environ.get("TRACE_EXPORT_ENDPOINT")
+    exporter = None
+    if path or endpoint:
+        exporter = SpanExporter(
+            environ.get("TRACE_SERVICE_NAME", service_name), path, endpoint
+        )
+    return Tracer(exporter, float(environ.get("TRACE_SAMPLE_RATIO", "1.0")))
@@ -3,17 +3,15 @@ This module implements a Flask web application for a fitness tracker, including
 exercise management, and integration with a speech-to-text service for voice commands.
 """
 
+import logging
 import os
 import re
-import subprocess
 from datetime import datetime
 
 from flask import Flask, request, redirect, url_for, render_template, jsonify, session
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, PyMongoError
 from bson import ObjectId
-import certifi
+from pymongo.errors import ConnectionFailure, PyMongoError
 from flask_login import (
     LoginManager,
     UserMixin,
@@ -24,36 +22,135 @@ from flask_login import (
 )
 
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
 import requests
 
+from audio_pipe import (
+    AudioConversionError,
+    AudioTooLarge,
+    MULTIPART_OVERHEAD,
+    InMemoryUploadRequest,
+    convert_upload,
+)
+from conversion_scheduler import (
+    CONVERSION_METRICS,
+    ConversionBusy,
+    create_conversion_scheduler,
+)
+from todo_sync import parse_fields, todo_page
+from voice_command import parse_voice_command
+from mongo_pool import PoolMonitor, create_mongo_client
+from storage import create_storage
+from catalog_snapshot import SnapshotStorage
+from write_behind import create_write_behind_buffer
+from request_metrics import METRICS, RequestMetrics
+from db_accounting import DB_METRICS, create_command_accounting
+from profiler import create_profiler
+from tracing import KIND_CLIENT, create_tracer
+from structured_logging import init_request_ids, request_id_headers, setup_logging
+from static_assets import StaticAssets
+from http_caching import CachedValue, create_http_caching
+from session_store import (
+    create_session_interface,
+    load_secret_key,
+    regenerate_session_id,
+)
+from password_hashing import PasswordHashingBusy, create_password_hasher, needs_rehash
+
 load_dotenv()
+setup_logging("web-app")
+logger = logging.getLogger(__name__)
 
 mongo_uri = os.getenv("MONGO_URI")
 
 app = Flask(__name__)
-app.secret_key = os.urandom(13)
+app.request_class = InMemoryUploadRequest
+app.secret_key = load_secret_key(instance_path=app.instance_path)
+init_request_ids(app)
+static_assets = StaticAssets(app.static_folder)
+static_assets.init_app(app)
+
+request_metrics = RequestMetrics({**METRICS, **DB_METRICS, **CONVERSION_METRICS})
+request_metrics.init_app(app)
+command_accounting = create_command_accounting(request_metrics)
+command_accounting.init_app(app)
+tracer = create_tracer("web-app")
+tracer.init_app(app)
+profiler = create_profiler()
+profiler.init_app(app, os.getenv("PROFILER_ADMIN_TOKEN"))
+http_caching = create_http_caching(app)
+http_caching.init_app(app)
+
+# Uploads and converted audio over this size are rejected with 413. Request
+# bodies are capped just above it, so werkzeug refuses an oversized upload
+# from its Content-Length before reading or spooling any of it.
+app.config["AUDIO_MAX_BYTES"] = int(os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024)))
+app.config["MAX_CONTENT_LENGTH"] = app.config["AUDIO_MAX_BYTES"] + MULTIPART_OVERHEAD
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "30"))
+conversion_scheduler = create_conversion_scheduler(request_metrics)
+
+pool_monitor = PoolMonitor()
+
+
+def connect_mongo():
+    """Builds the MongoDB client. No connection is made until first use."""
+    return create_mongo_client(
+        mongo_uri, event_listeners=[pool_monitor, command_accounting]
+    )
+
+
+storage = create_storage(connect_mongo)
+if os.getenv("CATALOG_SNAPSHOT"):
+    storage = SnapshotStorage(
+        storage,
+        os.getenv("CATALOG_SNAPSHOT"),
+        check_interval=float(os.getenv("CATALOG_SNAPSHOT_CHECK_INTERVAL", "300")),
+    )
+
+app.session_interface = create_session_interface(
+    storage, instance_path=app.instance_path
+)
+
+
+def current_catalog_version():
+    """Identifies the current state of the exercise catalog."""
+    return storage.catalog_version()
+
+
+# The catalog only changes on import, so pages built from it may be revalidated
+# against a version up to CATALOG_VERSION_TTL seconds old.
+catalog_version = CachedValue(
+    current_catalog_version, float(os.getenv("CATALOG_VERSION_TTL", "30"))
+)
+
+
+def write_search_history(entries):
+    """Writes a batch of buffered search history entries."""
+    storage.insert_search_history_many(entries)
 
-UPLOAD_FOLDER = "uploads"
-app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+def write_transcriptions(entries):
+    """Writes a batch of buffered transcription entries."""
+    storage.insert_transcriptions_many(entries)
 
-client = MongoClient(mongo_uri, tls=True, tlsCAFile=certifi.where())
 
-try:
-    client.admin.command("ping")
-    print("Successfully connected to MongoDB!")
-except ConnectionFailure as e:
-    print(f"Failed to connect to MongoDB: {e}")
+search_history_buffer = create_write_behind_buffer(
+    "search_history", write_search_history
+)
+transcription_buffer = create_write_behind_buffer(
+    "edit_transcription", write_transcriptions
+)
 
-db = client["fitness_db"]
-todo_collection = db["todo"]
-exercises_collection = db["exercises"]
-users_collection = db["users"]
-search_history_collection = db["search_history"]
-edit_transcription_collection = db["edit_transcription"]
+password_hasher = create_password_hasher()
+# Werkzeug method string, e.g. "pbkdf2:sha256:600000" to raise the work factor.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+
+SPEECH_TO_TEXT_URL = os.getenv(
+    "SPEECH_TO_TEXT_URL", "http://machine-learning-client:8080/transcribe"
+)
+SEARCH_HISTORY_LIMIT = int(os.getenv("SEARCH_HISTORY_LIMIT", "20"))
+TODO_API_PAGE_SIZE = int(os.getenv("TODO_API_PAGE_SIZE", "50"))
+TODO_API_MAX_PAGE_SIZE = 200
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -71,7 +168,7 @@ class User(UserMixin):
     @staticmethod
     def get(user_id):
         """Retrieve a User object from the database by user_id."""
-        user_data = users_collection.find_one({"_id": ObjectId(user_id)})
+        user_data = storage.get_user(user_id)
         if user_data:
             return User(
                 str(user_data["_id"]), user_data["username"], user_data["password"]
@@ -95,33 +192,7 @@ def search_exercise(query: str):
     ignoring case, spaces, and hyphens.
     """
     normalized_query = normalize_text(query)
-
-    exercises = exercises_collection.find(
-        {
-            "$expr": {
-                "$regexMatch": {
-                    "input": {
-                        "$replaceAll": {
-                            "input": {
-                                "$replaceAll": {
-                                    "input": "$workout_name",
-                                    "find": "-",
-                                    "replacement": "",
-                                }
-                            },
-                            "find": " ",
-                            "replacement": "",
-                        }
-                    },
-                    "regex": normalized_query,
-                    "options": "i",
-                }
-            }
-        }
-    )
-
-    exercises_list = list(exercises)
-    return exercises_list
+    return storage.find_exercises_matching(normalized_query)
 
 
 def search_exercise_rigid(query: str):
@@ -131,34 +202,7 @@ def search_exercise_rigid(query: str):
     ignoring case, spaces, and hyphens.
     """
     normalized_query = normalize_text(query)
-
-    exercises = exercises_collection.find(
-        {
-            "$expr": {
-                "$eq": [
-                    {
-                        "$toLower": {
-                            "$replaceAll": {
-                                "input": {
-                                    "$replaceAll": {
-                                        "input": "$workout_name",
-                                        "find": "-",
-                                        "replacement": "",
-                                    }
-                                },
-                                "find": " ",
-                                "replacement": "",
-                            }
-                        }
-                    },
-                    normalized_query,
-                ]
-            }
-        }
-    )
-
-    exercises_list = list(exercises)
-    return exercises_list
+    return storage.find_exercises_named(normalized_query)
 
 
 def get_exercise(exercise_id: str):
@@ -166,7 +210,7 @@ def get_exercise(exercise_id: str):
     Retrieves the exercise record from the database that corresponds
     to the provided exercise ID.
     """
-    return exercises_collection.find_one({"_id": ObjectId(exercise_id)})
+    return storage.get_exercise(exercise_id)
 
 
 def get_todo():
@@ -174,7 +218,7 @@ def get_todo():
     Retrieves the current To-Do list for the logged-in user,
     including all pending exercise items.
     """
-    todo_list = todo_collection.find_one({"user_id": current_user.id})
+    todo_list = storage.get_todo_document(current_user.id)
     if todo_list and "todo" in todo_list:
         return todo_list["todo"]
     return []
@@ -185,11 +229,17 @@ def delete_todo(exercise_todo_id: int):
     Removes a specific exercise from the user's To-Do list by its ID.
     Returns True if successful, False otherwise.
     """
-    result = todo_collection.update_one(
-        {"user_id": current_user.id},
-        {"$pull": {"todo": {"exercise_todo_id": exercise_todo_id}}},
+    return storage.pull_todo_item(current_user.id, exercise_todo_id)
+
+
+def next_todo_id(todo_items) -> int:
+    """
+    Returns the id for a new To-Do item: one more than the largest existing id,
+    starting at 1000 for an empty list.
+    """
+    return (
+        max((item.get("exercise_todo_id", 999) for item in todo_items), default=999) + 1
     )
-    return result.modified_count > 0
 
 
 def add_todo(exercise_id: str, working_time=None, reps=None, weight=None):
@@ -197,21 +247,14 @@ def add_todo(exercise_id: str, working_time=None, reps=None, weight=None):
     Adds a new exercise to the user's To-Do list.
     Optional parameters include working time, repetitions, and weight.
     """
-    exercise = exercises_collection.find_one({"_id": ObjectId(exercise_id)})
+    exercise = storage.get_exercise(exercise_id)
 
     if exercise:
-        user_todo = todo_collection.find_one({"user_id": current_user.id})
-
-        if user_todo and "todo" in user_todo:
-            next_exercise_todo_id = (
-                max(
-                    (item.get("exercise_todo_id", 999) for item in user_todo["todo"]),
-                    default=999,
-                )
-                + 1
-            )
-        else:
-            next_exercise_todo_id = 1000
+        user_todo = storage.get_todo_document(current_user.id)
+
+        next_exercise_todo_id = next_todo_id(
+            user_todo["todo"] if user_todo and "todo" in user_todo else []
+        )
 
         exercise_item = {
             "exercise_todo_id": next_exercise_todo_id,
@@ -223,17 +266,11 @@ def add_todo(exercise_id: str, working_time=None, reps=None, weight=None):
         }
 
         if user_todo:
-            result = todo_collection.update_one(
-                {"user_id": current_user.id}, {"$push": {"todo": exercise_item}}
-            )
-            success = result.modified_count > 0
-        else:
-            result = todo_collection.insert_one(
-                {"user_id": current_user.id, "todo": [exercise_item]}
-            )
-            success = result.inserted_id is not None
-
-        return success
+            return storage.push_todo_item(current_user.id, exercise_item)
+        inserted_id = storage.insert_todo_document(
+            {"user_id": current_user.id, "todo": [exercise_item]}
+        )
+        return inserted_id is not None
     return False
 
 
@@ -246,60 +283,59 @@ def edit_exercise(exercise_todo_id, working_time, weight, reps):
     update_fields = {}
 
     if working_time is not None:
-        update_fields["todo.$.working_time"] = working_time
+        update_fields["working_time"] = working_time
     if reps is not None:
-        update_fields["todo.$.reps"] = reps
+        update_fields["reps"] = reps
     if weight is not None:
-        update_fields["todo.$.weight"] = weight
+        update_fields["weight"] = weight
 
     if not update_fields:
         return False
 
-    result = todo_collection.update_one(
-        {"user_id": current_user.id, "todo.exercise_todo_id": exercise_todo_id},
-        {"$set": update_fields},
-    )
-
-    return result.matched_count > 0
+    return storage.update_todo_item(current_user.id, exercise_todo_id, update_fields)
 
 
 def add_search_history(content):
     """
     Logs a search query made by the user into the search history database.
     Associates the search with the current user and records the timestamp.
+    The write happens in the background through search_history_buffer.
     """
     search_entry = {
         "user_id": current_user.id,
         "content": content,
         "time": datetime.utcnow(),
     }
-    search_history_collection.insert_one(search_entry)
+    search_history_buffer.put(search_entry)
 
 
 def insert_transcription_entry(user_id, content):
     """
-    Inserts a new transcription record into the edit_transcription_collection.
+    Queues a new transcription record for the edit_transcription collection.
+    Returns the record's id, generated here so it can be returned before the
+    write, or None if the write-behind queue is full.
+    A queued record is retried if its batch fails, but it is lost if every
+    retry fails or the process dies before the next flush.
     """
     edit_transcription_entry = {
+        "_id": ObjectId(),
         "user_id": user_id,
         "content": content,
         "time": datetime.utcnow(),
     }
-    result = edit_transcription_collection.insert_one(edit_transcription_entry)
-    return result.inserted_id if result.inserted_id else None
+    if transcription_buffer.put(edit_transcription_entry):
+        return edit_transcription_entry["_id"]
+    return None
 
 
-def get_search_history():
+def get_search_history(limit=None):
     """
     Retrieves the search history of the currently logged-in user,
-    sorted by the most recent searches.
+    sorted by the most recent searches, up to limit entries.
     """
-    results = search_history_collection.find(
-        {"user_id": current_user.id}, {"_id": 0, "user_id": 1, "content": 1, "time": 1}
-    ).sort("time", -1)
-
-    history = list(results)
-    return history
+    if limit is None:
+        limit = SEARCH_HISTORY_LIMIT
+    return storage.find_search_history(current_user.id, limit)
 
 
 def get_exercise_in_todo(exercise_todo_id: int):
@@ -307,7 +343,7 @@ def get_exercise_in_todo(exercise_todo_id: int):
     Finds a specific exercise in the user's To-Do list
     by its unique To-Do ID. Returns the exercise details if found.
     """
-    todo_item = todo_collection.find_one({"user_id": current_user.id})
+    todo_item = storage.get_todo_document(current_user.id)
 
     if not todo_item:
         return None
@@ -324,9 +360,7 @@ def get_instruction(exercise_id: str):
     Retrieves the instruction and workout name for the exercise with the given ID.
     Returns a message if the exercise or instructions are not found.
     """
-    exercise = exercises_collection.find_one(
-        {"_id": ObjectId(exercise_id)}, {"instruction": 1, "workout_name": 1}
-    )
+    exercise = storage.get_exercise(exercise_id, {"instruction": 1, "workout_name": 1})
 
     if exercise:
         return {
@@ -354,6 +388,42 @@ def get_matching_exercises_from_history():
     return matching_exercises_list
 
 
+def ping_storage():
+    """
+    Pings the storage backend; for MongoDB this opens the first pooled connection.
+    Returns True if the database answered.
+    """
+    try:
+        storage.ping()
+        return True
+    except ConnectionFailure as e:
+        logger.error("Failed to connect to MongoDB: %s", e)
+        return False
+
+
+@app.route("/ready")
+def ready():
+    """
+    Readiness check. Reports whether MongoDB answers a ping,
+    together with the connection pool counters.
+    """
+    is_ready = ping_storage()
+    return (
+        jsonify(
+            {
+                "status": "ready" if is_ready else "unavailable",
+                "pool": pool_monitor.snapshot(),
+                "write_behind": {
+                    "search_history": search_history_buffer.metrics(),
+                    "edit_transcription": transcription_buffer.metrics(),
+                },
+                "audio_conversions": conversion_scheduler.snapshot(),
+            }
+        ),
+        200 if is_ready else 503,
+    )
+
+
 @app.route("/")
 def home():
     """
@@ -371,6 +441,37 @@ def load_user(user_id):
     return User.get(user_id)
 
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(_error):
+    """413 for request bodies over MAX_CONTENT_LENGTH."""
+    return jsonify({"error": "Audio file is too large"}), 413
+
+
+def busy_response():
+    """503 returned when the password hashing pool is saturated."""
+    response = jsonify(
+        {"message": "Server is busy, please try again.", "success": False}
+    )
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+def upgrade_password_hash(user_data, password):
+    """
+    Rehashes a password stored with an older method or work factor.
+    Called after a successful login; failures leave the old hash in place.
+    """
+    if not needs_rehash(user_data["password"], PASSWORD_HASH_METHOD):
+        return
+    try:
+        new_hash = password_hasher.run(
+            generate_password_hash, password, method=PASSWORD_HASH_METHOD
+        )
+        storage.update_user(user_data["_id"], {"password": new_hash})
+    except (PasswordHashingBusy, PyMongoError) as e:
+        logger.warning("Password hash upgrade skipped: %s", e)
+
+
 @app.route("/register", methods=["POST"])
 def register():
     """
@@ -383,16 +484,19 @@ def register():
     if not username or not password:
         return jsonify({"message": "Username and password are required!"}), 400
 
-    if users_collection.find_one({"username": username}):
+    if storage.find_user_by_name(username):
         return jsonify({"message": "Username already exists!"}), 400
 
-    hashed_password = generate_password_hash(password, method="pbkdf2:sha256")
+    try:
+        hashed_password = password_hasher.run(
+            generate_password_hash, password, method=PASSWORD_HASH_METHOD
+        )
+    except PasswordHashingBusy:
+        return busy_response()
 
-    user_id = users_collection.insert_one(
-        {"username": username, "password": hashed_password}
-    ).inserted_id
+    user_id = storage.insert_user({"username": username, "password": hashed_password})
 
-    todo_collection.insert_one(
+    storage.insert_todo_document(
         {"user_id": str(user_id), "date": datetime.utcnow(), "todo": []}
     )
 
@@ -429,10 +533,19 @@ def login():
     username = request.form.get("username")
     password = request.form.get("password")
 
-    user_data = users_collection.find_one({"username": username})
+    user_data = storage.find_user_by_name(username)
 
-    if user_data and check_password_hash(user_data["password"], password):
+    try:
+        valid = user_data and password_hasher.run(
+            check_password_hash, user_data["password"], password
+        )
+    except PasswordHashingBusy:
+        return busy_response()
+
+    if valid:
+        upgrade_password_hash(user_data, password)
         user = User(str(user_data["_id"]), user_data["username"], user_data["password"])
+        regenerate_session_id(session)
         login_user(user)
         return jsonify({"message": "Login successful!", "success": True}), 200
     return jsonify({"message": "Invalid username or password!", "success": False}), 401
@@ -474,8 +587,24 @@ def search():
     return render_template("search.html", exercises=exercises)
 
 
+def todo_version():
+    """Version of the logged-in user's To-Do list, for conditional GETs."""
+    return storage.get_todo_version(current_user.get_id())
+
+
+def catalog_page_version():
+    """Version of the exercise catalog, for conditional GETs of catalog pages."""
+    return catalog_version.get()
+
+
+def search_results_version():
+    """The search results kept in the session, which the add page lists."""
+    return session.get("results", [])
+
+
 @app.route("/todo")
 @login_required
+@http_caching.conditional(todo_version)
 def todo():
     """
     Displays the user's To-Do list with all the exercises and their details.
@@ -484,8 +613,32 @@ def todo():
     return render_template("todo.html", exercises=exercises)
 
 
+@app.route("/api/todo")
+@login_required
+@http_caching.conditional(todo_version)
+def api_todo():
+    """
+    Returns the user's To-Do items as JSON, a page at a time.
+    Query parameters: limit, cursor (the next_cursor of the previous page),
+    fields (comma-separated item fields) and since (the version of the last sync).
+    """
+    try:
+        limit = int(request.args.get("limit", TODO_API_PAGE_SIZE))
+        if not 1 <= limit <= TODO_API_MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {TODO_API_MAX_PAGE_SIZE}")
+        fields = parse_fields(request.args.get("fields"))
+        since = request.args.get("since")
+        since = None if since is None else int(since)
+        document = storage.get_todo_document(current_user.id, fields)
+        page = todo_page(document, limit, request.args.get("cursor"), since)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
+
+
 @app.route("/delete_exercise")
 @login_required
+@http_caching.conditional(todo_version)
 def delete_exercise():
     """
     Renders a page to allow the user to select and delete exercises from the To-Do list.
@@ -508,6 +661,7 @@ def delete_exercise_id(exercise_todo_id):
 
 @app.route("/add")
 @login_required
+@http_caching.conditional(search_results_version)
 def add():
     """
     Displays a page where the user can add exercises to the To-Do list from search results.
@@ -527,20 +681,21 @@ def add_exercise():
     exercise_id = request.args.get("exercise_id")
 
     if not exercise_id:
-        print("No exercise ID provided")
+        logger.info("No exercise ID provided")
         return jsonify({"message": "Exercise ID is required"}), 400
 
     success = add_todo(exercise_id)
 
     if success:
-        print(f"Successfully added exercise with ID: {exercise_id}")
+        logger.info("Added exercise", extra={"exercise_id": exercise_id})
         return jsonify({"message": "Added successfully"}), 200
-    print(f"Failed to add exercise with ID: {exercise_id}")
+    logger.warning("Failed to add exercise", extra={"exercise_id": exercise_id})
     return jsonify({"message": "Failed to add"}), 400
 
 
 @app.route("/edit", methods=["GET", "POST"])
 @login_required
+@http_caching.conditional(todo_version)
 def edit():
     """
     Enables the user to edit an exercise's details in the To-Do list, such as time, reps, or weight.
@@ -563,6 +718,7 @@ def edit():
 
 
 @app.route("/instructions", methods=["GET"])
+@http_caching.conditional(catalog_page_version)
 def instructions():
     """
     Fetches and displays detailed instructions for a specific exercise chosen by the user.
@@ -573,6 +729,40 @@ def instructions():
     return render_template("instructions.html", exercise=exercise)
 
 
+def conversion_busy_response():
+    """503 returned when no audio conversion slot is free."""
+    response = jsonify({"error": "Server is busy, please try again."})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+def convert_audio(audio):
+    """
+    Streams an uploaded file into audio the speech-to-text service can read.
+    Raises AudioTooLarge, AudioConversionError or ConversionBusy.
+    """
+    with tracer.span("convert audio") as span:
+        upload = convert_upload(
+            audio.stream,
+            app.config["AUDIO_MAX_BYTES"],
+            FFMPEG_TIMEOUT,
+            conversion_scheduler,
+        )
+        if span:
+            span.set_attribute("audio.bytes", upload.size)
+            span.set_attribute("audio.converted", upload.converted)
+    logger.info(
+        "Received %d bytes of audio",
+        upload.size,
+        extra={
+            "audio_bytes": upload.size,
+            "audio_sha256": upload.sha256,
+            "audio_converted": upload.converted,
+        },
+    )
+    return upload.content
+
+
 @app.route("/upload-audio", methods=["POST"])
 def upload_audio():
     """
@@ -582,73 +772,45 @@ def upload_audio():
     if "audio" not in request.files:
         return jsonify({"error": "No audio file uploaded"}), 400
 
-    audio = request.files["audio"]
-    original_file_path = os.path.join(app.config["UPLOAD_FOLDER"], audio.filename)
-    audio.save(original_file_path)
-
-    wav_file_path = os.path.splitext(original_file_path)[0] + "_converted.wav"
     try:
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                original_file_path,
-                "-ar",
-                "16000",
-                "-ac",
-                "1",
-                wav_file_path,
-            ],
-            check=True,
-        )
-    except subprocess.CalledProcessError as e:
-        print(f"Error converting audio to WAV: {e}")
+        audio_content = convert_audio(request.files["audio"])
+    except AudioTooLarge as e:
+        logger.warning("Rejected audio upload: %s", e)
+        return jsonify({"error": "Audio file is too large"}), 413
+    except AudioConversionError as e:
+        logger.error("Error converting audio to WAV: %s", e)
         return jsonify({"error": "Failed to convert audio file"}), 500
+    except ConversionBusy as e:
+        logger.warning("Rejected audio upload: %s", e)
+        return conversion_busy_response()
 
-    transcription = call_speech_to_text_service(wav_file_path)
+    transcription = call_speech_to_text_service(audio_content)
     if not transcription:
         return jsonify({"error": "Failed to transcribe audio"}), 500
     return jsonify({"transcription": transcription})
 
 
-def call_speech_to_text_service(file_path):
+def call_speech_to_text_service(audio_content):
     """
-    Sends the uploaded audio file to a remote speech-to-text service for transcription.
+    Sends the uploaded audio to a remote speech-to-text service for transcription.
     Returns the transcription or an error message if the service fails.
     """
-    url = "http://machine-learning-client:8080/transcribe"
-    data = {"audio_file": file_path}
-    headers = {"Content-Type": "application/json"}
+    url = SPEECH_TO_TEXT_URL
+    headers = {"Content-Type": "application/octet-stream"}
     try:
-        response = requests.post(url, json=data, headers=headers, timeout=10)
-        response.raise_for_status()
+        with tracer.span("POST /transcribe", KIND_CLIENT, **{"http.url": url}):
+            headers.update(tracer.headers())
+            headers.update(request_id_headers())
+            response = requests.post(
+                url, data=audio_content, headers=headers, timeout=10
+            )
+            response.raise_for_status()
         return response.json().get("transcript", "No transcription returned")
     except requests.RequestException as e:
-        print(f"Error communicating with the Speech-to-Text service: {e}")
+        logger.error("Error communicating with the Speech-to-Text service: %s", e)
         return "Error during transcription"
 
 
-def parse_voice_command(transcription):
-    """
-    Parses the transcription to extract time, group count, and weight parameters.
-    Returns a dictionary with these extracted values.
-    """
-
-    time_match = re.search(r"\b(\d+)\s*minutes?\b", transcription, re.IGNORECASE)
-    time_params = int(time_match.group(1)) if time_match else None
-
-    group_match = re.search(r"\b(\d+)\s*groups?\b", transcription, re.IGNORECASE)
-    groups = int(group_match.group(1)) if group_match else None
-
-    weight_match = re.search(
-        r"\b(\d+)\s*(kg|kgs|kilogram|kilograms)?\b", transcription, re.IGNORECASE
-    )
-    weight = int(weight_match.group(1)) if weight_match else None
-
-    return {"time": time_params, "groups": groups, "weight": weight}
-
-
 @app.route("/process-audio", methods=["POST"])
 @login_required
 def process_audio():
@@ -660,35 +822,24 @@ def process_audio():
     if "audio" not in request.files:
         return jsonify({"error": "No audio file uploaded"}), 400
 
-    audio = request.files["audio"]
-    original_file_path = os.path.join(app.config["UPLOAD_FOLDER"], audio.filename)
-    audio.save(original_file_path)
-
-    wav_file_path = os.path.splitext(original_file_path)[0] + "_converted.wav"
     try:
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-y",
-                "-i",
-                original_file_path,
-                "-ar",
-                "16000",
-                "-ac",
-                "1",
-                wav_file_path,
-            ],
-            check=True,
-        )
-    except subprocess.CalledProcessError as e:
-        print(f"Error converting audio to WAV: {e}")
+        audio_content = convert_audio(request.files["audio"])
+    except AudioTooLarge as e:
+        logger.warning("Rejected audio upload: %s", e)
+        return jsonify({"error": "Audio file is too large"}), 413
+    except AudioConversionError as e:
+        logger.error("Error converting audio to WAV: %s", e)
         return jsonify({"error": "Failed to convert audio file"}), 500
+    except ConversionBusy as e:
+        logger.warning("Rejected audio upload: %s", e)
+        return conversion_busy_response()
 
-    transcription = call_speech_to_text_service(wav_file_path)
+    transcription = call_speech_to_text_service(audio_content)
     if not transcription:
         return jsonify({"error": "Failed to transcribe audio"}), 500
 
-    parsed_data = parse_voice_command(transcription)
+    with tracer.span("parse voice command"):
+        parsed_data = parse_voice_command(transcription)
     if not parsed_data:
         return (
             jsonify(
@@ -708,7 +859,8 @@ def process_audio():
     if not exercise_todo_id:
         return jsonify({"error": "Exercise To-Do ID is required"}), 400
 
-    success = edit_exercise(exercise_todo_id, working_time, weight, groups)
+    with tracer.span("update exercise"):
+        success = edit_exercise(exercise_todo_id, working_time, weight, groups)
     if not success:
         return jsonify({"error": "Failed to update exercise"}), 500
 
@@ -729,7 +881,8 @@ def process_audio():
 def upload_transcription():
     # pylint: disable=too-many-return-statements
     """
-    Processes uploaded transcription data and saves it to MongoDB.
+    Processes uploaded transcription data and queues it to be saved to MongoDB.
+    Answers 202 with the record's id once it is queued, before it is written.
     """
     try:
         if not request.is_json:
@@ -747,24 +900,21 @@ def upload_transcription():
                 401,
             )
 
-        inserted_id = insert_transcription_entry(current_user.id, transcription_content)
+        queued_id = insert_transcription_entry(current_user.id, transcription_content)
 
-        if inserted_id:
+        if queued_id:
             return (
-                jsonify(
-                    {
-                        "message": "Transcription saved successfully!",
-                        "id": str(inserted_id),
-                    }
-                ),
-                200,
+                jsonify({"message": "Transcription queued", "id": str(queued_id)}),
+                202,
             )
-        return jsonify({"error": "Failed to save transcription"}), 500
+        response = jsonify({"error": "Too many transcriptions waiting to be saved"})
+        response.headers["Retry-After"] = "1"
+        return response, 503
     except BadRequest as e:
         return jsonify({"error": str(e)}), 400
-    except PyMongoError as e:
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
 
 
 if __name__ == "__main__":
+    if ping_storage():
+        logger.info("Successfully connected to MongoDB!")
     app.run(host="0.0.0.0", port=5001)
@@ -0,0 +1,264 @@
+"""
+This module turns an uploaded audio stream into audio the speech-to-text
+service can read, without writing it to disk. The upload is read in chunks, and
+each chunk is counted against the size limit and hashed as it passes. FLAC,
+Ogg/WebM Opus and 16-bit PCM WAV uploads are collected in memory as they are.
+Ogg and WebM holding any other codec, such as Vorbis, count as non-native.
+Anything else is piped into ffmpeg's stdin while the 16 kHz mono PCM it writes
+to stdout is read back into memory and given a WAV header.
+"""
+
+import hashlib
+import struct
+import subprocess
+import threading
+from contextlib import nullcontext
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+# Room for the multipart boundaries and part headers around an upload.
+MULTIPART_OVERHEAD = 64 * 1024
+# Enough to tell every native format apart, including the WAV sample width
+# and the OpusHead packet that opens an Ogg Opus stream at byte 28.
+HEADER_SIZE = 36
+WEBM_SIGNATURE = b"\x1a\x45\xdf\xa3"
+# How far into a WebM upload the speech-to-text service looks for OpusHead.
+WEBM_PROBE_SIZE = 4096
+SAMPLE_RATE = 16000
+# Raw PCM rather than WAV: ffmpeg cannot seek back on a pipe to fill in the
+# WAV header's sizes, so the header is written here once the length is known.
+# One thread per conversion, as the scheduler runs one conversion per core.
+FFMPEG_COMMAND = [
+    "ffmpeg",
+    "-hide_banner",
+    "-loglevel",
+    "error",
+    "-threads",
+    "1",
+    "-i",
+    "pipe:0",
+    "-ar",
+    str(SAMPLE_RATE),
+    "-ac",
+    "1",
+    "-f",
+    "s16le",
+    "pipe:1",
+]
+
+
+class AudioTooLarge(Exception):
+    """Raised when an upload, or the audio decoded from it, exceeds the limit."""
+
+
+class AudioConversionError(Exception):
+    """Raised when ffmpeg cannot be run or fails to convert the upload."""
+
+
+class AudioUpload:  # pylint: disable=too-few-public-methods
+    """Audio ready for the speech-to-text service, with facts about the upload."""
+
+    def __init__(self, content, size, sha256, converted):
+        self.content = content
+        self.size = size
+        self.sha256 = sha256
+        self.converted = converted
+
+
+class InMemoryUploadRequest(Request):
+    """
+    Request class that keeps uploaded files in memory, where werkzeug would
+    spool anything over 500 KiB to a temp file. Together with the app's
+    MAX_CONTENT_LENGTH, which rejects larger bodies before they are read, no
+    upload reaches the disk.
+    """
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        max_size = current_app.config.get("MAX_CONTENT_LENGTH") or (
+            current_app.config.get("AUDIO_MAX_BYTES", DEFAULT_MAX_BYTES)
+            + MULTIPART_OVERHEAD
+        )
+        # pylint: disable=consider-using-with
+        return SpooledTemporaryFile(max_size=max_size, mode="rb+")
+
+
+def is_native_audio(header):
+    """
+    Checks whether the speech-to-text service can read audio with this header.
+    FLAC, Ogg/WebM Opus and 16-bit PCM WAV carry the header the service needs.
+    A WebM header must be read up to WEBM_PROBE_SIZE bytes to be recognized.
+    """
+    if header.startswith(b"fLaC"):
+        return True
+    if header.startswith(b"OggS"):
+        return header[28:36] == b"OpusHead"
+    if header.startswith(WEBM_SIGNATURE):
+        return b"A_OPUS" in header and b"OpusHead" in header
+    return (
+        header[:4] == b"RIFF"
+        and header[8:16] == b"WAVEfmt "
+        and header[20:22] == b"\x01\x00"
+        and header[34:36] == b"\x10\x00"
+    )
+
+
+class MeteredStream:
+    """Reads a stream in chunks, hashing them and enforcing max_bytes."""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    def read(self, size=CHUNK_SIZE):
+        """The next chunk, or b"" at the end. Raises AudioTooLarge past the limit."""
+        chunk = self.stream.read(size)
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise AudioTooLarge(f"Audio upload exceeds {self.max_bytes} bytes")
+        self.digest.update(chunk)
+        return chunk
+
+    def chunks(self):
+        """Yields the remaining chunks."""
+        while True:
+            chunk = self.read()
+            if not chunk:
+                return
+            yield chunk
+
+
+def wav_header(data_size, sample_rate=SAMPLE_RATE):
+    """The 44-byte header of a mono 16-bit PCM WAV file."""
+    return b"RIFF" + struct.pack(
+        "<I4s4sIHHIIHH4sI",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        1,
+        sample_rate,
+        sample_rate * 2,
+        2,
+        16,
+        b"data",
+        data_size,
+    )
+
+
+def read_header(stream, size=HEADER_SIZE):
+    """Reads up to size bytes, even from a stream that returns less."""
+    header = b""
+    while len(header) < size:
+        chunk = stream.read(size - len(header))
+        if not chunk:
+            break
+        header += chunk
+    return header
+
+
+def feed_ffmpeg(process, header, stream, failure):
+    """Writes the upload to ffmpeg's stdin, killing ffmpeg if reading fails."""
+    try:
+        process.stdin.write(header)
+        for chunk in stream.chunks():
+            process.stdin.write(chunk)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its exit status reports why.
+    except Exception as e:  # pylint: disable=broad-except
+        failure.append(e)
+        process.kill()
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def run_ffmpeg(header, stream, max_bytes, timeout):
+    """
+    Pipes the upload through ffmpeg and returns its output as WAV. The upload is
+    written from a helper thread, so ffmpeg never waits on a full pipe.
+    """
+    try:
+        # pylint: disable=consider-using-with
+        process = subprocess.Popen(
+            FFMPEG_COMMAND,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError as e:
+        raise AudioConversionError(f"Cannot run ffmpeg: {e}") from e
+
+    failure = []
+    errors = []
+    threads = [
+        threading.Thread(
+            target=feed_ffmpeg, args=(process, header, stream, failure), daemon=True
+        ),
+        threading.Thread(
+            target=lambda: errors.append(process.stderr.read()), daemon=True
+        ),
+    ]
+    timer = threading.Timer(timeout, process.kill)
+    for thread in threads:
+        thread.start()
+    timer.start()
+    output = bytearray()
+    try:
+        while True:
+            chunk = process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            output += chunk
+            if len(output) > max_bytes:
+                raise AudioTooLarge(f"Converted audio exceeds {max_bytes} bytes")
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.wait()
+        timer.cancel()
+        for thread in threads:
+            thread.join()
+        process.stdout.close()
+        process.stderr.close()
+
+    if failure:
+        raise failure[0]
+    if process.returncode != 0:
+        message = (errors[0] if errors else b"").decode(errors="replace").strip()
+        raise AudioConversionError(
+            f"ffmpeg exited with {process.returncode}: {message or 'killed'}"
+        )
+    return wav_header(len(output)) + bytes(output)
+
+
+def convert_upload(stream, max_bytes, timeout=30.0, scheduler=None):
+    """
+    Reads an upload stream into audio the speech-to-text service can read,
+    converting it with ffmpeg when needed. Raises AudioTooLarge when the upload
+    or the converted audio is over max_bytes, and AudioConversionError when
+    ffmpeg fails or runs longer than timeout seconds. With a scheduler, ffmpeg
+    only starts once it grants a slot; it raises ConversionBusy otherwise.
+    """
+    metered = MeteredStream(stream, max_bytes)
+    header = read_header(metered)
+    if header.startswith(WEBM_SIGNATURE):
+        header += read_header(metered, WEBM_PROBE_SIZE - len(header))
+    if is_native_audio(header):
+        content = header + b"".join(metered.chunks())
+        converted = False
+    else:
+        with scheduler.slot() if scheduler else nullcontext():
+            content = run_ffmpeg(header, metered, max_bytes, timeout)
+        converted = True
+    return AudioUpload(content, metered.size, metered.digest.hexdigest(), converted)
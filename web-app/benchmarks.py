@@ -0,0 +1,217 @@
+"""
+Micro-benchmarks for the pure functions on the web app's request path.
+Each case runs its function over a batch of realistic inputs, so that one call
+takes tens of microseconds or more, well above timer noise. It is timed as the
+best of several rounds and divided by the best time of a fixed reference loop
+timed in between, so baselines recorded on one machine stay comparable on
+another. Every case is run in several passes and keeps its fastest, so one
+noisy pass cannot fail the run. A run fails when any case is slower than its
+baseline by more than the threshold.
+
+Usage: python benchmarks.py [--save] [--threshold 0.25] [--passes 3]
+                            [--baseline FILE] [-k NAME]
+"""
+
+import argparse
+import json
+import sys
+import timeit
+
+from app import next_todo_id, normalize_text
+from storage import matching_query, named_query
+from voice_command import parse_voice_command
+
+BASELINE_PATH = "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_PASSES = 3
+
+# Searches as users type them, repeated to make a batch of 100.
+SHORT_QUERIES = [
+    "Push-Up",
+    "squat",
+    "bench press",
+    "Pull up",
+    "deadlift",
+    "lunge",
+    "Bicep-Curl",
+    "plank",
+    "leg press",
+    "benchpress",
+] * 10
+LONG_QUERIES = [
+    "Single-Arm  Dumbbell Bent Over Row with Pause - Alternating " * 4,
+    "Barbell Romanian Dead-Lift with Deficit and Tempo - Three Second Lower " * 3,
+    "Cable Seated Row - Wide Grip - Pause at the Top, Slow Negative " * 4,
+] * 10
+SHORT_COMMANDS = [
+    "Set 20 kg for 40 minutes and 2 groups.",
+    "ten reps with 20 kg",
+    "set time to 5 minutes and 3 sets",
+    "four sets of 12 pounds for two minutes",
+] * 5
+LONG_TRANSCRIPTIONS = [
+    "okay so for this one I want to set the time to fifteen minutes, "
+    "do four sets, um actually make that five groups, and the weight should be "
+    "twenty five kilograms, no wait, forty pounds, thanks",
+    "alright let's change this to three groups of twelve, with the dumbbells at "
+    "seventeen and a half kilos, and give me about eight minutes for the whole "
+    "thing, actually make it ten minutes",
+] * 3
+
+
+def todo_items(count):
+    """A To-Do list with count items, as stored in the todo collection."""
+    return [
+        {"exercise_todo_id": 1000 + i, "workout_name": "Push-Up", "reps": "3"}
+        for i in range(count)
+    ]
+
+
+def batch(func, inputs):
+    """A benchmark that calls func once for each of inputs."""
+    return lambda: [func(value) for value in inputs]
+
+
+def benchmark_cases():
+    """Returns {name: zero-argument function} for every benchmark."""
+    # As many To-Do lists of each size as keep one call near 100 us.
+    small_todos = [todo_items(10)] * 100
+    medium_todos = [todo_items(100)] * 20
+    large_todos = [todo_items(1000)] * 4
+    return {
+        "normalize_text/short": batch(normalize_text, SHORT_QUERIES),
+        "normalize_text/long": batch(normalize_text, LONG_QUERIES),
+        "parse_voice_command/short": batch(parse_voice_command, SHORT_COMMANDS),
+        "parse_voice_command/long": batch(parse_voice_command, LONG_TRANSCRIPTIONS),
+        "matching_query": batch(matching_query, SHORT_QUERIES),
+        "named_query": batch(named_query, SHORT_QUERIES),
+        "next_todo_id/10": batch(next_todo_id, small_todos),
+        "next_todo_id/100": batch(next_todo_id, medium_todos),
+        "next_todo_id/1000": batch(next_todo_id, large_todos),
+    }
+
+
+def reference_workload():
+    """Fixed pure-Python loop used to normalize timings across machines."""
+    return sum(i * i for i in range(1000))
+
+
+def _calibrated(func, round_time):
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    return timer, max(1, int(number * round_time / elapsed)) if elapsed else number
+
+
+def measure(func, rounds=20, round_time=0.01):
+    """
+    Times func in rounds alternating with the reference loop, so both see the
+    same machine load. Returns (best seconds per call, best relative to reference).
+    """
+    reference, reference_number = _calibrated(reference_workload, round_time)
+    timer, number = _calibrated(func, round_time)
+    best_reference = best = float("inf")
+    for _ in range(rounds):
+        best_reference = min(
+            best_reference, reference.timeit(reference_number) / reference_number
+        )
+        best = min(best, timer.timeit(number) / number)
+    return best, best / best_reference
+
+
+def run(cases, rounds=20, passes=1):
+    """
+    Times the cases in passes, keeping each case's fastest pass. Returns a
+    results dict in the baseline file format.
+    """
+    results = []
+    for _ in range(passes):
+        benchmarks = {}
+        for name, func in cases.items():
+            seconds, relative = measure(func, rounds)
+            benchmarks[name] = {"seconds": seconds, "relative": relative}
+        results.append({"benchmarks": benchmarks})
+    return fastest(*results)
+
+
+def fastest(*results):
+    """Merges result dicts, keeping each benchmark's fastest relative time."""
+    merged = {}
+    for result in results:
+        for name, current in result["benchmarks"].items():
+            if name not in merged or current["relative"] < merged[name]["relative"]:
+                merged[name] = current
+    return {"benchmarks": merged}
+
+
+def compare(baseline, results, threshold):
+    """
+    Returns (lines, regressions): a report line per benchmark and the names
+    slower than the baseline by more than threshold (0.25 = 25%).
+    """
+    lines, regressions = [], []
+    for name, current in results["benchmarks"].items():
+        before = baseline.get("benchmarks", {}).get(name)
+        per_call = f"{current['seconds'] * 1e6:10.2f} us"
+        if before is None:
+            lines.append(f"{name:<28}{per_call}   (no baseline)")
+            continue
+        change = current["relative"] / before["relative"] - 1
+        marker = ""
+        if change > threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        lines.append(f"{name:<28}{per_call}   {change:+7.1%}{marker}")
+    return lines, regressions
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--save", action="store_true", help="record a new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--passes", type=int, default=DEFAULT_PASSES)
+    parser.add_argument("-k", dest="only", help="run cases whose name contains this")
+    args = parser.parse_args()
+
+    cases = {
+        name: func
+        for name, func in benchmark_cases().items()
+        if not args.only or args.only in name
+    }
+    # The baseline keeps the fastest pass too, so both sides of the
+    # comparison are measured the same way.
+    results = run(cases, args.rounds, args.passes)
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved {len(cases)} baselines to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+        print(f"No baseline at {args.baseline}; run with --save to record one")
+    lines, regressions = compare(baseline, results, args.threshold)
+    if regressions:
+        # Re-time suspected regressions so a burst of machine load during
+        # one stretch of the run does not fail it.
+        retry = run(
+            {name: cases[name] for name in regressions}, args.rounds, args.passes
+        )
+        results = fastest(results, retry)
+        lines, regressions = compare(baseline, results, args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
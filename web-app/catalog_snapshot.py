@@ -0,0 +1,244 @@
+"""
+Compact, memory-mapped snapshot of the exercise catalog.
+
+Layout (little-endian):
+    magic "EXSNAP01" | u32 header length | JSON header
+    | ids: 12-byte ObjectIds, sorted | offsets: u64 per record, plus the end
+    | names: NUL-separated stripped workout names | records: BSON documents
+
+Workers map the file at boot and answer catalog searches and instruction
+lookups from it, checking in the background that the snapshot still matches
+the live collection and rebuilding it when it does not.
+
+Usage: python catalog_snapshot.py [path]
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+import bson
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from mongo_pool import create_mongo_client
+from storage import MongoStorage, project, strip_name
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"EXSNAP01"
+PREFIX = struct.Struct("<8sI")
+ID_SIZE = 12
+
+
+def write_snapshot(path, exercises, version):
+    """
+    Writes the exercises (an iterable in any order) and the catalog version
+    to path. The file is replaced atomically so readers never see a partial one.
+    """
+    exercises = sorted(exercises, key=lambda exercise: exercise["_id"])
+    records = [bson.encode(exercise) for exercise in exercises]
+    names = "\0".join(
+        strip_name(exercise.get("workout_name", "")) for exercise in exercises
+    ).encode("utf-8")
+
+    offsets = [0]
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    header = json.dumps(
+        {"version": version, "count": len(records), "names_size": len(names)}
+    ).encode("utf-8")
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        f.write(b"".join(exercise["_id"].binary for exercise in exercises))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.write(names)
+        f.write(b"".join(records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CatalogSnapshot:  # pylint: disable=too-many-instance-attributes
+    """Read-only view of a snapshot file, decoded lazily from the memory map."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        magic, header_size = PREFIX.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        position = PREFIX.size
+        header = json.loads(bytes(view[position : position + header_size]))
+        position += header_size
+
+        self.version = header["version"]
+        self.count = header["count"]
+        self._ids = view[position : position + ID_SIZE * self.count]
+        position += ID_SIZE * self.count
+        self._offsets = view[position : position + 8 * (self.count + 1)].cast("Q")
+        position += 8 * (self.count + 1)
+        names = bytes(view[position : position + header["names_size"]])
+        self.names = names.decode("utf-8").split("\0") if self.count else []
+        self._records = view[position + header["names_size"] :]
+        self._lower_names = [name.lower() for name in self.names]
+
+    def record(self, index):
+        """Decodes the record at the given position."""
+        return bson.decode(
+            self._records[self._offsets[index] : self._offsets[index + 1]]
+        )
+
+    def index_of(self, object_id):
+        """Binary search over the sorted ids. Returns the position or None."""
+        target = ObjectId(object_id).binary
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            current = self._ids[middle * ID_SIZE : (middle + 1) * ID_SIZE].tobytes()
+            if current < target:
+                low = middle + 1
+            elif current > target:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def find_matching(self, normalized_query):
+        """Exercises whose stripped name matches the query as a regex."""
+        pattern = re.compile(normalized_query, re.IGNORECASE)
+        return [
+            self.record(i) for i, name in enumerate(self.names) if pattern.search(name)
+        ]
+
+    def find_named(self, normalized_query):
+        """Exercises whose stripped, lowercased name equals the query."""
+        return [
+            self.record(i)
+            for i, name in enumerate(self._lower_names)
+            if name == normalized_query
+        ]
+
+    def get(self, exercise_id, projection=None):
+        """The exercise with the given id, or None."""
+        index = self.index_of(exercise_id)
+        if index is None:
+            return None
+        return project(self.record(index), projection)
+
+
+class SnapshotStorage:
+    """
+    Wraps a storage backend and serves catalog reads from a snapshot while it
+    matches the live catalog. Everything else goes to the backend.
+    """
+
+    def __init__(self, backend, path, check_interval=300.0):
+        self.backend = backend
+        self.path = path
+        self.check_interval = check_interval
+        self.snapshot = None
+        self.fresh = False
+        self._checked_at = None
+        self._checking = threading.Lock()
+        if os.path.exists(path):
+            try:
+                self.snapshot = CatalogSnapshot(path)
+                self.fresh = True
+            except (OSError, ValueError) as e:
+                logger.warning("Ignoring catalog snapshot %s: %s", path, e)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def refresh(self):
+        """Rebuilds the snapshot from the backend and maps the new file."""
+        version = self.backend.catalog_version()
+        write_snapshot(self.path, self.backend.iter_exercises(), version)
+        self.snapshot = CatalogSnapshot(self.path)
+        self.fresh = True
+
+    def check_version(self):
+        """Compares the snapshot with the live catalog and refreshes it if stale."""
+        if self.snapshot is None or (
+            self.snapshot.version != self.backend.catalog_version()
+        ):
+            self.fresh = False
+            self.refresh()
+
+    def _check_in_background(self):
+        try:
+            self.check_version()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Catalog snapshot check failed: %s", e)
+        finally:
+            self._checking.release()
+
+    def _maybe_check(self):
+        now = time.monotonic()
+        if (
+            self._checked_at is not None
+            and now - self._checked_at < self.check_interval
+        ):
+            return
+        # Released by the checking thread once it finishes.
+        # pylint: disable-next=consider-using-with
+        if self._checking.acquire(blocking=False):
+            self._checked_at = now
+            threading.Thread(target=self._check_in_background, daemon=True).start()
+
+    def _current(self):
+        self._maybe_check()
+        return self.snapshot if self.fresh else None
+
+    def find_exercises_matching(self, normalized_query: str):
+        """Returns exercises whose stripped name matches the query as a regex."""
+        snapshot = self._current()
+        if snapshot is None:
+            return self.backend.find_exercises_matching(normalized_query)
+        return snapshot.find_matching(normalized_query)
+
+    def find_exercises_named(self, normalized_query: str):
+        """Returns exercises whose stripped, lowercased name equals the query."""
+        snapshot = self._current()
+        if snapshot is None:
+            return self.backend.find_exercises_named(normalized_query)
+        return snapshot.find_named(normalized_query)
+
+    def get_exercise(self, exercise_id: str, projection=None):
+        """Returns the exercise with the given id, or None."""
+        snapshot = self._current()
+        if snapshot is None:
+            return self.backend.get_exercise(exercise_id, projection)
+        return snapshot.get(exercise_id, projection)
+
+
+def main():
+    """Command line entry point: exports the live catalog to a snapshot file."""
+    parser = argparse.ArgumentParser(description="Export the exercise catalog.")
+    parser.add_argument("path", nargs="?", default="catalog.snapshot")
+    args = parser.parse_args()
+
+    load_dotenv()
+    backend = MongoStorage(create_mongo_client(os.getenv("MONGO_URI")))
+    started = time.perf_counter()
+    write_snapshot(args.path, backend.iter_exercises(), backend.catalog_version())
+    snapshot = CatalogSnapshot(args.path)
+    print(
+        f"Wrote {snapshot.count} exercises to {args.path} "
+        f"({os.path.getsize(args.path)} bytes) in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+This module limits how many ffmpeg conversions run at once.
+A burst of uploads that all started ffmpeg immediately would oversubscribe the
+container's CPUs and slow every conversion down. Instead, at most one
+conversion per available core runs, a bounded number more wait for a slot, and
+the rest are rejected at once. Waiting conversions give up after a timeout.
+Queue depth, waits and run times are recorded in the /metrics registry.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from request_metrics import LATENCY_BUCKETS
+
+CONVERSION_METRICS = {
+    "audio_conversions_waiting": (
+        "gauge",
+        "Audio conversions waiting for a slot.",
+        None,
+    ),
+    "audio_conversions_running": ("gauge", "Audio conversions running.", None),
+    "audio_conversion_wait_seconds": (
+        "histogram",
+        "Time a conversion waited for a slot.",
+        (0.001,) + LATENCY_BUCKETS,
+    ),
+    "audio_conversion_duration_seconds": (
+        "histogram",
+        "Time ffmpeg took to convert one upload.",
+        LATENCY_BUCKETS,
+    ),
+    "audio_conversions_rejected_total": (
+        "counter",
+        "Conversions turned away, by reason (queue_full or timeout).",
+        None,
+    ),
+}
+
+
+class ConversionBusy(Exception):
+    """Raised when no conversion slot is free within the wait limit."""
+
+
+def available_cpus(cgroup_cpu_max="/sys/fs/cgroup/cpu.max"):
+    """
+    Number of CPUs this process may use: the cgroup v2 quota when one is set,
+    otherwise the CPUs in its affinity mask.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open(cgroup_cpu_max, encoding="utf-8") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+class ConversionScheduler:  # pylint: disable=too-many-instance-attributes
+    """
+    Admits at most max_running conversions at once, with at most max_queue more
+    waiting up to wait_timeout seconds for a slot.
+    """
+
+    def __init__(self, max_running, max_queue=8, wait_timeout=5.0, metrics=None):
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self.metrics = metrics
+        self._running = threading.BoundedSemaphore(max_running)
+        self._admitted = threading.BoundedSemaphore(max_running + max_queue)
+        self._lock = threading.Lock()
+        self._counts = {"waiting": 0, "running": 0, "rejected": 0}
+
+    def _record(self, counter, amount, metric=None, labels=()):
+        with self._lock:
+            self._counts[counter] += amount
+        if self.metrics is not None and metric:
+            self.metrics.inc(metric, labels, amount)
+
+    def _observe(self, metric, value):
+        if self.metrics is not None:
+            self.metrics.observe(metric, value)
+
+    def _reject(self, reason, message):
+        self._record(
+            "rejected", 1, "audio_conversions_rejected_total", (("reason", reason),)
+        )
+        raise ConversionBusy(message)
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds a conversion slot for the body of the with block.
+        Raises ConversionBusy if the queue is full or the wait times out.
+        """
+        # Released below once the conversion has finished.
+        # pylint: disable-next=consider-using-with
+        if not self._admitted.acquire(blocking=False):
+            self._reject("queue_full", "Too many audio conversions waiting")
+        try:
+            self._record("waiting", 1, "audio_conversions_waiting")
+            started = time.perf_counter()
+            try:
+                acquired = self._running.acquire(timeout=self.wait_timeout)
+            finally:
+                self._record("waiting", -1, "audio_conversions_waiting")
+            self._observe(
+                "audio_conversion_wait_seconds", time.perf_counter() - started
+            )
+            if not acquired:
+                self._reject("timeout", "Timed out waiting for an audio conversion")
+            self._record("running", 1, "audio_conversions_running")
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._observe(
+                    "audio_conversion_duration_seconds", time.perf_counter() - started
+                )
+                self._record("running", -1, "audio_conversions_running")
+                self._running.release()
+        finally:
+            self._admitted.release()
+
+    def snapshot(self):
+        """Current waiting, running and rejected counts, with the limits."""
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            "max_running": self.max_running,
+            "max_queue": self.max_queue,
+        }
+
+
+def create_conversion_scheduler(metrics=None, environ=None):
+    """
+    Builds the scheduler from FFMPEG_MAX_RUNNING (default: the available CPUs),
+    FFMPEG_MAX_QUEUE (default 8) and FFMPEG_QUEUE_TIMEOUT in seconds (default 5).
+    """
+    environ = os.environ if environ is None else environ
+    return ConversionScheduler(
+        max_running=int(environ.get("FFMPEG_MAX_RUNNING") or available_cpus()),
+        max_queue=int(environ.get("FFMPEG_MAX_QUEUE", "8")),
+        wait_timeout=float(environ.get("FFMPEG_QUEUE_TIMEOUT", "5")),
+        metrics=metrics,
+    )
@@ -0,0 +1,174 @@
+"""
+This module attributes MongoDB commands to the Flask request that issued them.
+A pymongo CommandListener counts each request's commands and database time,
+and flags requests that repeat the same query shape many times (an N+1 pattern).
+Commands issued outside a request, e.g. by the write-behind threads, are ignored.
+"""
+
+import contextvars
+import json
+import logging
+import os
+from collections import Counter
+
+from flask import request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Command fields that describe a query's shape; inserted documents do not.
+SHAPE_FIELDS = (
+    "filter",
+    "query",
+    "sort",
+    "projection",
+    "pipeline",
+    "updates",
+    "deletes",
+)
+
+DB_METRICS = {
+    "mongodb_commands_per_request": (
+        "histogram",
+        "MongoDB commands issued by one request.",
+        (0, 1, 2, 5, 10, 20, 50, 100),
+    ),
+    "mongodb_time_per_request_seconds": (
+        "histogram",
+        "Time one request spent waiting on MongoDB.",
+        (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+    ),
+    "mongodb_repeated_queries_total": (
+        "counter",
+        "Requests that repeated one query shape more than the threshold.",
+        None,
+    ),
+}
+
+
+def value_shape(value):
+    """Replaces the literal values in a query with "?", keeping keys and operators."""
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [value_shape(value[0])] if value else []
+    return "?"
+
+
+def query_shape(command_name, command):
+    """Returns a string identifying the command, collection and query shape."""
+    fields = {field: command[field] for field in SHAPE_FIELDS if field in command}
+    return json.dumps(
+        [command_name, str(command.get(command_name, "")), value_shape(fields)],
+        sort_keys=True,
+    )
+
+
+class RequestQueries:  # pylint: disable=too-few-public-methods
+    """Commands issued while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.pending = {}
+
+    def repeated(self, threshold):
+        """Returns (shape, count) pairs issued more than threshold times."""
+        return [(shape, n) for shape, n in self.shapes.items() if n > threshold]
+
+
+_current = contextvars.ContextVar("request_queries", default=None)
+
+
+class CommandAccounting(monitoring.CommandListener):
+    """
+    Command listener plus Flask hooks that report per-request query counts.
+    Requests issuing one query shape more than n_plus_one_threshold times are
+    logged with that shape.
+    """
+
+    def __init__(self, n_plus_one_threshold=10, metrics=None):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.metrics = metrics
+
+    @staticmethod
+    def current():
+        """Returns the RequestQueries of the running request, or None."""
+        return _current.get()
+
+    def started(self, event):
+        queries = _current.get()
+        if queries is not None:
+            queries.pending[event.request_id] = query_shape(
+                event.command_name, event.command
+            )
+
+    def _finished(self, event):
+        queries = _current.get()
+        if queries is None:
+            return
+        shape = queries.pending.pop(event.request_id, None)
+        if shape is None:
+            return
+        queries.count += 1
+        queries.duration += event.duration_micros / 1_000_000
+        queries.shapes[shape] += 1
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    @staticmethod
+    def before_request():
+        """Starts counting commands for this request."""
+        _current.set(RequestQueries())
+
+    def teardown_request(self, error=None):  # pylint: disable=unused-argument
+        """Logs and records the request's commands."""
+        queries = _current.get()
+        if queries is None:
+            return
+        _current.set(None)
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        if self.metrics is not None:
+            labels = (("route", route),)
+            self.metrics.observe("mongodb_commands_per_request", queries.count, labels)
+            self.metrics.observe(
+                "mongodb_time_per_request_seconds", queries.duration, labels
+            )
+        if queries.count:
+            logger.info(
+                "%s %s: %d MongoDB commands, %.1f ms",
+                request.method,
+                request.path,
+                queries.count,
+                queries.duration * 1000,
+                extra={"route": route},
+            )
+        repeated = queries.repeated(self.n_plus_one_threshold)
+        for shape, count in repeated:
+            logger.warning(
+                "Possible N+1 in %s %s: %d commands with one shape",
+                request.method,
+                route,
+                count,
+                extra={"query_shape": shape},
+            )
+        if repeated and self.metrics is not None:
+            self.metrics.inc("mongodb_repeated_queries_total", (("route", route),))
+
+    def init_app(self, app):
+        """Registers the request hooks on a Flask app."""
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+
+def create_command_accounting(metrics=None, environ=None):
+    """Builds the listener; MONGO_N_PLUS_ONE_THRESHOLD defaults to 10."""
+    environ = os.environ if environ is None else environ
+    return CommandAccounting(
+        int(environ.get("MONGO_N_PLUS_ONE_THRESHOLD", "10")), metrics
+    )
@@ -0,0 +1,224 @@
+"""
+Streaming importer for the exercises collection.
+Reads a JSON Lines or CSV catalog, validates each record, adds the derived
+search fields and upserts in unordered bulk batches keyed on normalized_name,
+so importing the same file twice leaves the catalog unchanged.
+
+Usage: python exercise_import.py catalog.jsonl [--format jsonl|csv] [--batch-size N]
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from mongo_pool import create_mongo_client
+
+STRING_FIELDS = ("workout_name", "instruction", "description")
+
+
+class InvalidRecord(ValueError):
+    """Raised for a catalog record that cannot be imported."""
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase name without spaces or hyphens, as normalize_text in app.py."""
+    return re.sub(r"[\s\-]", "", name).lower()
+
+
+def search_tokens(name: str):
+    """Distinct lowercase words of the name, in order."""
+    return list(dict.fromkeys(re.findall(r"[a-z0-9]+", name.lower())))
+
+
+def prepare_record(record):
+    """
+    Validates a raw catalog record and returns it with its derived fields.
+    Raises InvalidRecord if it has no workout_name or a field has the wrong type.
+    """
+    if not isinstance(record, dict):
+        raise InvalidRecord("record is not an object")
+    record = {key: value for key, value in record.items() if value not in ("", None)}
+    record.pop("_id", None)
+    name = record.get("workout_name")
+    if not isinstance(name, str) or not name.strip():
+        raise InvalidRecord("workout_name is required")
+    for field in STRING_FIELDS:
+        if field in record and not isinstance(record[field], str):
+            raise InvalidRecord(f"{field} must be a string")
+    record["workout_name"] = name.strip()
+    record["normalized_name"] = normalize_name(record["workout_name"])
+    record["search_tokens"] = search_tokens(record["workout_name"])
+    return record
+
+
+def read_records(stream, file_format):
+    """Yields (line number, raw record) pairs from a JSON Lines or CSV stream."""
+    if file_format == "csv":
+        for record in csv.DictReader(stream):
+            yield 0, record
+        return
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, InvalidRecord(f"invalid JSON: {e.msg}")
+
+
+def upsert_batch(collection, batch):
+    """Upserts one batch keyed on normalized_name. Returns the bulk write result."""
+    # Two upserts of the same key in one unordered batch can race; the last one wins.
+    latest = {record["normalized_name"]: record for record in batch}
+    return collection.bulk_write(
+        [
+            UpdateOne(
+                {"normalized_name": normalized_name},
+                {"$set": record},
+                upsert=True,
+            )
+            for normalized_name, record in latest.items()
+        ],
+        ordered=False,
+    )
+
+
+def backfill_normalized_names(collection, batch_size=1000):
+    """
+    Adds normalized_name and search_tokens to exercises stored before the
+    importer derived them, so re-importing one updates it instead of adding
+    a duplicate. Where several exercises share a normalized name only the
+    oldest gets it, as the unique index allows one. Returns the number of
+    exercises updated.
+    """
+    taken = {
+        exercise["normalized_name"]
+        for exercise in collection.find(
+            {"normalized_name": {"$type": "string"}}, {"normalized_name": 1}
+        )
+    }
+    cursor = collection.find(
+        {"normalized_name": {"$exists": False}, "workout_name": {"$type": "string"}},
+        {"workout_name": 1},
+    ).sort("_id", 1)
+    operations = []
+    backfilled = 0
+    for exercise in cursor:
+        name = exercise["workout_name"].strip()
+        normalized_name = normalize_name(name)
+        if not name or normalized_name in taken:
+            continue
+        taken.add(normalized_name)
+        operations.append(
+            UpdateOne(
+                {"_id": exercise["_id"], "normalized_name": {"$exists": False}},
+                {
+                    "$set": {
+                        "normalized_name": normalized_name,
+                        "search_tokens": search_tokens(name),
+                    }
+                },
+            )
+        )
+        if len(operations) >= batch_size:
+            backfilled += collection.bulk_write(
+                operations, ordered=False
+            ).modified_count
+            operations = []
+    if operations:
+        backfilled += collection.bulk_write(operations, ordered=False).modified_count
+    return backfilled
+
+
+def import_exercises(collection, stream, file_format="jsonl", batch_size=1000):
+    """
+    Imports every valid record from the stream into the collection.
+    Returns counters for read, imported, upserted, modified and invalid records,
+    and for existing exercises given a normalized_name first (backfilled).
+    """
+    # Without this, exercises stored before the importer fall outside the
+    # partial unique index, and importing them again would duplicate them.
+    backfilled = backfill_normalized_names(collection, batch_size)
+    collection.create_index(
+        "normalized_name",
+        unique=True,
+        partialFilterExpression={"normalized_name": {"$type": "string"}},
+    )
+    stats = {
+        "read": 0,
+        "imported": 0,
+        "upserted": 0,
+        "modified": 0,
+        "invalid": 0,
+        "backfilled": backfilled,
+    }
+    batch = []
+
+    def flush():
+        result = upsert_batch(collection, batch)
+        stats["imported"] += len(batch)
+        stats["upserted"] += result.upserted_count
+        stats["modified"] += result.modified_count
+        batch.clear()
+
+    for line_number, raw in read_records(stream, file_format):
+        stats["read"] += 1
+        try:
+            if isinstance(raw, InvalidRecord):
+                raise raw
+            batch.append(prepare_record(raw))
+        except InvalidRecord as e:
+            stats["invalid"] += 1
+            where = f"line {line_number}" if line_number else f"row {stats['read']}"
+            print(f"Skipping {where}: {e}")
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    if stats["upserted"] + stats["modified"] + stats["backfilled"]:
+        # Lets catalog snapshots and caches notice in-place updates. Imports
+        # that changed nothing leave the version, and the caches, alone.
+        collection.database["catalog_meta"].update_one(
+            {"_id": "exercises"},
+            {"$inc": {"version": 1}, "$currentDate": {"updated_at": True}},
+            upsert=True,
+        )
+    return stats
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default=None)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    file_format = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+
+    load_dotenv()
+    client = create_mongo_client(os.getenv("MONGO_URI"))
+    collection = client["fitness_db"]["exercises"]
+
+    started = time.perf_counter()
+    with open(args.path, newline="", encoding="utf-8") as stream:
+        stats = import_exercises(collection, stream, file_format, args.batch_size)
+    elapsed = time.perf_counter() - started
+
+    rate = stats["imported"] / elapsed if elapsed else 0.0
+    print(
+        f"Imported {stats['imported']} of {stats['read']} records in {elapsed:.1f}s "
+        f"({rate:.0f} records/s): {stats['upserted']} new, "
+        f"{stats['modified']} updated, {stats['invalid']} invalid"
+    )
+
+
+if __name__ == "__main__":
+    main()
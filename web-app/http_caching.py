@@ -0,0 +1,167 @@
+"""
+This module adds conditional GET and response compression to the web app.
+Pages whose content follows from a known data version (a user's To-Do
+document, the exercise catalog) get an ETag built from that version, so a
+matching If-None-Match is answered with 304 before the view queries or renders
+anything. Other GET responses get an ETag hashed from their body. Text
+responses of at least COMPRESS_MIN_SIZE bytes (default 1024) are gzipped at
+COMPRESS_LEVEL (default 6) for clients that accept it.
+
+ETags are weak: the gzipped and plain bodies of one page share a tag.
+"""
+
+import functools
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import make_response, request
+from flask_login import current_user
+
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "application/json",
+    "application/javascript",
+}
+# Pages depend on the user, so shared caches must not store them and browsers
+# must revalidate before reuse.
+REVALIDATE = "private, no-cache"
+
+
+def folder_fingerprint(*folders):
+    """Hash of every file under the folders; changes when a template is deployed."""
+    digest = hashlib.sha256()
+    for folder in folders:
+        for directory, _, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                digest.update(path.encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def version_tag(*parts):
+    """A compact ETag value for a JSON-serializable description of a response."""
+    encoded = json.dumps(parts, default=str, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+class CachedValue:  # pylint: disable=too-few-public-methods
+    """Calls func at most once every ttl seconds and returns the last result."""
+
+    def __init__(self, func, ttl):
+        self.func = func
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0.0
+
+    def get(self):
+        """The cached result, recomputed when older than ttl."""
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._expires:
+                self._value = self.func()
+                self._expires = now + self.ttl
+            return self._value
+
+
+class HttpCaching:
+    """Builds conditional views and compresses responses."""
+
+    def __init__(self, build_id="", min_size=1024, level=6):
+        self.build_id = build_id
+        self.min_size = min_size
+        self.level = level
+
+    def conditional(self, version):
+        """
+        Decorates a view whose GET response is determined by version(**view_args)
+        together with the URL and the logged-in user. A request whose
+        If-None-Match holds the resulting tag gets 304 without calling the view.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**view_args):
+                if request.method not in ("GET", "HEAD"):
+                    return view(**view_args)
+                tag = version_tag(
+                    self.build_id,
+                    request.full_path,
+                    current_user.get_id(),
+                    version(**view_args),
+                )
+                if request.if_none_match.contains_weak(tag):
+                    response = make_response("", 304)
+                else:
+                    response = make_response(view(**view_args))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(tag, weak=True)
+                response.headers["Cache-Control"] = REVALIDATE
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def after_request(self, response):
+        """Adds a body ETag where there is none yet, then compresses the body."""
+        if response.direct_passthrough or response.is_streamed:
+            return response
+        if (
+            request.method in ("GET", "HEAD")
+            and response.status_code == 200
+            and "ETag" not in response.headers
+            and response.mimetype in COMPRESSIBLE_TYPES
+        ):
+            response.set_etag(
+                hashlib.sha256(response.get_data()).hexdigest()[:32], weak=True
+            )
+            response.headers.setdefault("Cache-Control", REVALIDATE)
+            response.make_conditional(request)
+        return self.compress(response)
+
+    def compress(self, response):
+        """Gzips a large enough text response if the client accepts gzip."""
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        if len(data) < self.min_size or not request.accept_encodings["gzip"]:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=self.level))
+        response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    def init_app(self, app):
+        """Registers the response hook on a Flask app."""
+        app.after_request(self.after_request)
+
+
+def create_http_caching(app, environ=None):
+    """
+    Builds the helper from COMPRESS_MIN_SIZE and COMPRESS_LEVEL. The app's
+    templates and static files are fingerprinted so a deploy changes every tag.
+    """
+    environ = os.environ if environ is None else environ
+    return HttpCaching(
+        folder_fingerprint(
+            os.path.join(app.root_path, app.template_folder), app.static_folder
+        ),
+        int(environ.get("COMPRESS_MIN_SIZE", "1024")),
+        int(environ.get("COMPRESS_LEVEL", "6")),
+    )
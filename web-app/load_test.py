@@ -0,0 +1,431 @@
+"""
+End-to-end load test for the web app.
+Virtual users sign up, log in and then loop over a weighted mix of search,
+add, edit, todo, instructions, voice-command and audio upload requests. Uploads
+alternate between 16 kHz WAV, which is passed through, and 44.1 kHz 8-bit
+stereo WAV, which is piped through ffmpeg, so conversion cost shows up in the
+results. By default the app runs in-process on the in-memory backend with a
+fake speech-to-text service; --url points the users at an app that is already
+running instead.
+
+Usage: python load_test.py [--users N] [--duration S] [--ml-latency MS]
+       [--storage memory|mongo] [--url URL] [--output FILE] [--compare FILE]
+
+Reports p50/p95/p99 latency and requests/s per route and writes them to a JSON
+file, so results from two commits can be compared with --compare.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# Relative weights of the actions each virtual user picks from.
+DEFAULT_MIX = {
+    "search": 25,
+    "search_history": 10,
+    "add": 15,
+    "todo": 20,
+    "edit": 10,
+    "instructions": 10,
+    "process_audio": 10,
+    "upload_audio": 5,
+    "upload_converted": 5,
+}
+
+SEED_EXERCISES = [
+    "Push-Up",
+    "Pull-Up",
+    "Squat",
+    "Bench Press",
+    "Deadlift",
+    "Lunge",
+    "Plank",
+    "Bicep Curl",
+    "Shoulder Press",
+    "Leg Press",
+]
+SEARCH_TERMS = ["push", "pull up", "squat", "press", "curl", "plank", "leg"]
+TRANSCRIPTS = [
+    "set time to 5 minutes and 3 sets",
+    "ten reps with 20 kg",
+    "four sets of 12 pounds for two minutes",
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(
+        0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """
+    Turns {route: [(latency seconds, ok), ...]} into per-route statistics:
+    count, errors, requests/s and p50/p95/p99 latency in milliseconds.
+    """
+    summary = {}
+    for route, route_samples in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in route_samples)
+        summary[route] = {
+            "count": len(route_samples),
+            "errors": sum(1 for _, ok in route_samples if not ok),
+            "rps": round(len(route_samples) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return summary
+
+
+def compare(baseline, current):
+    """Returns lines comparing the p95 and requests/s of two result files."""
+    lines = []
+    for route, stats in current["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before:
+            lines.append(f"{route:<16} new route")
+            continue
+        p95_change = _change(before["p95_ms"], stats["p95_ms"])
+        rps_change = _change(before["rps"], stats["rps"])
+        lines.append(f"{route:<16} p95 {p95_change:+7.1f}%   rps {rps_change:+7.1f}%")
+    return lines
+
+
+def _change(before, after):
+    return (after - before) / before * 100 if before else 0.0
+
+
+def wav_bytes(seconds=1.0, sample_rate=16000, channels=1, sample_width=2):
+    """
+    A silent WAV. The 16-bit mono default is passed through without ffmpeg;
+    the app converts any other sample width with ffmpeg.
+    """
+    # pylint: disable=no-member
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(sample_width)
+        f.setframerate(sample_rate)
+        frame = (b"\x80" if sample_width == 1 else b"\0" * sample_width) * channels
+        f.writeframes(frame * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+def converted_clip(seconds=1.0):
+    """A 44.1 kHz 8-bit stereo WAV: cheap to build, but the app must convert it."""
+    return wav_bytes(seconds, sample_rate=44100, channels=2, sample_width=1)
+
+
+class FakeSpeechService:
+    """
+    Stand-in for the machine-learning client: answers POST /transcribe with a
+    canned transcript after latency_ms (plus up to jitter_ms) milliseconds.
+    """
+
+    def __init__(self, latency_ms=200.0, jitter_ms=50.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler bound to this service."""
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Replies to /transcribe."""
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(service.delay())
+                body = json.dumps(
+                    {"transcript": random.choice(TRANSCRIPTS), "confidence": 0.9}
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/transcribe"
+
+    def delay(self):
+        """Seconds to wait before answering."""
+        return (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000
+
+    def start(self):
+        """Serves in a background thread."""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops serving."""
+        self.server.shutdown()
+
+
+def start_local_app(storage_backend, ml_url):
+    """
+    Imports the app configured for load testing and serves it on a free port
+    in a background thread. Returns the base URL and the server.
+    """
+    os.environ["STORAGE_BACKEND"] = storage_backend
+    os.environ["SPEECH_TO_TEXT_URL"] = ml_url
+    # pylint: disable-next=import-outside-toplevel
+    from werkzeug.serving import make_server
+
+    # The app reads its configuration at import time.
+    # pylint: disable-next=import-outside-toplevel
+    from app import app, storage
+
+    if storage_backend == "memory":
+        for name in SEED_EXERCISES:
+            storage.insert_exercise(
+                {"workout_name": name, "instruction": f"How to do a {name}."}
+            )
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+class VirtualUser:
+    """One simulated user with its own session cookie."""
+
+    def __init__(self, base_url, number, record):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.username = f"load{number}_{random.randrange(10**9)}"
+        self.record = record
+        self.exercise_ids = []
+        self.todo_ids = []
+
+    def request(self, route, method, path, **kwargs):
+        """Sends one request and records its latency under route."""
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.base_url + path, timeout=30, **kwargs
+            )
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.record(route, time.perf_counter() - started, ok)
+        return response
+
+    def sign_in(self):
+        """Registers and logs in."""
+        credentials = {"username": self.username, "password": "load-test-password"}
+        self.request("register", "POST", "/register", data=credentials)
+        self.request("login", "POST", "/login", data=credentials)
+
+    def search(self):
+        """Searches and follows the redirect to the add page."""
+        self.request(
+            "search", "POST", "/search", data={"query": random.choice(SEARCH_TERMS)}
+        )
+
+    def search_history(self):
+        """Opens the search page, which replays the search history."""
+        self.request("search_history", "GET", "/search")
+
+    def add(self):
+        """Adds a known exercise to the To-Do list."""
+        if not self.exercise_ids:
+            return
+        exercise_id = random.choice(self.exercise_ids)
+        self.request("add", "POST", f"/add_exercise?exercise_id={exercise_id}")
+
+    def todo(self):
+        """Opens the To-Do list and remembers its ids."""
+        response = self.request("todo", "GET", "/todo")
+        if response is not None and response.ok:
+            self.todo_ids = sorted(
+                {int(i) for i in _find_all(response.text, "exercise_todo_id=")}
+            )
+
+    def edit(self):
+        """Edits a To-Do item."""
+        if not self.todo_ids:
+            return
+        self.request(
+            "edit",
+            "POST",
+            f"/edit?exercise_todo_id={random.choice(self.todo_ids)}",
+            data={"working_time": "10:00", "reps": "3", "weight": "20"},
+        )
+
+    def instructions(self):
+        """Opens the instructions of a known exercise."""
+        if self.exercise_ids:
+            self.request(
+                "instructions",
+                "GET",
+                f"/instructions?exercise_id={random.choice(self.exercise_ids)}",
+            )
+
+    def process_audio(self):
+        """Uploads a voice command for a To-Do item."""
+        if not self.todo_ids:
+            return
+        name = f"{self.username}_{random.randrange(10**9)}.wav"
+        self.request(
+            "process_audio",
+            "POST",
+            f"/process-audio?exercise_todo_id={random.choice(self.todo_ids)}",
+            files={"audio": (name, wav_bytes(0.5), "audio/wav")},
+        )
+
+    def upload_audio(self):
+        """Uploads a 16 kHz WAV recording, which skips ffmpeg."""
+        self.request(
+            "upload_audio",
+            "POST",
+            "/upload-audio",
+            files={"audio": ("recording.wav", wav_bytes(2.0), "audio/wav")},
+        )
+
+    def upload_converted(self):
+        """Uploads a recording the app has to convert with ffmpeg."""
+        self.request(
+            "upload_converted",
+            "POST",
+            "/upload-audio",
+            files={"audio": ("recording.wav", converted_clip(2.0), "audio/wav")},
+        )
+
+
+def _find_all(text, marker):
+    """Digits following each occurrence of marker in text."""
+    found = []
+    start = text.find(marker)
+    while start != -1:
+        start += len(marker)
+        end = start
+        while end < len(text) and text[end].isdigit():
+            end += 1
+        if end > start:
+            found.append(text[start:end])
+        start = text.find(marker, end)
+    return found
+
+
+def run(base_url, users, duration, mix=None, exercise_ids=()):
+    """
+    Runs users virtual users against base_url for duration seconds.
+    Returns the per-route summary and the elapsed time.
+    """
+    mix = mix or DEFAULT_MIX
+    actions, weights = zip(*mix.items())
+    samples = {}
+    lock = threading.Lock()
+
+    def record(route, latency, ok):
+        with lock:
+            samples.setdefault(route, []).append((latency, ok))
+
+    def user_loop(number):
+        user = VirtualUser(base_url, number, record)
+        user.exercise_ids = list(exercise_ids)
+        user.sign_in()
+        user.todo()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            getattr(user, random.choices(actions, weights)[0])()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(user_loop, range(users)))
+    elapsed = time.perf_counter() - started
+    return summarize(samples, elapsed), elapsed
+
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--ml-latency", type=float, default=200.0)
+    parser.add_argument("--ml-jitter", type=float, default=50.0)
+    parser.add_argument("--storage", choices=("memory", "mongo"), default="memory")
+    parser.add_argument("--url", help="base URL of an already running web app")
+    parser.add_argument("--exercise-ids", nargs="*", default=[])
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    exercise_ids = args.exercise_ids
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        speech = FakeSpeechService(args.ml_latency, args.ml_jitter).start()
+        base_url, _ = start_local_app(args.storage, speech.url)
+        if not exercise_ids:
+            # pylint: disable-next=import-outside-toplevel
+            from app import storage
+
+            exercise_ids = [
+                str(exercise["_id"]) for exercise in storage.iter_exercises()
+            ]
+
+    routes, elapsed = run(base_url, args.users, args.duration, None, exercise_ids)
+    results = {
+        "commit": git_commit(),
+        "time": datetime.utcnow().isoformat(timespec="seconds"),
+        "config": {
+            "users": args.users,
+            "duration": args.duration,
+            "ml_latency_ms": args.ml_latency,
+            "storage": "external" if args.url else args.storage,
+        },
+        "elapsed": round(elapsed, 2),
+        "routes": routes,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(
+        f"{'route':<16}{'count':>8}{'errors':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    )
+    for route, stats in routes.items():
+        print(
+            f"{route:<16}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>9}"
+            f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+        )
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline.get('commit')}):")
+        print("\n".join(compare(baseline, results)))
+
+
+if __name__ == "__main__":
+    main()
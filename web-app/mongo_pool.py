@@ -0,0 +1,111 @@
+"""
+This module builds the MongoDB client options from the environment and tracks
+connection pool health through pymongo's pool monitoring events.
+"""
+
+import os
+import threading
+
+import certifi
+from pymongo import MongoClient, monitoring
+
+READ_PREFERENCES = (
+    "primary",
+    "primaryPreferred",
+    "secondary",
+    "secondaryPreferred",
+    "nearest",
+)
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so the readiness endpoint can report them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            "pools": 0,
+            "open": 0,
+            "checked_out": 0,
+            "created": 0,
+            "closed": 0,
+            "checkout_failures": 0,
+            "cleared": 0,
+        }
+
+    def _update(self, **changes):
+        with self._lock:
+            for key, delta in changes.items():
+                self.stats[key] += delta
+
+    def snapshot(self):
+        """Returns a copy of the current pool counters."""
+        with self._lock:
+            return dict(self.stats)
+
+    def pool_created(self, event):
+        self._update(pools=1)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(cleared=1)
+
+    def pool_closed(self, event):
+        self._update(pools=-1)
+
+    def connection_created(self, event):
+        self._update(created=1, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(closed=1, open=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._update(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._update(checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._update(checked_out=-1)
+
+
+def mongo_client_options(environ=None):
+    """
+    Reads the pool and timeout settings for MongoClient from the environment.
+    connect=False defers the first connection until a command is issued.
+    """
+    environ = os.environ if environ is None else environ
+    read_preference = environ.get("MONGO_READ_PREFERENCE", "primary")
+    if read_preference not in READ_PREFERENCES:
+        raise ValueError(f"Unknown MONGO_READ_PREFERENCE: {read_preference}")
+
+    return {
+        "connect": False,
+        "maxPoolSize": int(environ.get("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(environ.get("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(environ.get("MONGO_MAX_IDLE_TIME_MS", "60000")),
+        "serverSelectionTimeoutMS": int(
+            environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+        ),
+        "connectTimeoutMS": int(environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "readPreference": read_preference,
+    }
+
+
+def create_mongo_client(mongo_uri, event_listeners=None):
+    """Builds a TLS MongoClient with the configured pool options."""
+    return MongoClient(
+        mongo_uri,
+        tls=True,
+        tlsCAFile=certifi.where(),
+        event_listeners=event_listeners or [],
+        **mongo_client_options(),
+    )
@@ -0,0 +1,113 @@
+"""
+This module runs password hashing off the request threads.
+pbkdf2 work is sent to a small dedicated process pool; when too many hashes
+are already running or waiting, new ones are rejected at once instead of
+queueing behind a login burst.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool is saturated or a hash took too long."""
+
+
+def pbkdf2_parameters(method: str):
+    """
+    Splits a werkzeug method string such as "pbkdf2:sha256:600000" into
+    its kind ("pbkdf2", "sha256") and iteration count (None for other methods).
+    """
+    parts = method.split(":")
+    if parts[0] != "pbkdf2":
+        return tuple(parts), None
+    hash_name = parts[1] if len(parts) > 1 else "sha256"
+    iterations = int(parts[2]) if len(parts) > 2 else DEFAULT_PBKDF2_ITERATIONS
+    return ("pbkdf2", hash_name), iterations
+
+
+def needs_rehash(stored_hash: str, method: str) -> bool:
+    """
+    Checks whether a stored werkzeug hash was made with a different method
+    or fewer iterations than the configured one.
+    """
+    if "$" not in stored_hash:
+        return False
+    stored_kind, stored_iterations = pbkdf2_parameters(stored_hash.split("$", 1)[0])
+    kind, iterations = pbkdf2_parameters(method)
+    if stored_kind != kind:
+        return True
+    return iterations is not None and (stored_iterations or 0) < iterations
+
+
+class PasswordHasher:
+    """
+    Runs hashing functions on a process pool of `workers` processes, with at
+    most `max_queue` further calls waiting. workers=0 runs them inline.
+    """
+
+    def __init__(self, workers=2, max_queue=8, timeout=10.0):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        # Created on first use so each forked web worker gets its own pool.
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def run(self, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs) on the pool and returns its result.
+        Raises PasswordHashingBusy if the pool is full or the call times out.
+        """
+        # Released below once the call has finished.
+        # pylint: disable-next=consider-using-with
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHashingBusy("Too many password checks in progress")
+        if self.workers == 0:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_pool().submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A call that times out keeps its worker busy until it finishes, so
+        # its slot is only freed then, not when the caller gives up.
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout as e:
+            future.cancel()
+            raise PasswordHashingBusy("Password check timed out") from e
+
+    def shutdown(self):
+        """Stops the worker processes."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+def create_password_hasher(environ=None):
+    """
+    Builds the hasher from PASSWORD_HASH_WORKERS (default 2),
+    PASSWORD_HASH_MAX_QUEUE (default 8) and PASSWORD_HASH_TIMEOUT in seconds (default 10).
+    """
+    environ = os.environ if environ is None else environ
+    return PasswordHasher(
+        workers=int(environ.get("PASSWORD_HASH_WORKERS", "2")),
+        max_queue=int(environ.get("PASSWORD_HASH_MAX_QUEUE", "8")),
+        timeout=float(environ.get("PASSWORD_HASH_TIMEOUT", "10")),
+    )
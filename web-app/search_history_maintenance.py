@@ -0,0 +1,56 @@
+"""
+Maintenance for the search_history collection.
+Creates the covering and TTL indexes, then compacts entries older than the
+compaction window into per-user daily buckets in search_history_daily.
+
+Usage: python search_history_maintenance.py [--batch-size N]
+
+SEARCH_HISTORY_RETENTION_DAYS (default 30) is how long raw entries are kept,
+SEARCH_HISTORY_COMPACT_AFTER_DAYS (default 7) is when they are folded into buckets,
+and SEARCH_HISTORY_BUCKET_RETENTION_DAYS (default 365) is how long buckets are kept.
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from mongo_pool import create_mongo_client
+from storage import MongoStorage
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+def run(storage, batch_size=1000, environ=None, now=None):
+    """
+    Ensures the search history indexes and compacts old entries.
+    Returns the number of entries compacted.
+    """
+    environ = os.environ if environ is None else environ
+    retention_days = int(environ.get("SEARCH_HISTORY_RETENTION_DAYS", "30"))
+    compact_after_days = int(environ.get("SEARCH_HISTORY_COMPACT_AFTER_DAYS", "7"))
+    bucket_days = int(environ.get("SEARCH_HISTORY_BUCKET_RETENTION_DAYS", "365"))
+
+    storage.ensure_search_history_indexes(
+        retention_days * DAY_SECONDS, bucket_days * DAY_SECONDS
+    )
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=compact_after_days)
+    return storage.compact_search_history(cutoff, batch_size)
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = create_mongo_client(os.getenv("MONGO_URI"))
+    compacted = run(MongoStorage(client), args.batch_size)
+    print(f"Compacted {compacted} search history entries")
+
+
+if __name__ == "__main__":
+    main()
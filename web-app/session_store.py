@@ -0,0 +1,296 @@
+"""
+This module keeps Flask sessions on the server so any worker or replica can
+serve any user. The cookie only carries a signed session id; the session data
+lives in SQLite for a single host or in MongoDB when replicas share it.
+"""
+
+import logging
+import os
+import secrets
+import sqlite3
+import stat
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from bson import Binary
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+from flask.sessions import SessionInterface
+from itsdangerous import BadSignature, Signer
+
+logger = logging.getLogger(__name__)
+
+# Payloads larger than this are zlib-compressed before they are stored.
+COMPRESS_THRESHOLD = 512
+
+
+def private_directory(path):
+    """Creates path readable only by this user, or checks an existing one is."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    check_private(os.lstat(path), path)
+    return path
+
+
+def check_private(status, path):
+    """Raises PermissionError unless path is owned by this user and not shared."""
+    if status.st_uid != os.geteuid() or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} must be owned by this user and not writable")
+    if stat.S_ISREG(status.st_mode) and status.st_mode & (stat.S_IRGRP | stat.S_IROTH):
+        raise PermissionError(f"{path} must not be readable by other users")
+
+
+def read_private_file(path):
+    """Reads a file after checking it is a private regular file, not a link."""
+    fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    with open(fd, encoding="utf-8") as f:
+        status = os.fstat(fd)
+        if not stat.S_ISREG(status.st_mode):
+            raise PermissionError(f"{path} is not a regular file")
+        check_private(status, path)
+        return f.read().strip()
+
+
+def load_secret_key(environ=None, instance_path="instance"):
+    """
+    Returns SECRET_KEY if it is set. Otherwise reads the key from SECRET_KEY_FILE
+    (default: secret_key in the app's instance folder), creating it once with a
+    random key so every worker on the host shares it. The file must belong to
+    this user and be readable by no one else.
+    """
+    environ = os.environ if environ is None else environ
+    if environ.get("SECRET_KEY"):
+        return environ["SECRET_KEY"]
+    path = environ.get("SECRET_KEY_FILE") or os.path.join(
+        private_directory(instance_path), "secret_key"
+    )
+    if not os.path.lexists(path):
+        tmp_path = f"{path}.{os.getpid()}.{secrets.token_hex(4)}.tmp"
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW
+        with open(os.open(tmp_path, flags, 0o600), "w", encoding="utf-8") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # link fails if another worker created the key first; theirs wins.
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+        logger.warning("SECRET_KEY is not set, using the key stored in %s", path)
+    return read_private_file(path)
+
+
+class SessionSerializer:
+    """Flask's tagged JSON, compressed when large, prefixed with its encoding."""
+
+    def __init__(self):
+        self._json = TaggedJSONSerializer()
+
+    def dumps(self, data) -> bytes:
+        """Serializes a session dict."""
+        payload = self._json.dumps(data).encode("utf-8")
+        if len(payload) > COMPRESS_THRESHOLD:
+            return b"z" + zlib.compress(payload)
+        return b"j" + payload
+
+    def loads(self, payload: bytes):
+        """Reverses dumps."""
+        payload = bytes(payload)
+        body = payload[1:]
+        if payload[:1] == b"z":
+            body = zlib.decompress(body)
+        return self._json.loads(body.decode("utf-8"))
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file, shared by the workers of one host."""
+
+    def __init__(self, path, purge_every=100):
+        self.path = path
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._saves = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, sid):
+        """Returns the stored payload, or None if it is missing or expired."""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT data FROM sessions WHERE id = ? AND expires_at > ?",
+                (sid, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def save(self, sid, payload, expires_at):
+        """Stores the payload until expires_at (an aware datetime)."""
+        self._saves += 1
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (sid, payload, expires_at.timestamp()),
+            )
+            if self._saves % self.purge_every == 0:
+                connection.execute(
+                    "DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)
+                )
+
+    def delete(self, sid):
+        """Removes a session."""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+
+class MongoSessionStore:
+    """Sessions in a MongoDB collection, expired by a TTL index."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexed = False
+
+    def load(self, sid):
+        """Returns the stored payload, or None if it is missing or expired."""
+        document = self.collection.find_one(
+            {"_id": sid, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"data": 1},
+        )
+        return document["data"] if document else None
+
+    def save(self, sid, payload, expires_at):
+        """Stores the payload until expires_at (an aware datetime)."""
+        if not self._indexed:
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        self.collection.replace_one(
+            {"_id": sid},
+            {"_id": sid, "data": Binary(payload), "expires_at": expires_at},
+            upsert=True,
+        )
+
+    def delete(self, sid):
+        """Removes a session."""
+        self.collection.delete_one({"_id": sid})
+
+
+class ServerSession(SecureCookieSession):
+    """Session dict that remembers its server-side id."""
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Moves the session to a new id; the old one is deleted when saved."""
+        self.replaced_sid = self.replaced_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+def regenerate_session_id(session):
+    """
+    Gives a server-side session a new id, so that an id planted before login
+    (session fixation) does not carry the login. Cookie sessions have no id.
+    """
+    if isinstance(session, ServerSession):
+        session.regenerate()
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface that stores session data in a session store."""
+
+    session_class = ServerSession
+
+    def __init__(self, store, serializer=None):
+        self.store = store
+        self.serializer = serializer or SessionSerializer()
+
+    @staticmethod
+    def _signer(app):
+        return Signer(app.secret_key, salt="server-session")
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode("utf-8")
+            except BadSignature:
+                sid = None
+            payload = self.store.load(sid) if sid else None
+            if payload is not None:
+                return self.session_class(self.serializer.loads(payload), sid=sid)
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid:
+            self.store.delete(session.replaced_sid)
+            session.replaced_sid = None
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not self.should_set_cookie(app, session):
+            return
+
+        expires = self.get_expiration_time(app, session)
+        stored_until = expires or (
+            datetime.now(timezone.utc) + app.permanent_session_lifetime
+        )
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), stored_until)
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode("utf-8"),
+            expires=expires,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def create_session_interface(storage, environ=None, instance_path="instance"):
+    """
+    Returns the session interface selected by SESSION_BACKEND: "sqlite"
+    (default, file at SESSION_SQLITE_PATH, else sessions.db in the instance
+    folder), "mongo" (the sessions collection of the storage backend's
+    database) or "cookie" (Flask's signed cookies).
+    """
+    environ = os.environ if environ is None else environ
+    backend = environ.get("SESSION_BACKEND", "sqlite")
+    if backend == "sqlite":
+        path = environ.get("SESSION_SQLITE_PATH") or os.path.join(
+            private_directory(instance_path), "sessions.db"
+        )
+        return ServerSessionInterface(SQLiteSessionStore(path))
+    if backend == "mongo":
+        if not hasattr(storage, "db"):
+            raise ValueError('SESSION_BACKEND="mongo" needs STORAGE_BACKEND="mongo"')
+        return ServerSessionInterface(MongoSessionStore(storage.db["sessions"]))
+    if backend == "cookie":
+        return SecureCookieSessionInterface()
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
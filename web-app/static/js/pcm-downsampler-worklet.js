@@ -0,0 +1,62 @@
+// Audio worklet that mixes the microphone down to mono and resamples it to
+// targetRate 16-bit PCM. Each output sample is the mean of the input samples
+// in its window, which also low-pass filters the signal before decimation.
+// Samples are posted to the main thread in batches of about 100 ms.
+class PcmDownsampler extends AudioWorkletProcessor {
+    constructor(options) {
+        super();
+        const targetRate = options.processorOptions.targetRate;
+        this.ratio = sampleRate / targetRate;
+        this.batch = new Int16Array(Math.round(targetRate / 10));
+        this.batchLength = 0;
+        this.sum = 0;
+        this.count = 0;
+        this.position = 0;
+        this.nextBoundary = this.ratio;
+        this.port.onmessage = (event) => {
+            if (event.data === 'flush') {
+                this.postBatch();
+                this.port.postMessage({ done: true });
+            }
+        };
+    }
+
+    postBatch() {
+        if (this.batchLength === 0) {
+            return;
+        }
+        const samples = this.batch.slice(0, this.batchLength);
+        this.port.postMessage({ samples }, [samples.buffer]);
+        this.batchLength = 0;
+    }
+
+    process(inputs) {
+        const channels = inputs[0];
+        if (!channels || channels.length === 0) {
+            return true;
+        }
+        const frames = channels[0].length;
+        for (let i = 0; i < frames; i++) {
+            let mono = 0;
+            for (let c = 0; c < channels.length; c++) {
+                mono += channels[c][i];
+            }
+            this.sum += mono / channels.length;
+            this.count++;
+            this.position++;
+            if (this.position >= this.nextBoundary) {
+                const sample = Math.max(-1, Math.min(1, this.sum / this.count));
+                this.batch[this.batchLength++] = sample < 0 ? sample * 0x8000 : sample * 0x7fff;
+                if (this.batchLength === this.batch.length) {
+                    this.postBatch();
+                }
+                this.sum = 0;
+                this.count = 0;
+                this.nextBoundary += this.ratio;
+            }
+        }
+        return true;
+    }
+}
+
+registerProcessor('pcm-downsampler', PcmDownsampler);
@@ -0,0 +1,113 @@
+// Records the microphone as 16 kHz mono 16-bit PCM and returns it as a WAV
+// file, which the server passes to the speech-to-text service without running
+// ffmpeg. Browsers without AudioWorklet fall back to MediaRecorder, whose
+// compressed output is labelled with its real type and converted server-side.
+const PCM_SAMPLE_RATE = 16000;
+
+function encodeWav(chunks, sampleRate) {
+    const length = chunks.reduce((total, chunk) => total + chunk.length, 0);
+    const view = new DataView(new ArrayBuffer(44 + length * 2));
+    const writeText = (offset, text) => {
+        for (let i = 0; i < text.length; i++) {
+            view.setUint8(offset + i, text.charCodeAt(i));
+        }
+    };
+    writeText(0, 'RIFF');
+    view.setUint32(4, 36 + length * 2, true);
+    writeText(8, 'WAVE');
+    writeText(12, 'fmt ');
+    view.setUint32(16, 16, true);
+    view.setUint16(20, 1, true); // PCM
+    view.setUint16(22, 1, true); // mono
+    view.setUint32(24, sampleRate, true);
+    view.setUint32(28, sampleRate * 2, true);
+    view.setUint16(32, 2, true);
+    view.setUint16(34, 16, true);
+    writeText(36, 'data');
+    view.setUint32(40, length * 2, true);
+    let offset = 44;
+    for (const chunk of chunks) {
+        for (let i = 0; i < chunk.length; i++, offset += 2) {
+            view.setInt16(offset, chunk[i], true);
+        }
+    }
+    return new Blob([view], { type: 'audio/wav' });
+}
+
+const FALLBACK_EXTENSIONS = { 'audio/webm': 'webm', 'audio/ogg': 'ogg', 'audio/mp4': 'm4a' };
+
+class PcmRecorder {
+    constructor(workletUrl) {
+        this.workletUrl = workletUrl;
+        this.stream = null;
+    }
+
+    static supported() {
+        return Boolean(navigator.mediaDevices && navigator.mediaDevices.getUserMedia);
+    }
+
+    async start() {
+        this.stream = await navigator.mediaDevices.getUserMedia({
+            audio: { channelCount: 1, echoCancellation: true, noiseSuppression: true },
+        });
+        if (window.AudioWorkletNode) {
+            await this.startWorklet();
+        } else {
+            this.startMediaRecorder();
+        }
+    }
+
+    async startWorklet() {
+        this.context = new AudioContext();
+        await this.context.audioWorklet.addModule(this.workletUrl);
+        this.chunks = [];
+        this.node = new AudioWorkletNode(this.context, 'pcm-downsampler', {
+            numberOfOutputs: 0,
+            processorOptions: { targetRate: PCM_SAMPLE_RATE },
+        });
+        this.flushed = new Promise((resolve) => {
+            this.node.port.onmessage = (event) => {
+                if (event.data.done) {
+                    resolve();
+                } else {
+                    this.chunks.push(event.data.samples);
+                }
+            };
+        });
+        this.source = this.context.createMediaStreamSource(this.stream);
+        this.source.connect(this.node);
+    }
+
+    startMediaRecorder() {
+        this.mediaRecorder = new MediaRecorder(this.stream);
+        this.chunks = [];
+        this.mediaRecorder.ondataavailable = (event) => this.chunks.push(event.data);
+        this.mediaRecorder.start();
+    }
+
+    // Resolves to { blob, filename } for the upload form.
+    async stop() {
+        let recording;
+        if (this.mediaRecorder) {
+            const stopped = new Promise((resolve) => { this.mediaRecorder.onstop = resolve; });
+            this.mediaRecorder.stop();
+            await stopped;
+            const type = (this.mediaRecorder.mimeType || 'audio/webm').split(';')[0];
+            recording = {
+                blob: new Blob(this.chunks, { type }),
+                filename: `recording.${FALLBACK_EXTENSIONS[type] || 'webm'}`,
+            };
+            this.mediaRecorder = null;
+        } else {
+            this.source.disconnect();
+            this.node.port.postMessage('flush');
+            await this.flushed;
+            await this.context.close();
+            recording = { blob: encodeWav(this.chunks, PCM_SAMPLE_RATE), filename: 'recording.wav' };
+        }
+        this.stream.getTracks().forEach((track) => track.stop());
+        this.stream = null;
+        this.chunks = [];
+        return recording;
+    }
+}
@@ -0,0 +1,181 @@
+"""
+This module serves the static folder under content-hashed names.
+At startup every file is hashed and url_for("static", filename="css/style1.css")
+produces /static/css/style1.<hash>.css, so the templates keep their plain names.
+Hashed URLs change whenever the file does, so they are served with a one-year
+immutable Cache-Control and browsers never revalidate them.
+
+Text files are compressed once at startup, with gzip and, when the brotli
+package is installed, brotli. Files precompressed next to the original
+(style1.css.gz, style1.css.br) are used instead when they decompress to exactly
+the original; run this module to write them:
+
+    python static_assets.py [static folder]
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+import zlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip alone is used without it
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE = {".css", ".js", ".svg", ".html", ".json", ".txt", ".map"}
+HASH_LENGTH = 12
+# What reading or decompressing a corrupt copy can raise.
+DECOMPRESS_ERRORS = (OSError, EOFError, zlib.error) + (
+    (brotli.error,) if brotli is not None else ()
+)
+
+
+def hashed_name(filename, digest):
+    """css/style1.css -> css/style1.<digest>.css"""
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def compress(data):
+    """Returns {encoding: bytes} for the encodings that make data smaller."""
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data)
+    return {k: v for k, v in variants.items() if len(v) < len(data)}
+
+
+def decompressors():
+    """Returns {encoding: (suffix, decompress)} for the copies that can be checked."""
+    available = {"gzip": (".gz", gzip.decompress)}
+    if brotli is not None:
+        available["br"] = (".br", brotli.decompress)
+    return available
+
+
+def read_precompressed(copy_path, data, decompress):
+    """
+    Returns the precompressed copy if it decompresses to data, else None.
+    A stale or corrupt copy is ignored whatever its modification time.
+    """
+    try:
+        with open(copy_path, "rb") as f:
+            compressed = f.read()
+        # Checked against the original itself, the source of the asset's hash.
+        if decompress(compressed) == data:
+            return compressed
+    except DECOMPRESS_ERRORS:
+        pass
+    return None
+
+
+class Asset:  # pylint: disable=too-few-public-methods
+    """One static file with its hash and compressed variants."""
+
+    def __init__(self, path, data):
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.etag = hashlib.sha256(data).hexdigest()
+        self.variants = {"identity": data}
+        if os.path.splitext(path)[1] in COMPRESSIBLE:
+            self.variants.update(compress(data))
+            for encoding, (suffix, decompress) in decompressors().items():
+                compressed = read_precompressed(path + suffix, data, decompress)
+                if compressed is not None:
+                    self.variants[encoding] = compressed
+
+    def encoding_for(self, accept_encodings):
+        """The smallest variant the client accepts."""
+        accepted = [
+            encoding
+            for encoding in self.variants
+            if encoding == "identity" or accept_encodings[encoding]
+        ]
+        return min(accepted, key=lambda encoding: len(self.variants[encoding]))
+
+
+def source_files(static_folder):
+    """Paths of the static files relative to the folder, without the .gz/.br copies."""
+    for directory, _, files in os.walk(static_folder):
+        for name in sorted(files):
+            if not name.endswith((".gz", ".br")):
+                path = os.path.join(directory, name)
+                yield os.path.relpath(path, static_folder).replace(os.sep, "/")
+
+
+class StaticAssets:
+    """Hashes the static folder and serves it with long-lived cache headers."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.manifest = {}
+        self.assets = {}
+
+    def build(self):
+        """Reads and hashes every static file. Returns the manifest."""
+        manifest, assets = {}, {}
+        for filename in source_files(self.static_folder):
+            path = os.path.join(self.static_folder, filename)
+            with open(path, "rb") as f:
+                asset = Asset(path, f.read())
+            manifest[filename] = hashed_name(filename, asset.etag)
+            assets[manifest[filename]] = asset
+        self.manifest, self.assets = manifest, assets
+        return manifest
+
+    def url_defaults(self, endpoint, values):
+        """Points url_for("static", ...) at the hashed file name."""
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = self.manifest.get(
+                values["filename"], values["filename"]
+            )
+
+    def serve(self, filename, fallback):
+        """Serves a hashed file, or hands other names to Flask's static view."""
+        asset = self.assets.get(filename)
+        if asset is None:
+            return fallback(filename=filename)
+        encoding = asset.encoding_for(request.accept_encodings)
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        response.set_etag(f"{asset.etag[:HASH_LENGTH]}-{encoding}")
+        return response.make_conditional(request)
+
+    def init_app(self, app):
+        """Builds the manifest and takes over the app's static endpoint."""
+        self.build()
+        app.url_defaults(self.url_defaults)
+        fallback = app.view_functions["static"]
+        app.view_functions["static"] = lambda filename: self.serve(filename, fallback)
+
+
+def precompress(static_folder):
+    """Writes .gz (and, with brotli installed, .br) copies of the text files."""
+    written = []
+    for filename in source_files(static_folder):
+        path = os.path.join(static_folder, filename)
+        if os.path.splitext(path)[1] not in COMPRESSIBLE:
+            continue
+        with open(path, "rb") as f:
+            variants = compress(f.read())
+        for encoding, suffix in (("gzip", ".gz"), ("br", ".br")):
+            if encoding in variants:
+                with open(path + suffix, "wb") as f:
+                    f.write(variants[encoding])
+                written.append(path + suffix)
+    return written
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else "static"
+    for written_path in precompress(folder):
+        print(written_path)
+    if brotli is None:
+        print("brotli is not installed; only gzip copies were written")
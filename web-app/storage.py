@@ -0,0 +1,654 @@
+"""
+This module defines the storage backends behind the web app's helpers.
+MongoStorage talks to the fitness_db collections; MemoryStorage keeps the same
+data in process so the app can be tested, load-tested and profiled without a cluster.
+"""
+
+import copy
+import json
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+
+def strip_name(name: str) -> str:
+    """Removes hyphens and spaces, as the Mongo search expressions do."""
+    return name.replace("-", "").replace(" ", "")
+
+
+def query_key(content: str) -> str:
+    """
+    Normalizes a search query for the daily buckets: lowercase, without
+    whitespace or hyphens, and without characters not allowed in field names.
+    """
+    return re.sub(r"[\s\-.$]", "", content).lower() or "_"
+
+
+def daily_buckets(entries):
+    """
+    Groups search history entries into per-user daily counts.
+    Returns {(user_id, day): Counter of query keys}.
+    """
+    buckets = defaultdict(Counter)
+    for entry in entries:
+        time = entry["time"]
+        day = datetime(time.year, time.month, time.day)
+        buckets[(entry["user_id"], day)][query_key(entry["content"])] += 1
+    return buckets
+
+
+def bucket_id(user_id, day):
+    """Returns the _id of a user's daily bucket."""
+    return f"{user_id}:{day:%Y-%m-%d}"
+
+
+def stripped_name_expression():
+    """Aggregation expression for workout_name without hyphens and spaces."""
+    return {
+        "$replaceAll": {
+            "input": {
+                "$replaceAll": {
+                    "input": "$workout_name",
+                    "find": "-",
+                    "replacement": "",
+                }
+            },
+            "find": " ",
+            "replacement": "",
+        }
+    }
+
+
+def matching_query(normalized_query: str):
+    """Filter for exercises whose stripped name matches the query as a regex."""
+    return {
+        "$expr": {
+            "$regexMatch": {
+                "input": stripped_name_expression(),
+                "regex": normalized_query,
+                "options": "i",
+            }
+        }
+    }
+
+
+def named_query(normalized_query: str):
+    """Filter for exercises whose stripped, lowercased name equals the query."""
+    return {
+        "$expr": {"$eq": [{"$toLower": stripped_name_expression()}, normalized_query]}
+    }
+
+
+# Removed To-Do items are remembered for this many changes so that clients
+# syncing with a since version learn about deletions.
+REMOVED_TODO_LIMIT = 200
+# MongoDB's error code for a unique index violation.
+DUPLICATE_KEY = 11000
+
+
+def version_filter(version):
+    """Matches a To-Do document at version; documents older than versioning have none."""
+    return {"$in": [0, None]} if version == 0 else version
+
+
+def versioned_todo_document(document):
+    """A new To-Do document at version 1, with its items stamped to match."""
+    return {
+        **document,
+        "version": 1,
+        "todo": [{**item, "version": 1} for item in document.get("todo", [])],
+    }
+
+
+def todo_projection(item_fields):
+    """find_one projection keeping the given item fields plus the sync fields."""
+    projection = {"version": 1, "removed": 1, "todo.exercise_todo_id": 1}
+    projection["todo.version"] = 1
+    projection.update({f"todo.{field}": 1 for field in item_fields})
+    return projection
+
+
+def project(document, projection=None):
+    """Applies an inclusion projection the way find_one does; _id is always kept."""
+    if projection is None:
+        return copy.deepcopy(document)
+    return {
+        key: copy.deepcopy(value)
+        for key, value in document.items()
+        if key == "_id" or projection.get(key)
+    }
+
+
+class MongoStorage:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """Storage backed by the MongoDB collections of fitness_db."""
+
+    def __init__(self, client, db_name="fitness_db"):
+        self.client = client
+        self.db = client[db_name]
+        self.todo = self.db["todo"]
+        self.exercises = self.db["exercises"]
+        self.users = self.db["users"]
+        self.search_history = self.db["search_history"]
+        self.search_history_daily = self.db["search_history_daily"]
+        self.edit_transcription = self.db["edit_transcription"]
+        self.catalog_meta = self.db["catalog_meta"]
+
+    def ping(self):
+        """Raises ConnectionFailure if the database does not answer."""
+        self.client.admin.command("ping")
+
+    def catalog_version(self):
+        """
+        Identifies the current state of the exercise catalog: the version
+        counter bumped by the importer, the document count and the newest _id.
+        """
+        meta = self.catalog_meta.find_one({"_id": "exercises"}) or {}
+        newest = self.exercises.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+        return {
+            "version": meta.get("version", 0),
+            "count": self.exercises.estimated_document_count(),
+            "max_id": str(newest["_id"]) if newest else None,
+        }
+
+    def iter_exercises(self):
+        """Yields every exercise in _id order."""
+        return self.exercises.find({}).sort("_id", ASCENDING)
+
+    def find_exercises_matching(self, normalized_query: str):
+        """Returns exercises whose stripped name matches the query as a regex."""
+        return list(self.exercises.find(matching_query(normalized_query)))
+
+    def find_exercises_named(self, normalized_query: str):
+        """Returns exercises whose stripped, lowercased name equals the query."""
+        return list(self.exercises.find(named_query(normalized_query)))
+
+    def get_exercise(self, exercise_id: str, projection=None):
+        """Returns the exercise with the given id, or None."""
+        if projection is None:
+            return self.exercises.find_one({"_id": ObjectId(exercise_id)})
+        return self.exercises.find_one({"_id": ObjectId(exercise_id)}, projection)
+
+    def get_todo_document(self, user_id, item_fields=None):
+        """
+        Returns the user's To-Do document, or None. With item_fields, items only
+        carry those fields besides exercise_todo_id and version.
+        """
+        if item_fields is None:
+            return self.todo.find_one({"user_id": user_id})
+        return self.todo.find_one({"user_id": user_id}, todo_projection(item_fields))
+
+    def get_todo_version(self, user_id):
+        """
+        Returns the change counter of the user's To-Do document, bumped by every
+        item change, or None if the user has no To-Do document.
+        """
+        document = self.todo.find_one({"user_id": user_id}, {"version": 1})
+        return None if document is None else document.get("version", 0)
+
+    def _update_todo_version(self, user_id, item_filter, update):
+        """
+        Applies update(new_version) to the user's To-Do document if it is still
+        at the version just read, so every change gets a version of its own to
+        stamp the item with. A change that lost the race to another one is
+        retried at the newer version until it applies; each retry means another
+        change did. Returns the UpdateResult, or None if the user has no To-Do
+        document.
+        """
+        current = self.get_todo_version(user_id)
+        while current is not None:
+            result = self.todo.update_one(
+                {"user_id": user_id, "version": version_filter(current), **item_filter},
+                update(current + 1),
+            )
+            if result.matched_count:
+                return result
+            latest = self.get_todo_version(user_id)
+            # No match with the version unchanged means the item is missing.
+            if latest == current:
+                return result
+            current = latest
+        return None
+
+    def insert_todo_document(self, document):
+        """Creates a To-Do document. Returns its id."""
+        return self.todo.insert_one(versioned_todo_document(document)).inserted_id
+
+    def push_todo_item(self, user_id, item):
+        """Appends an item to the user's To-Do list. Returns True if modified."""
+        result = self._update_todo_version(
+            user_id,
+            {},
+            lambda version: {
+                "$push": {"todo": {**item, "version": version}},
+                "$set": {"version": version},
+            },
+        )
+        return result is not None and result.modified_count > 0
+
+    def pull_todo_item(self, user_id, exercise_todo_id: int):
+        """Removes an item from the user's To-Do list. Returns True if modified."""
+        result = self._update_todo_version(
+            user_id,
+            {"todo.exercise_todo_id": exercise_todo_id},
+            lambda version: {
+                "$pull": {"todo": {"exercise_todo_id": exercise_todo_id}},
+                "$push": {
+                    "removed": {
+                        "$each": [
+                            {"exercise_todo_id": exercise_todo_id, "version": version}
+                        ],
+                        "$slice": -REMOVED_TODO_LIMIT,
+                    }
+                },
+                "$set": {"version": version},
+            },
+        )
+        return result is not None and result.modified_count > 0
+
+    def update_todo_item(self, user_id, exercise_todo_id: int, fields):
+        """Sets fields on one To-Do item. Returns True if the item was found."""
+        result = self._update_todo_version(
+            user_id,
+            {"todo.exercise_todo_id": exercise_todo_id},
+            lambda version: {
+                "$set": {
+                    **{f"todo.$.{name}": value for name, value in fields.items()},
+                    "todo.$.version": version,
+                    "version": version,
+                }
+            },
+        )
+        return result is not None and result.matched_count > 0
+
+    def get_user(self, user_id):
+        """Returns the user with the given id, or None."""
+        return self.users.find_one({"_id": ObjectId(user_id)})
+
+    def find_user_by_name(self, username):
+        """Returns the user with the given username, or None."""
+        return self.users.find_one({"username": username})
+
+    def insert_user(self, document):
+        """Creates a user. Returns its id."""
+        return self.users.insert_one(document).inserted_id
+
+    def update_user(self, user_id, fields):
+        """Sets fields on the user whose _id is user_id."""
+        self.users.update_one({"_id": user_id}, {"$set": fields})
+
+    def insert_search_history(self, entry):
+        """Records one search."""
+        self.search_history.insert_one(entry)
+
+    def insert_search_history_many(self, entries):
+        """
+        Records a batch of searches. insert_many gives each entry its _id, so a
+        retried batch only hits duplicate keys for the entries already written.
+        """
+        try:
+            self.search_history.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                raise
+
+    def find_search_history(self, user_id, limit):
+        """
+        Returns the user's most recent searches, newest first.
+        Served entirely from the user_time_content index.
+        """
+        results = (
+            self.search_history.find(
+                {"user_id": user_id}, {"_id": 0, "user_id": 1, "content": 1, "time": 1}
+            )
+            .sort("time", -1)
+            .limit(limit)
+        )
+        return list(results)
+
+    def ensure_search_history_indexes(
+        self, retention_seconds, bucket_retention_seconds
+    ):
+        """
+        Creates the covering index for history reads and the TTL indexes
+        for raw entries and daily buckets, updating TTLs that have changed.
+        """
+        self.search_history.create_index(
+            [("user_id", ASCENDING), ("time", DESCENDING), ("content", ASCENDING)],
+            name="user_time_content",
+        )
+        self.search_history_daily.create_index(
+            [("user_id", ASCENDING), ("day", DESCENDING)], name="user_day"
+        )
+        for collection, field, seconds in (
+            (self.search_history, "time", retention_seconds),
+            (self.search_history_daily, "day", bucket_retention_seconds),
+        ):
+            name = f"{field}_ttl"
+            try:
+                collection.create_index(field, name=name, expireAfterSeconds=seconds)
+            except OperationFailure:
+                self.db.command(
+                    "collMod",
+                    collection.name,
+                    index={"name": name, "expireAfterSeconds": seconds},
+                )
+
+    def _compact_search_history_batch(self, session, cutoff, batch_size):
+        batch = list(
+            self.search_history.find(
+                {"time": {"$lt": cutoff}},
+                {"user_id": 1, "content": 1, "time": 1},
+                session=session,
+            )
+            .sort("time", 1)
+            .limit(batch_size)
+        )
+        if not batch:
+            return 0
+        updates = [
+            UpdateOne(
+                {"_id": bucket_id(user_id, day)},
+                {
+                    "$inc": {f"counts.{key}": n for key, n in counts.items()},
+                    "$setOnInsert": {"user_id": user_id, "day": day},
+                },
+                upsert=True,
+            )
+            for (user_id, day), counts in daily_buckets(batch).items()
+        ]
+        self.search_history_daily.bulk_write(updates, ordered=False, session=session)
+        self.search_history.delete_many(
+            {"_id": {"$in": [entry["_id"] for entry in batch]}}, session=session
+        )
+        return len(batch)
+
+    def compact_search_history(self, cutoff, batch_size=1000):
+        """
+        Folds entries older than cutoff into per-user daily buckets and
+        removes them from search_history. Returns the number compacted.
+        Each batch is read, counted and deleted in one transaction, so a run
+        that stops part-way never counts an entry twice.
+        """
+        compacted = 0
+        while True:
+            with self.client.start_session() as session:
+                count = session.with_transaction(
+                    lambda s: self._compact_search_history_batch(s, cutoff, batch_size)
+                )
+            if not count:
+                return compacted
+            compacted += count
+
+    def insert_transcription(self, entry):
+        """Records one transcription. Returns its id, or None."""
+        result = self.edit_transcription.insert_one(entry)
+        return result.inserted_id if result.inserted_id else None
+
+    def insert_transcriptions_many(self, entries):
+        """
+        Records a batch of transcriptions. Their _ids are set before the first
+        attempt, so a retried batch only hits duplicate keys for the entries
+        already written.
+        """
+        try:
+            self.edit_transcription.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                raise
+
+
+class MemoryStorage:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    In-process storage with the same semantics as MongoStorage.
+    Documents are copied on the way in and out, as they would be over the wire.
+    """
+
+    def __init__(self, exercises=None):
+        self._lock = threading.Lock()
+        self.exercises = []
+        self.todo = {}
+        self.users = {}
+        self.search_history = []
+        self.search_history_daily = {}
+        self.edit_transcription = []
+        self.catalog_changes = 0
+        for exercise in exercises or []:
+            self.insert_exercise(exercise)
+
+    def ping(self):
+        """Always available."""
+
+    def catalog_version(self):
+        """Identifies the current state of the exercise catalog."""
+        newest = max((exercise["_id"] for exercise in self.exercises), default=None)
+        return {
+            "version": self.catalog_changes,
+            "count": len(self.exercises),
+            "max_id": str(newest) if newest else None,
+        }
+
+    def iter_exercises(self):
+        """Yields every exercise in _id order."""
+        for exercise in sorted(self.exercises, key=lambda exercise: exercise["_id"]):
+            yield copy.deepcopy(exercise)
+
+    def insert_exercise(self, exercise):
+        """Adds an exercise to the catalog. Returns its id."""
+        exercise = copy.deepcopy(exercise)
+        if isinstance(exercise.get("_id"), str):
+            exercise["_id"] = ObjectId(exercise["_id"])
+        exercise.setdefault("_id", ObjectId())
+        with self._lock:
+            self.exercises.append(exercise)
+            self.catalog_changes += 1
+        return exercise["_id"]
+
+    def find_exercises_matching(self, normalized_query: str):
+        """Returns exercises whose stripped name matches the query as a regex."""
+        pattern = re.compile(normalized_query, re.IGNORECASE)
+        return [
+            copy.deepcopy(exercise)
+            for exercise in self.exercises
+            if pattern.search(strip_name(exercise["workout_name"]))
+        ]
+
+    def find_exercises_named(self, normalized_query: str):
+        """Returns exercises whose stripped, lowercased name equals the query."""
+        return [
+            copy.deepcopy(exercise)
+            for exercise in self.exercises
+            if strip_name(exercise["workout_name"]).lower() == normalized_query
+        ]
+
+    def get_exercise(self, exercise_id: str, projection=None):
+        """Returns the exercise with the given id, or None."""
+        object_id = ObjectId(exercise_id)
+        for exercise in self.exercises:
+            if exercise["_id"] == object_id:
+                return project(exercise, projection)
+        return None
+
+    def get_todo_document(self, user_id, item_fields=None):
+        """
+        Returns the user's To-Do document, or None. With item_fields, items only
+        carry those fields besides exercise_todo_id and version.
+        """
+        document = copy.deepcopy(self.todo.get(user_id))
+        if document is None or item_fields is None:
+            return document
+        keep = {"exercise_todo_id", "version", *item_fields}
+        document["todo"] = [
+            {key: value for key, value in item.items() if key in keep}
+            for item in document.get("todo", [])
+        ]
+        return {
+            key: document[key]
+            for key in ("_id", "todo", "version", "removed")
+            if key in document
+        }
+
+    def get_todo_version(self, user_id):
+        """Returns the change counter of the user's To-Do document, or None."""
+        document = self.todo.get(user_id)
+        return None if document is None else document.get("version", 0)
+
+    def insert_todo_document(self, document):
+        """Creates a To-Do document. Returns its id."""
+        document = versioned_todo_document(copy.deepcopy(document))
+        document.setdefault("_id", ObjectId())
+        with self._lock:
+            self.todo.setdefault(document["user_id"], document)
+        return document["_id"]
+
+    def push_todo_item(self, user_id, item):
+        """Appends an item to the user's To-Do list. Returns True if modified."""
+        with self._lock:
+            document = self.todo.get(user_id)
+            if document is None:
+                return False
+            document["version"] = document.get("version", 0) + 1
+            item = {**copy.deepcopy(item), "version": document["version"]}
+            document.setdefault("todo", []).append(item)
+        return True
+
+    def pull_todo_item(self, user_id, exercise_todo_id: int):
+        """Removes an item from the user's To-Do list. Returns True if modified."""
+        with self._lock:
+            document = self.todo.get(user_id)
+            if document is None:
+                return False
+            items = document.get("todo", [])
+            kept = [i for i in items if i.get("exercise_todo_id") != exercise_todo_id]
+            document["todo"] = kept
+            if len(kept) != len(items):
+                document["version"] = document.get("version", 0) + 1
+                removed = document.setdefault("removed", [])
+                removed.append(
+                    {
+                        "exercise_todo_id": exercise_todo_id,
+                        "version": document["version"],
+                    }
+                )
+                del removed[:-REMOVED_TODO_LIMIT]
+        return len(kept) != len(items)
+
+    def update_todo_item(self, user_id, exercise_todo_id: int, fields):
+        """Sets fields on one To-Do item. Returns True if the item was found."""
+        with self._lock:
+            document = self.todo.get(user_id) or {}
+            for item in document.get("todo", []):
+                if item.get("exercise_todo_id") == exercise_todo_id:
+                    document["version"] = document.get("version", 0) + 1
+                    item.update(copy.deepcopy(fields), version=document["version"])
+                    return True
+        return False
+
+    def get_user(self, user_id):
+        """Returns the user with the given id, or None."""
+        return copy.deepcopy(self.users.get(ObjectId(user_id)))
+
+    def find_user_by_name(self, username):
+        """Returns the user with the given username, or None."""
+        for user in self.users.values():
+            if user["username"] == username:
+                return copy.deepcopy(user)
+        return None
+
+    def insert_user(self, document):
+        """Creates a user. Returns its id."""
+        document = copy.deepcopy(document)
+        document.setdefault("_id", ObjectId())
+        with self._lock:
+            self.users[document["_id"]] = document
+        return document["_id"]
+
+    def update_user(self, user_id, fields):
+        """Sets fields on the user whose _id is user_id."""
+        with self._lock:
+            if user_id in self.users:
+                self.users[user_id].update(copy.deepcopy(fields))
+
+    def insert_search_history(self, entry):
+        """Records one search."""
+        with self._lock:
+            self.search_history.append(copy.deepcopy(entry))
+
+    def insert_search_history_many(self, entries):
+        """Records a batch of searches."""
+        with self._lock:
+            self.search_history.extend(copy.deepcopy(entries))
+
+    def find_search_history(self, user_id, limit):
+        """Returns the user's most recent searches, newest first."""
+        # Newest first, with later inserts winning ties on time.
+        history = [
+            {key: entry[key] for key in ("user_id", "content", "time")}
+            for entry in reversed(self.search_history)
+            if entry["user_id"] == user_id
+        ]
+        history.sort(key=lambda entry: entry["time"], reverse=True)
+        return history[:limit]
+
+    def ensure_search_history_indexes(
+        self, retention_seconds, bucket_retention_seconds
+    ):
+        """Nothing to index in memory."""
+
+    def compact_search_history(self, cutoff, batch_size=1000):
+        """
+        Folds entries older than cutoff into per-user daily buckets and
+        removes them from search_history. Returns the number compacted.
+        """
+        del batch_size
+        with self._lock:
+            old = [entry for entry in self.search_history if entry["time"] < cutoff]
+            self.search_history = [
+                entry for entry in self.search_history if entry["time"] >= cutoff
+            ]
+            for (user_id, day), counts in daily_buckets(old).items():
+                bucket = self.search_history_daily.setdefault(
+                    bucket_id(user_id, day),
+                    {"user_id": user_id, "day": day, "counts": Counter()},
+                )
+                bucket["counts"].update(counts)
+        return len(old)
+
+    def insert_transcription(self, entry):
+        """Records one transcription. Returns its id."""
+        entry = copy.deepcopy(entry)
+        entry.setdefault("_id", ObjectId())
+        with self._lock:
+            self.edit_transcription.append(entry)
+        return entry["_id"]
+
+    def insert_transcriptions_many(self, entries):
+        """Records a batch of transcriptions."""
+        with self._lock:
+            self.edit_transcription.extend(copy.deepcopy(entries))
+
+
+def create_storage(client_factory, environ=None):
+    """
+    Returns the backend selected by STORAGE_BACKEND ("mongo" or "memory").
+    MEMORY_STORAGE_SEED may name a JSON file of exercises to load into memory.
+    """
+    environ = os.environ if environ is None else environ
+    backend = environ.get("STORAGE_BACKEND", "mongo")
+    if backend == "memory":
+        exercises = []
+        seed_path = environ.get("MEMORY_STORAGE_SEED")
+        if seed_path:
+            with open(seed_path, encoding="utf-8") as f:
+                exercises = json.load(f)
+        return MemoryStorage(exercises)
+    if backend == "mongo":
+        return MongoStorage(client_factory())
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -1,12 +1,82 @@
 """Test code for web-app"""
 
 # pylint: disable=C0302
-from datetime import datetime
-from unittest.mock import patch, MagicMock
-import subprocess
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from unittest.mock import call, patch, MagicMock
+import filecmp
+import gzip
+import hashlib
+import io
 import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import timeit
 import pytest
+import requests
+from flask import Flask, session as flask_session
 from bson import ObjectId
+from werkzeug.security import generate_password_hash, check_password_hash
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from mongo_pool import mongo_client_options
+from storage import MemoryStorage, MongoStorage
+from exercise_import import import_exercises
+from catalog_snapshot import CatalogSnapshot, SnapshotStorage, write_snapshot
+from search_history_maintenance import run as run_search_history_maintenance
+from write_behind import WriteBehindBuffer
+from request_metrics import METRICS, RequestMetrics
+from benchmarks import benchmark_cases, compare as compare_benchmarks, fastest, measure
+from load_test import (
+    DEFAULT_MIX,
+    FakeSpeechService,
+    compare,
+    converted_clip,
+    summarize,
+    wav_bytes,
+)
+from profiler import SamplingProfiler
+from tracing import SpanExporter, parse_traceparent
+from static_assets import StaticAssets, precompress
+from http_caching import HttpCaching
+from structured_logging import (
+    ErrorRateLimitFilter,
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    RequestIdFilter,
+    init_request_ids,
+    request_id_headers,
+)
+from db_accounting import DB_METRICS, CommandAccounting, query_shape
+from session_store import (
+    MongoSessionStore,
+    ServerSessionInterface,
+    SessionSerializer,
+    SQLiteSessionStore,
+    create_session_interface,
+    load_secret_key,
+    regenerate_session_id,
+)
+from password_hashing import PasswordHasher, PasswordHashingBusy, needs_rehash
+from todo_sync import todo_page
+from audio_pipe import (
+    AudioConversionError,
+    AudioTooLarge,
+    convert_upload,
+    is_native_audio,
+)
+from conversion_scheduler import (
+    CONVERSION_METRICS,
+    ConversionBusy,
+    ConversionScheduler,
+    available_cpus,
+)
+from voice_command import scan_voice_command
+from transcription_analytics import run as run_transcription_analytics
 from app import (
     app,
     search_exercise,
@@ -23,6 +93,10 @@ from app import (
     get_search_history,
     parse_voice_command,
     insert_transcription_entry,
+    search_history_buffer,
+    transcription_buffer,
+    password_hasher,
+    tracer,
 )
 
 
@@ -30,11 +104,222 @@ from app import (
 def client():
     """client fixture"""
     app.config["LOGIN_DISABLED"] = True
-    app.config["UPLOAD_FOLDER"] = "/tmp"
     return app.test_client()
 
 
+@pytest.fixture(autouse=True)
+def inline_password_hashing():
+    """Hash in-process so the patched werkzeug functions are used"""
+    with patch.object(password_hasher, "workers", 0):
+        yield
+
+
+### Test in-memory storage ###
+@patch("app.current_user")
+def test_memory_storage_todo_flow(mock_current_user):
+    """Test the todo helpers end to end on the in-memory backend"""
+    memory = MemoryStorage([{"workout_name": "Push-Up"}, {"workout_name": "Squat"}])
+    mock_current_user.id = "user123"
+    with patch("app.storage", memory):
+        exercise = search_exercise("push up")[0]
+        assert exercise["workout_name"] == "Push-Up"
+        assert search_exercise_rigid("PUSHUP")[0]["_id"] == exercise["_id"]
+
+        assert add_todo(str(exercise["_id"])) is True
+        assert add_todo(str(exercise["_id"])) is True
+        assert [item["exercise_todo_id"] for item in get_todo()] == [1000, 1001]
+
+        assert edit_exercise(1001, "10:00", 20, 3) is True
+        assert get_exercise_in_todo(1001)["weight"] == 20
+        assert delete_todo(1000) is True
+        assert delete_todo(1000) is False
+        assert [item["exercise_todo_id"] for item in get_todo()] == [1001]
+
+
+@patch("app.current_user")
+def test_memory_storage_search_history(mock_current_user):
+    """Test search history ordering and matching on the in-memory backend"""
+    memory = MemoryStorage([{"workout_name": "Squat"}])
+    mock_current_user.id = "user123"
+    with patch("app.storage", memory):
+        add_search_history("push")
+        add_search_history("squat")
+        search_history_buffer.flush()
+        assert [entry["content"] for entry in get_search_history()] == [
+            "squat",
+            "push",
+        ]
+        matches = get_matching_exercises_from_history()
+        assert [match["workout_name"] for match in matches] == ["Squat"]
+
+
+### Test exercise importer ###
+def test_import_exercises_jsonl():
+    """Test the importer validates, derives fields and upserts in batches"""
+    # pylint: disable=protected-access
+    collection = MagicMock()
+    collection.bulk_write.return_value.upserted_count = 2
+    collection.bulk_write.return_value.modified_count = 0
+    stream = io.StringIO(
+        '{"workout_name": "Romanian Dead-Lift", "instruction": "Hinge."}\n'
+        "not json\n"
+        '{"instruction": "no name"}\n'
+        "\n"
+        '{"workout_name": "Push Up"}\n'
+    )
+
+    stats = import_exercises(collection, stream, batch_size=1)
+
+    assert stats == {
+        "read": 4,
+        "imported": 2,
+        "upserted": 4,
+        "modified": 0,
+        "invalid": 2,
+        "backfilled": 0,
+    }
+    assert collection.bulk_write.call_count == 2
+    operation = collection.bulk_write.call_args_list[0][0][0][0]
+    assert operation._filter == {"normalized_name": "romaniandeadlift"}
+    assert operation._doc["$set"]["search_tokens"] == ["romanian", "dead", "lift"]
+    assert collection.bulk_write.call_args.kwargs == {"ordered": False}
+
+
+def test_import_exercises_csv():
+    """Test CSV rows are imported with empty cells dropped"""
+    # pylint: disable=protected-access
+    collection = MagicMock()
+    stream = io.StringIO("workout_name,instruction\nSquat,\n,Missing name\n")
+    stats = import_exercises(collection, stream, file_format="csv")
+    assert stats["imported"] == 1
+    assert stats["invalid"] == 1
+    record = collection.bulk_write.call_args[0][0][0]._doc["$set"]
+    assert record == {
+        "workout_name": "Squat",
+        "normalized_name": "squat",
+        "search_tokens": ["squat"],
+    }
+
+
+def test_import_exercises_backfills_and_skips_unchanged_imports():
+    """Test older exercises get a normalized_name and no-op imports keep the version"""
+    # pylint: disable=protected-access
+    collection = MagicMock()
+    collection.find.side_effect = [
+        [{"normalized_name": "squat"}],
+        MagicMock(
+            sort=MagicMock(
+                return_value=[
+                    {"_id": 1, "workout_name": "Push-Up"},
+                    {"_id": 2, "workout_name": "Push Up"},
+                    {"_id": 3, "workout_name": "Squat"},
+                ]
+            )
+        ),
+    ]
+    collection.bulk_write.return_value.upserted_count = 0
+    collection.bulk_write.return_value.modified_count = 1
+    stream = io.StringIO('{"workout_name": "Push-Up"}\n')
+
+    stats = import_exercises(collection, stream)
+
+    backfill = collection.bulk_write.call_args_list[0][0][0]
+    assert [operation._filter["_id"] for operation in backfill] == [1]
+    assert backfill[0]._doc["$set"]["normalized_name"] == "pushup"
+    assert collection.method_calls.index(
+        call.bulk_write(backfill, ordered=False)
+    ) < collection.method_calls.index(
+        call.create_index(
+            "normalized_name",
+            unique=True,
+            partialFilterExpression={"normalized_name": {"$type": "string"}},
+        )
+    )
+    assert stats["backfilled"] == 1
+    meta = collection.database["catalog_meta"]
+    meta.update_one.assert_called_once()
+
+    meta.update_one.reset_mock()
+    collection.find.side_effect = None
+    collection.bulk_write.return_value.modified_count = 0
+    import_exercises(collection, io.StringIO('{"workout_name": "Push-Up"}\n'))
+    meta.update_one.assert_not_called()
+
+
+### Test catalog snapshot ###
+def test_catalog_snapshot_round_trip(tmp_path):
+    """Test a snapshot answers searches and lookups like the live catalog"""
+    memory = MemoryStorage(
+        [
+            {"workout_name": "Romanian Deadlift", "instruction": "Hinge."},
+            {"workout_name": "Push-Up", "instruction": "Keep a plank."},
+            {"workout_name": "Pull Up"},
+        ]
+    )
+    path = str(tmp_path / "catalog.snapshot")
+    write_snapshot(path, memory.iter_exercises(), memory.catalog_version())
+    snapshot = CatalogSnapshot(path)
+
+    assert snapshot.count == 3
+    assert snapshot.version == memory.catalog_version()
+    for query in ("up", "deadlift", "zzz"):
+        assert snapshot.find_matching(query) == memory.find_exercises_matching(query)
+    assert snapshot.find_named("pushup") == memory.find_exercises_named("pushup")
+    for exercise in memory.iter_exercises():
+        assert snapshot.get(str(exercise["_id"])) == exercise
+        assert snapshot.get(
+            str(exercise["_id"]), {"instruction": 1}
+        ) == memory.get_exercise(str(exercise["_id"]), {"instruction": 1})
+    assert snapshot.get(str(ObjectId())) is None
+
+
+def test_snapshot_storage_refreshes_when_stale(tmp_path):
+    """Test a stale snapshot is rebuilt from the live catalog"""
+    memory = MemoryStorage([{"workout_name": "Squat"}])
+    path = str(tmp_path / "catalog.snapshot")
+    write_snapshot(path, memory.iter_exercises(), memory.catalog_version())
+    wrapped = SnapshotStorage(memory, path, check_interval=3600)
+    wrapped._checked_at = float("inf")  # pylint: disable=protected-access
+    assert wrapped.find_exercises_named("squat")[0]["workout_name"] == "Squat"
+
+    memory.insert_exercise({"workout_name": "Front Squat"})
+    wrapped.check_version()
+    assert wrapped.snapshot.count == 2
+    assert len(wrapped.find_exercises_matching("squat")) == 2
+    assert wrapped.get_todo_document("nobody") is None
+
+
+### Test readiness endpoint ###
+@patch("app.storage.client")
+def test_ready_route(mock_client, client):
+    """Test readiness reports pool counters and database status"""
+    # pylint: disable=redefined-outer-name
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json["status"] == "ready"
+    assert "checked_out" in response.json["pool"]
+    mock_client.admin.command.assert_called_once_with("ping")
+
+    mock_client.admin.command.side_effect = ConnectionFailure("down")
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json["status"] == "unavailable"
+
+
+def test_mongo_client_options():
+    """Test pool settings are read from the environment"""
+    options = mongo_client_options(
+        {"MONGO_MAX_POOL_SIZE": "20", "MONGO_READ_PREFERENCE": "secondaryPreferred"}
+    )
+    assert options["connect"] is False
+    assert options["maxPoolSize"] == 20
+    assert options["readPreference"] == "secondaryPreferred"
+    with pytest.raises(ValueError):
+        mongo_client_options({"MONGO_READ_PREFERENCE": "anywhere"})
+
+
 ### Test edit function ###
+@patch("app.storage.get_todo_version", MagicMock(return_value=1))
 @patch("app.get_exercise_in_todo")
 def test_edit_get_route(mock_get_exercise_in_todo, client):
     """Test edit get route"""
@@ -90,28 +375,99 @@ def test_edit_route(mock_get_exercise_in_todo, mock_edit_exercise, client):
         mock_edit_exercise.assert_called_once_with("123", "30", "70", "15")
 
 
-@patch("app.edit_transcription_collection")
-def test_insert_transcription_entry(mock_edit_transcription_collection):
-    """Test insert_transcription_entry function"""
-    mock_result = MagicMock()
-    mock_result.inserted_id = "mock_id"
-    mock_edit_transcription_collection.insert_one.return_value = mock_result
+@patch("app.transcription_buffer")
+def test_insert_transcription_entry(mock_transcription_buffer):
+    """Test insert_transcription_entry queues the record with its id"""
+    mock_transcription_buffer.put.return_value = True
 
     user_id = "test_user"
     content = "Test transcription content"
-    inserted_id = insert_transcription_entry(user_id, content)
-
-    assert inserted_id == "mock_id"
-
-    mock_edit_transcription_collection.insert_one.assert_called_once()
-    call_args = mock_edit_transcription_collection.insert_one.call_args[0][0]
-    assert call_args["user_id"] == user_id
-    assert call_args["content"] == content
-    assert isinstance(call_args["time"], datetime)
-
-    mock_edit_transcription_collection.insert_one.return_value.inserted_id = None
-    failed_inserted_id = insert_transcription_entry(user_id, content)
-    assert failed_inserted_id is None
+    queued_id = insert_transcription_entry(user_id, content)
+
+    mock_transcription_buffer.put.assert_called_once()
+    entry = mock_transcription_buffer.put.call_args[0][0]
+    assert entry["_id"] == queued_id
+    assert isinstance(queued_id, ObjectId)
+    assert entry["user_id"] == user_id
+    assert entry["content"] == content
+    assert isinstance(entry["time"], datetime)
+
+    mock_transcription_buffer.put.return_value = False
+    assert insert_transcription_entry(user_id, content) is None
+
+
+def test_transcriptions_written_through_buffer():
+    """Test queued transcriptions reach storage with the id returned up front"""
+    memory = MemoryStorage()
+    with patch("app.storage", memory):
+        queued_id = insert_transcription_entry("user123", "set 3 groups")
+        transcription_buffer.flush()
+    assert [entry["_id"] for entry in memory.edit_transcription] == [queued_id]
+
+
+def test_write_behind_buffer_batches_and_drops():
+    """Test the write-behind buffer batches by size and drops when full"""
+    written = []
+    buffer = WriteBehindBuffer(
+        "test", written.append, max_batch=2, flush_interval=60, max_queue=10
+    )
+    for i in range(5):
+        assert buffer.put({"n": i}) is True
+    buffer.flush()
+    assert [len(batch) for batch in written] == [2, 2, 1]
+    buffer.close()
+
+    full = WriteBehindBuffer("full", written.append, max_queue=1)
+    full._ensure_started = lambda: None  # pylint: disable=protected-access
+    assert full.put({"n": 1}) is True
+    assert full.put({"n": 2}) is False
+    assert full.metrics()["dropped"] == 1
+    assert full.metrics()["queue_depth"] == 1
+
+
+def test_write_behind_buffer_retries_failed_batches():
+    """Test a failed batch is retried, and counted as lost after max_retries"""
+    attempts = []
+
+    def flaky(batch):
+        attempts.append(list(batch))
+        if len(attempts) < 3:
+            raise ConnectionFailure("down")
+
+    buffer = WriteBehindBuffer("retry", flaky, max_retries=2, retry_delay=0.001)
+    buffer.put({"n": 1})
+    buffer.flush()
+    assert attempts == [[{"n": 1}]] * 3
+    assert buffer.metrics()["written"] == 1
+    assert buffer.metrics()["write_errors"] == 2
+    buffer.close()
+
+    failing = MagicMock(side_effect=ConnectionFailure("down"))
+    buffer = WriteBehindBuffer("lost", failing, max_retries=1, retry_delay=0.001)
+    buffer.put({"n": 1})
+    buffer.flush()
+    assert failing.call_count == 2
+    assert buffer.metrics()["lost"] == 1
+    buffer.close()
+
+
+def test_mongo_search_history_retry_ignores_written_entries():
+    """Test a retried batch only fails on errors other than duplicate keys"""
+    storage = MongoStorage(MagicMock())
+    duplicate = BulkWriteError({"writeErrors": [{"code": 11000}]})
+    storage.search_history.insert_many.side_effect = duplicate
+    storage.insert_search_history_many([{"content": "push"}])
+
+    other = BulkWriteError({"writeErrors": [{"code": 11000}, {"code": 121}]})
+    storage.search_history.insert_many.side_effect = other
+    with pytest.raises(BulkWriteError):
+        storage.insert_search_history_many([{"content": "push"}])
+
+    storage.edit_transcription.insert_many.side_effect = duplicate
+    storage.insert_transcriptions_many([{"content": "set 3 groups"}])
+    storage.edit_transcription.insert_many.side_effect = other
+    with pytest.raises(BulkWriteError):
+        storage.insert_transcriptions_many([{"content": "set 3 groups"}])
 
 
 ### Test search function ###
@@ -215,7 +571,602 @@ def test_add_route_empty_session(client):
         assert b"const exercisesLength = 0" in response.data
 
 
+### Test server-side sessions ###
+def test_sessions_shared_between_workers(tmp_path):
+    """Test a session written by one app is read by another with the same key"""
+    apps = []
+    for _ in range(2):
+        worker = Flask("worker")
+        worker.secret_key = "shared-key"
+        worker.session_interface = ServerSessionInterface(
+            SQLiteSessionStore(str(tmp_path / "sessions.db"))
+        )
+        worker.add_url_rule("/set", "set", lambda: flask_session.update(n=1) or "")
+        worker.add_url_rule("/get", "get", lambda: str(flask_session.get("n")))
+        apps.append(worker.test_client())
+
+    response = apps[0].get("/set")
+    cookie = response.headers["Set-Cookie"].split(";")[0].split("=", 1)[1]
+    sid = cookie.rsplit(".", 1)[0]
+    # The cookie carries only the signed id of the session stored server-side.
+    assert SQLiteSessionStore(str(tmp_path / "sessions.db")).load(sid) is not None
+    apps[1].set_cookie("localhost", "session", cookie)
+    assert apps[1].get("/get").data == b"1"
+
+    apps[1].set_cookie("localhost", "session", "forged.signature")
+    assert apps[1].get("/get").data == b"None"
+
+
+def test_login_regenerates_session_id(tmp_path):
+    """Test a session id known before login does not carry the login"""
+    worker = Flask("worker")
+    worker.secret_key = "shared-key"
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    worker.session_interface = ServerSessionInterface(store)
+
+    def log_in():
+        regenerate_session_id(flask_session)
+        flask_session["user"] = "alice"
+        return ""
+
+    worker.add_url_rule("/set", "set", lambda: flask_session.update(n=1) or "")
+    worker.add_url_rule("/login", "login", log_in)
+    worker.add_url_rule("/get", "get", lambda: str(flask_session.get("user")))
+    client_ = worker.test_client()
+
+    planted = client_.get("/set").headers["Set-Cookie"].split(";")[0].split("=", 1)[1]
+    client_.set_cookie("localhost", "session", planted)
+    issued = client_.get("/login").headers["Set-Cookie"].split(";")[0].split("=", 1)[1]
+    assert issued != planted
+    assert client_.get("/get").data == b"alice"
+
+    client_.set_cookie("localhost", "session", planted)
+    assert client_.get("/get").data == b"None"
+    assert store.load(planted.rsplit(".", 1)[0]) is None
+
+
+def test_session_serializer_compresses_large_payloads():
+    """Test small sessions stay plain JSON and large ones are compressed"""
+    serializer = SessionSerializer()
+    small = {"_user_id": "abc", "_fresh": True}
+    large = {"results": [{"workout_name": "Push-Up", "_id": str(i)} for i in range(50)]}
+
+    assert serializer.dumps(small).startswith(b"j")
+    assert serializer.dumps(large).startswith(b"z")
+    assert len(serializer.dumps(large)) < len(json.dumps(large))
+    assert serializer.loads(serializer.dumps(small)) == small
+    assert serializer.loads(serializer.dumps(large)) == large
+
+
+def test_sqlite_session_store_expiry(tmp_path):
+    """Test expired sessions are not returned and deleted ones are gone"""
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    future = datetime.now(timezone.utc) + timedelta(hours=1)
+    past = datetime.now(timezone.utc) - timedelta(hours=1)
+    store.save("live", b"jdata", future)
+    store.save("old", b"jdata", past)
+
+    assert store.load("live") == b"jdata"
+    assert store.load("old") is None
+    store.delete("live")
+    assert store.load("live") is None
+
+
+def test_mongo_session_store():
+    """Test the Mongo store upserts with a TTL index and filters expired sessions"""
+    collection = MagicMock()
+    collection.find_one.return_value = {"data": b"jdata"}
+    store = MongoSessionStore(collection)
+    expires_at = datetime.now(timezone.utc)
+
+    store.save("sid", b"jdata", expires_at)
+    store.save("sid", b"jdata", expires_at)
+    collection.create_index.assert_called_once_with("expires_at", expireAfterSeconds=0)
+    assert collection.replace_one.call_args[0][1]["expires_at"] == expires_at
+    assert store.load("sid") == b"jdata"
+    assert "$gt" in collection.find_one.call_args[0][0]["expires_at"]
+
+
+def test_load_secret_key(tmp_path):
+    """Test the secret key comes from the environment or a stable key file"""
+    assert load_secret_key({"SECRET_KEY": "configured"}) == "configured"
+    environ = {"SECRET_KEY_FILE": str(tmp_path / "key")}
+    first = load_secret_key(environ)
+    assert len(first) == 64
+    assert load_secret_key(environ) == first
+
+    instance = tmp_path / "instance"
+    default = load_secret_key({}, str(instance))
+    assert (instance / "secret_key").read_text() == default
+    assert instance.stat().st_mode & 0o777 == 0o700
+
+    (tmp_path / "key").chmod(0o644)
+    with pytest.raises(PermissionError):
+        load_secret_key(environ)
+    (tmp_path / "planted").write_text("attacker-key")
+    os.symlink(tmp_path / "planted", tmp_path / "link")
+    with pytest.raises(OSError):
+        load_secret_key({"SECRET_KEY_FILE": str(tmp_path / "link")})
+
+
+def test_create_session_interface():
+    """Test the session backend selection"""
+    assert isinstance(
+        create_session_interface(MagicMock(), {"SESSION_BACKEND": "mongo"}).store,
+        MongoSessionStore,
+    )
+    with pytest.raises(ValueError):
+        create_session_interface(MemoryStorage(), {"SESSION_BACKEND": "mongo"})
+    with pytest.raises(ValueError):
+        create_session_interface(MemoryStorage(), {"SESSION_BACKEND": "redis"})
+
+
+### Test request metrics ###
+def test_metrics_endpoint(client):
+    """Test requests are recorded per route and served in Prometheus format"""
+    # pylint: disable=redefined-outer-name
+    client.get("/login")
+    client.get("/no-such-page")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_requests_total{method="GET",route="/login",status="200"}' in body
+    assert 'route="<unmatched>",status="404"' in body
+    assert 'http_response_size_bytes_count{route="/login"}' in body
+
+
+def test_request_metrics_merge_thread_shards():
+    """Test observations from many threads are merged into cumulative buckets"""
+    metrics = RequestMetrics()
+    labels = (("method", "GET"), ("route", "/x"))
+
+    def work():
+        for value in (0.001, 0.2, 20):
+            metrics.observe("http_request_duration_seconds", value, labels)
+        metrics.inc("http_requests_total", labels)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    work()
+    body = metrics.render()
+
+    prefix = 'http_request_duration_seconds_bucket{method="GET",route="/x",'
+    assert f'{prefix}le="0.005"}} 5' in body
+    assert f'{prefix}le="0.25"}} 10' in body
+    assert f'{prefix}le="+Inf"}} 15' in body
+    assert 'http_requests_total{method="GET",route="/x"} 5' in body
+
+
+### Test MongoDB command accounting ###
+def test_query_shape_ignores_values():
+    """Test queries differing only in values share a shape"""
+    first = query_shape("find", {"find": "exercises", "filter": {"_id": 1}})
+    second = query_shape("find", {"find": "exercises", "filter": {"_id": 2}})
+    other = query_shape("find", {"find": "exercises", "filter": {"name": 2}})
+    assert first == second
+    assert first != other
+
+
+def test_command_accounting_flags_repeated_queries(caplog):
+    """Test commands are attributed to the request and N+1 patterns reported"""
+    metrics = RequestMetrics({**METRICS, **DB_METRICS})
+    accounting = CommandAccounting(n_plus_one_threshold=3, metrics=metrics)
+    worker = Flask("worker")
+    accounting.init_app(worker)
+
+    def issue(request_id, exercise_id):
+        accounting.started(
+            MagicMock(
+                request_id=request_id,
+                command_name="find",
+                command={"find": "exercises", "filter": {"_id": exercise_id}},
+            )
+        )
+        accounting.succeeded(MagicMock(request_id=request_id, duration_micros=2000))
+
+    @worker.route("/history")
+    def history():
+        for i in range(5):
+            issue(i, i)
+        return str(accounting.current().count)
+
+    issue(99, 0)  # outside a request, ignored
+    response = worker.test_client().get("/history")
+
+    assert response.data == b"5"
+    assert "GET /history: 5 MongoDB commands, 10.0 ms" in caplog.text
+    assert "Possible N+1 in GET /history: 5 commands" in caplog.text
+    body = metrics.render()
+    assert 'mongodb_commands_per_request_sum{route="/history"} 5' in body
+    assert 'mongodb_repeated_queries_total{route="/history"} 1' in body
+
+
+def test_todo_version_counts_changes():
+    """Test the To-Do version moves only when the list actually changes"""
+    memory = MemoryStorage()
+    assert memory.get_todo_version("user123") is None
+    memory.insert_todo_document({"user_id": "user123", "todo": []})
+    assert memory.get_todo_version("user123") == 1
+    memory.push_todo_item("user123", {"exercise_todo_id": 1000})
+    memory.update_todo_item("user123", 1000, {"reps": "3"})
+    memory.pull_todo_item("user123", 999)
+    assert memory.get_todo_version("user123") == 3
+    memory.pull_todo_item("user123", 1000)
+    assert memory.get_todo_version("user123") == 4
+
+
+def test_todo_page_paginates_and_syncs_changes():
+    """Test cursor pages keep one version and since returns only changes"""
+    memory = MemoryStorage()
+    memory.insert_todo_document({"user_id": "user123", "todo": []})
+    for todo_id in range(1000, 1005):
+        memory.push_todo_item("user123", {"exercise_todo_id": todo_id})
+
+    first = todo_page(memory.get_todo_document("user123"), 2)
+    assert [item["exercise_todo_id"] for item in first["items"]] == [1000, 1001]
+    memory.update_todo_item("user123", 1000, {"reps": "3"})
+    second = todo_page(memory.get_todo_document("user123"), 2, first["next_cursor"])
+    assert [item["exercise_todo_id"] for item in second["items"]] == [1002, 1003]
+    assert second["version"] == first["version"] == 6
+
+    memory.pull_todo_item("user123", 1004)
+    changes = todo_page(memory.get_todo_document("user123"), 10, since=6)
+    assert [item["exercise_todo_id"] for item in changes["items"]] == [1000]
+    assert changes["removed"] == [1004]
+    assert changes["version"] == 8
+    assert changes["next_cursor"] is None
+    assert "reset" not in changes
+
+
+def test_todo_page_resets_when_removals_were_forgotten():
+    """Test clients too far behind get the full list with reset"""
+    document = {
+        "version": 500,
+        "todo": [{"exercise_todo_id": 1000, "version": 1}],
+        "removed": [{"exercise_todo_id": i, "version": 300 + i} for i in range(200)],
+    }
+    assert "reset" not in todo_page(document, 10, since=299)
+    stale = todo_page(document, 10, since=10)
+    assert stale["reset"] is True
+    assert len(stale["items"]) == 1
+    assert todo_page(None, 10, since=3)["reset"] is True
+
+
+@patch("app.current_user", new_callable=MagicMock)
+def test_api_todo_projects_fields_and_validates(mock_current_user, client):
+    """Test /api/todo returns the requested fields and rejects bad parameters"""
+    # pylint: disable=redefined-outer-name
+    mock_current_user.id = "user123"
+    memory = MemoryStorage()
+    exercise_id = ObjectId()
+    memory.insert_todo_document(
+        {
+            "user_id": "user123",
+            "todo": [
+                {"exercise_todo_id": 1000, "exercise_id": exercise_id, "reps": "3"}
+            ],
+        }
+    )
+    with patch("app.storage", memory):
+        response = client.get("/api/todo?fields=exercise_id")
+        assert response.get_json()["items"] == [
+            {"exercise_todo_id": 1000, "exercise_id": str(exercise_id), "version": 1}
+        ]
+        for query in ("limit=0", "limit=x", "fields=password", "since=x", "cursor=x"):
+            assert client.get(f"/api/todo?{query}").status_code == 400
+
+
+def test_mongo_todo_update_retries_concurrent_change():
+    """Test a change racing another one is retried at the newer version"""
+    storage = MongoStorage(MagicMock())
+    storage.todo = MagicMock()
+    # Ten changes land between each read and write before this one applies.
+    storage.todo.find_one.side_effect = [{"version": v} for v in range(3, 14)]
+    storage.todo.update_one.side_effect = [MagicMock(matched_count=0)] * 10 + [
+        MagicMock(matched_count=1)
+    ]
+
+    assert storage.update_todo_item("user123", 1000, {"reps": "3"}) is True
+    filters = [
+        call.args[0]["version"] for call in storage.todo.update_one.call_args_list
+    ]
+    assert filters == list(range(3, 14))
+    assert storage.todo.update_one.call_args.args[1]["$set"]["version"] == 14
+
+    storage.todo.find_one.side_effect = [{"version": 3}, {"version": 3}]
+    storage.todo.update_one.side_effect = [MagicMock(matched_count=0)]
+    assert storage.update_todo_item("user123", 999, {"reps": "3"}) is False
+
+
+def test_mongo_todo_document_projection():
+    """Test item fields are projected in the query"""
+    storage = MongoStorage(MagicMock())
+    storage.todo = MagicMock()
+    storage.get_todo_document("user123", ["reps"])
+    storage.todo.find_one.assert_called_once_with(
+        {"user_id": "user123"},
+        {
+            "version": 1,
+            "removed": 1,
+            "todo.exercise_todo_id": 1,
+            "todo.version": 1,
+            "todo.reps": 1,
+        },
+    )
+
+
+@patch("app.current_user", new_callable=MagicMock)
+def test_todo_page_revalidates_without_rendering(mock_current_user, client):
+    """Test an unchanged To-Do list is answered with 304 before it is read"""
+    # pylint: disable=redefined-outer-name
+    mock_current_user.id = "user123"
+    mock_current_user.get_id.return_value = "user123"
+    memory = MemoryStorage()
+    memory.insert_todo_document({"user_id": "user123", "todo": []})
+    with patch("app.storage", memory), patch("app.get_todo", return_value=[]) as read:
+        first = client.get("/todo")
+        assert first.headers["Cache-Control"] == "private, no-cache"
+        etag = first.headers["ETag"]
+        assert etag.startswith("W/")
+
+        repeat = client.get("/todo", headers={"If-None-Match": etag})
+        assert repeat.status_code == 304
+        assert read.call_count == 1
+
+        memory.push_todo_item("user123", {"exercise_todo_id": 1000})
+        changed = client.get("/todo", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+        assert read.call_count == 2
+
+
+def test_http_caching_compresses_and_tags_responses():
+    """Test large text responses are gzipped and body ETags answer 304"""
+    worker = Flask("worker")
+    HttpCaching(min_size=100).init_app(worker)
+    worker.add_url_rule("/big", "big", lambda: {"items": ["Push-Up"] * 100})
+    worker.add_url_rule("/small", "small", lambda: {"ok": True})
+    worker_client = worker.test_client()
+
+    big = worker_client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert big.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in big.headers["Vary"]
+    assert json.loads(gzip.decompress(big.data))["items"][0] == "Push-Up"
+    assert int(big.headers["Content-Length"]) == len(big.data)
+
+    plain = worker_client.get("/big")
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] == big.headers["ETag"]
+    repeat = worker_client.get(
+        "/big",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": big.headers["ETag"]},
+    )
+    assert repeat.status_code == 304
+    assert not repeat.data
+
+    small = worker_client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+
+
+def test_templates_link_fingerprinted_css(client):
+    """Test pages link hashed CSS that is served compressed and immutable"""
+    # pylint: disable=redefined-outer-name
+    page = client.get("/login").data.decode()
+    href = re.search(r'href="(/static/css/style3\.[0-9a-f]{12}\.css)"', page).group(1)
+
+    response = client.get(href, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    with open("static/css/style3.css", "rb") as f:
+        assert gzip.decompress(response.data) == f.read()
+
+    repeat = client.get(
+        href,
+        headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]},
+    )
+    assert repeat.status_code == 304
+    assert not repeat.data
+
+    plain = client.get(href, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+
+
+@patch("app.get_matching_exercises_from_history", return_value=[])
+def test_search_page_loads_pcm_recorder(_mock_get_history, client):
+    """Test the search page loads the recorder and its worklet by hashed name"""
+    # pylint: disable=redefined-outer-name
+    page = client.get("/search").data.decode()
+    for name in ("pcm-recorder", "pcm-downsampler-worklet"):
+        src = re.search(rf'"(/static/js/{name}\.[0-9a-f]{{12}}\.js)"', page).group(1)
+        response = client.get(src)
+        assert response.status_code == 200
+        assert response.mimetype in ("application/javascript", "text/javascript")
+
+
+def test_static_assets_use_matching_precompressed_copies(tmp_path):
+    """Test precompressed files are served only if they match the original"""
+    original = b"body { color: red; }\n" * 50
+    (tmp_path / "site.css").write_bytes(original)
+    assert precompress(str(tmp_path))[0] == str(tmp_path / "site.css.gz")
+    precompressed = gzip.compress(original, compresslevel=1)
+    (tmp_path / "site.css.gz").write_bytes(precompressed)
+    assets = StaticAssets(str(tmp_path))
+    name = assets.build()["site.css"]
+    assert assets.assets[name].variants["gzip"] == precompressed
+    assert "site.css.gz" not in assets.manifest
+
+    # A newer copy of other content, or a corrupt one, is ignored.
+    for stale in (gzip.compress(b"body {}"), b"not gzip"):
+        (tmp_path / "site.css.gz").write_bytes(stale)
+        os.utime(tmp_path / "site.css.gz", (2**31, 2**31))
+        name = assets.build()["site.css"]
+        gzipped = assets.assets[name].variants["gzip"]
+        assert gzip.decompress(gzipped) == original
+
+
+def test_json_formatter_writes_extra_fields_and_request_id():
+    """Test a log record becomes one JSON line with its extra fields"""
+    record = logging.makeLogRecord(
+        {"name": "app", "levelname": "INFO", "levelno": logging.INFO}
+    )
+    record.msg, record.args = "Added %s", ("Push-Up",)
+    record.exercise_id = "abc"
+    record.request_id = "req-1"
+
+    entry = json.loads(JsonFormatter("web-app").format(record))
+
+    assert entry["message"] == "Added Push-Up"
+    assert entry["service"] == "web-app"
+    assert entry["exercise_id"] == "abc"
+    assert entry["request_id"] == "req-1"
+
+
+def test_error_rate_limit_suppresses_repeats():
+    """Test repeated errors are dropped and counted once the limit is reached"""
+    rate_limit = ErrorRateLimitFilter(limit=2, period=60)
+
+    def error(msg="Lookup failed: %s"):
+        return logging.makeLogRecord(
+            {"name": "app", "msg": msg, "levelno": logging.ERROR}
+        )
+
+    assert [rate_limit.filter(error()) for _ in range(4)] == [True, True, False, False]
+    assert rate_limit.filter(error("Other failure"))
+    assert rate_limit.filter(logging.makeLogRecord({"levelno": logging.INFO}))
+
+    rate_limit.period = 0
+    record = error()
+    assert rate_limit.filter(record)
+    assert record.suppressed == 2
+
+
+def test_queue_handler_drops_instead_of_blocking():
+    """Test logging never waits on a full queue"""
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    logger = logging.getLogger("test.nonblocking")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        logger.warning("first", extra={"route": "/search"})
+        logger.warning("second")
+    finally:
+        logger.removeHandler(handler)
+
+    assert handler.dropped == 1
+    queued = handler.queue.get_nowait()
+    assert queued.getMessage() == "first"
+    assert queued.route == "/search"
+
+
+def test_request_id_is_echoed_or_generated():
+    """Test requests get an X-Request-ID that log records and outgoing calls carry"""
+    worker = Flask("worker")
+    init_request_ids(worker)
+    seen = {}
+
+    @worker.route("/")
+    def index():
+        record = logging.makeLogRecord({})
+        RequestIdFilter().filter(record)
+        seen["record"] = record.request_id
+        seen["headers"] = request_id_headers()
+        return "ok"
+
+    worker_client = worker.test_client()
+    response = worker_client.get("/", headers={"X-Request-ID": "abc-123"})
+    assert response.headers["X-Request-ID"] == "abc-123"
+    assert seen == {"record": "abc-123", "headers": {"X-Request-ID": "abc-123"}}
+
+    response = worker_client.get("/", headers={"X-Request-ID": "bad id"})
+    assert len(response.headers["X-Request-ID"]) == 32
+    assert response.headers["X-Request-ID"] == seen["record"]
+    assert not request_id_headers()
+
+
+### Test load test harness ###
+def test_load_test_summary_and_compare():
+    """Test per-route percentiles, throughput and the comparison with a baseline"""
+    samples = {"todo": [(i / 1000, i != 100) for i in range(1, 101)]}
+    summary = summarize(samples, elapsed=2.0)
+
+    assert summary["todo"] == {
+        "count": 100,
+        "errors": 1,
+        "rps": 50.0,
+        "p50_ms": 50.0,
+        "p95_ms": 95.0,
+        "p99_ms": 99.0,
+    }
+    baseline = {"routes": {"todo": dict(summary["todo"], p95_ms=50.0, rps=100.0)}}
+    current = {"routes": {"todo": summary["todo"], "edit": summary["todo"]}}
+    assert compare(baseline, current) == [
+        "todo             p95   +90.0%   rps   -50.0%",
+        "edit             new route",
+    ]
+
+
+def test_fake_speech_service():
+    """Test the stand-in ML client answers like the real /transcribe"""
+    service = FakeSpeechService(latency_ms=1, jitter_ms=0).start()
+    try:
+        response = requests.post(service.url, json={"audio_file": "x.wav"}, timeout=5)
+    finally:
+        service.stop()
+    assert response.status_code == 200
+    assert "transcript" in response.json()
+
+
+### Test micro-benchmark suite ###
+def test_benchmark_compare_flags_regressions():
+    """Test benchmarks slower than the threshold fail against the baseline"""
+    baseline = {
+        "benchmarks": {
+            "fast": {"seconds": 1e-5, "relative": 0.10},
+            "slow": {"seconds": 1e-5, "relative": 0.10},
+            "tiny": {"seconds": 1e-7, "relative": 0.001},
+        }
+    }
+    results = {
+        "benchmarks": {
+            "fast": {"seconds": 1.1e-5, "relative": 0.11},
+            "slow": {"seconds": 2e-5, "relative": 0.20},
+            "new": {"seconds": 1e-5, "relative": 0.10},
+            "tiny": {"seconds": 3e-7, "relative": 0.003},
+        }
+    }
+    lines, regressions = compare_benchmarks(baseline, results, threshold=0.25)
+
+    assert regressions == ["slow", "tiny"]
+    assert lines[1].endswith("+100.0%  REGRESSION")
+    assert lines[2].endswith("(no baseline)")
+    assert lines[3].endswith("+200.0%  REGRESSION")
+    retried = {"benchmarks": {"slow": {"seconds": 1e-5, "relative": 0.105}}}
+    assert fastest(results, retried)["benchmarks"]["slow"]["relative"] == 0.105
+
+
+def test_benchmark_baseline_cases_are_above_timer_noise():
+    """Test every benchmark case has a baseline and takes at least 20 us a call"""
+    with open("benchmark_baseline.json", encoding="utf-8") as f:
+        baseline = json.load(f)["benchmarks"]
+    assert set(baseline) == set(benchmark_cases())
+    assert min(case["seconds"] for case in baseline.values()) >= 20e-6
+
+
+def test_benchmark_measure_relative_to_reference():
+    """Test a heavier function measures slower relative to the reference loop"""
+    _, light = measure(lambda: None, rounds=2, round_time=0.001)
+    _, heavy = measure(lambda: sorted(range(2000)), rounds=2, round_time=0.001)
+    assert 0 < light < heavy
+
+
 ### Test delete route ###
+@patch("app.storage.get_todo_version", MagicMock(return_value=1))
 @patch("app.get_todo")
 def test_delete_exercise_route(mock_get_todo, client):
     """Test delete exercise route"""
@@ -258,7 +1209,7 @@ def test_delete_exercise_id_failure(mock_delete_todo, client):
 
 
 ### Test search_exercise function ###
-@patch("app.exercises_collection")
+@patch("app.storage.exercises")
 @patch("app.normalize_text")
 def test_search_exercise(mock_normalize_text, mock_exercises_collection):
     """Test search exercise."""
@@ -306,7 +1257,7 @@ def test_search_exercise(mock_normalize_text, mock_exercises_collection):
 
 
 ### Test search_exercise_rigid function ###
-@patch("app.exercises_collection")
+@patch("app.storage.exercises")
 @patch("app.normalize_text")
 def test_search_exercise_rigid(mock_normalize_text, mock_exercises_collection):
     """Test search exercise rigid."""
@@ -353,7 +1304,7 @@ def test_search_exercise_rigid(mock_normalize_text, mock_exercises_collection):
 
 
 ### Test get_exercise function ###
-@patch("app.exercises_collection")
+@patch("app.storage.exercises")
 def test_get_exercise(mock_exercises_collection):
     """Test get exercise"""
     random_object_id = ObjectId()
@@ -371,7 +1322,7 @@ def test_get_exercise(mock_exercises_collection):
 
 ### Test get_todo function ###
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_get_todo_with_todo_list(mock_todo_collection, mock_current_user):
     """Test get todo from the todo list"""
     mock_current_user.id = "user123"
@@ -386,7 +1337,7 @@ def test_get_todo_with_todo_list(mock_todo_collection, mock_current_user):
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_get_todo_without_todo_list(mock_todo_collection, mock_current_user):
     """Test get todo without todo list"""
     mock_current_user.id = "user123"
@@ -397,7 +1348,7 @@ def test_get_todo_without_todo_list(mock_todo_collection, mock_current_user):
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_get_todo_with_empty_todo_list(mock_todo_collection, mock_current_user):
     """Test get todo with empty todo list"""
     mock_current_user.id = "user123"
@@ -413,7 +1364,7 @@ def test_get_todo_with_empty_todo_list(mock_todo_collection, mock_current_user):
 
 ### Test delete_todo function ###
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_delete_todo_success(mock_todo_collection, mock_current_user):
     """Test delete todo successful"""
     mock_current_user.id = "user123"
@@ -421,19 +1372,33 @@ def test_delete_todo_success(mock_todo_collection, mock_current_user):
     mock_result = MagicMock()
     mock_result.modified_count = 1
     mock_todo_collection.update_one.return_value = mock_result
+    mock_todo_collection.find_one.return_value = {"version": 3}
 
     exercise_todo_id = ObjectId()
     result = delete_todo(exercise_todo_id)
 
     assert result is True
     mock_todo_collection.update_one.assert_called_once_with(
-        {"user_id": mock_current_user.id},
-        {"$pull": {"todo": {"exercise_todo_id": exercise_todo_id}}},
+        {
+            "user_id": mock_current_user.id,
+            "version": 3,
+            "todo.exercise_todo_id": exercise_todo_id,
+        },
+        {
+            "$pull": {"todo": {"exercise_todo_id": exercise_todo_id}},
+            "$push": {
+                "removed": {
+                    "$each": [{"exercise_todo_id": exercise_todo_id, "version": 4}],
+                    "$slice": -200,
+                }
+            },
+            "$set": {"version": 4},
+        },
     )
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_delete_todo_failure(mock_todo_collection, mock_current_user):
     """Test delete todo fail"""
     mock_current_user.id = "user123"
@@ -441,21 +1406,35 @@ def test_delete_todo_failure(mock_todo_collection, mock_current_user):
     mock_result = MagicMock()
     mock_result.modified_count = 0
     mock_todo_collection.update_one.return_value = mock_result
+    mock_todo_collection.find_one.return_value = {"version": 3}
 
     exercise_todo_id = ObjectId()
     result = delete_todo(exercise_todo_id)
 
     assert result is False
     mock_todo_collection.update_one.assert_called_once_with(
-        {"user_id": mock_current_user.id},
-        {"$pull": {"todo": {"exercise_todo_id": exercise_todo_id}}},
+        {
+            "user_id": mock_current_user.id,
+            "version": 3,
+            "todo.exercise_todo_id": exercise_todo_id,
+        },
+        {
+            "$pull": {"todo": {"exercise_todo_id": exercise_todo_id}},
+            "$push": {
+                "removed": {
+                    "$each": [{"exercise_todo_id": exercise_todo_id, "version": 4}],
+                    "$slice": -200,
+                }
+            },
+            "$set": {"version": 4},
+        },
     )
 
 
 ### Test add_todo function ###
 @patch("app.current_user")
-@patch("app.exercises_collection")
-@patch("app.todo_collection")
+@patch("app.storage.exercises")
+@patch("app.storage.todo")
 def test_add_todo_success(
     mock_todo_collection, mock_exercises_collection, mock_current_user
 ):
@@ -477,7 +1456,7 @@ def test_add_todo_success(
 
     assert result is True
     mock_todo_collection.update_one.assert_called_once_with(
-        {"user_id": "user123"},
+        {"user_id": "user123", "version": {"$in": [0, None]}},
         {
             "$push": {
                 "todo": {
@@ -487,15 +1466,17 @@ def test_add_todo_success(
                     "working_time": None,
                     "reps": None,
                     "weight": None,
+                    "version": 1,
                 }
-            }
+            },
+            "$set": {"version": 1},
         },
     )
 
 
 @patch("app.current_user")
-@patch("app.exercises_collection")
-@patch("app.todo_collection")
+@patch("app.storage.exercises")
+@patch("app.storage.todo")
 def test_add_todo_failure(
     mock_todo_collection, mock_exercises_collection, mock_current_user
 ):
@@ -516,7 +1497,7 @@ def test_add_todo_failure(
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_edit_exercise_success(mock_todo_collection, mock_current_user):
     """Test edit exercise successful"""
     mock_current_user.id = "user123"
@@ -524,6 +1505,7 @@ def test_edit_exercise_success(mock_todo_collection, mock_current_user):
     mock_result = MagicMock()
     mock_result.matched_count = 1
     mock_todo_collection.update_one.return_value = mock_result
+    mock_todo_collection.find_one.return_value = {"version": 3}
 
     exercise_todo_id = 1001
     working_time = 30
@@ -533,19 +1515,25 @@ def test_edit_exercise_success(mock_todo_collection, mock_current_user):
 
     assert result is True
     mock_todo_collection.update_one.assert_called_once_with(
-        {"user_id": "user123", "todo.exercise_todo_id": exercise_todo_id},
+        {
+            "user_id": "user123",
+            "version": 3,
+            "todo.exercise_todo_id": exercise_todo_id,
+        },
         {
             "$set": {
                 "todo.$.working_time": working_time,
                 "todo.$.weight": weight,
                 "todo.$.reps": reps,
+                "todo.$.version": 4,
+                "version": 4,
             }
         },
     )
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_edit_exercise_no_fields_to_update(mock_todo_collection, mock_current_user):
     """Test edit exercise with no update"""
     mock_current_user.id = "user123"
@@ -561,7 +1549,7 @@ def test_edit_exercise_no_fields_to_update(mock_todo_collection, mock_current_us
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_edit_exercise_not_found(mock_todo_collection, mock_current_user):
     """Test edit exercise with no result found"""
     mock_current_user.id = "user123"
@@ -569,6 +1557,7 @@ def test_edit_exercise_not_found(mock_todo_collection, mock_current_user):
     mock_result = MagicMock()
     mock_result.matched_count = 0
     mock_todo_collection.update_one.return_value = mock_result
+    mock_todo_collection.find_one.return_value = {"version": 3}
 
     exercise_todo_id = 1001
     working_time = 20
@@ -578,12 +1567,18 @@ def test_edit_exercise_not_found(mock_todo_collection, mock_current_user):
 
     assert result is False
     mock_todo_collection.update_one.assert_called_once_with(
-        {"user_id": mock_current_user.id, "todo.exercise_todo_id": exercise_todo_id},
+        {
+            "user_id": mock_current_user.id,
+            "version": 3,
+            "todo.exercise_todo_id": exercise_todo_id,
+        },
         {
             "$set": {
                 "todo.$.working_time": working_time,
                 "todo.$.weight": weight,
                 "todo.$.reps": reps,
+                "todo.$.version": 4,
+                "version": 4,
             }
         },
     )
@@ -591,7 +1586,7 @@ def test_edit_exercise_not_found(mock_todo_collection, mock_current_user):
 
 ### Test get_exercise_in_todo function ###
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_get_exercise_in_todo_found(mock_todo_collection, mock_current_user):
     """Test get exercise in todo"""
     mock_current_user.id = "user123"
@@ -630,7 +1625,7 @@ def test_get_exercise_in_todo_found(mock_todo_collection, mock_current_user):
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_get_exercise_in_todo_not_found(mock_todo_collection, mock_current_user):
     """Test get exercise in todo with no results found"""
     mock_current_user.id = "user123"
@@ -658,7 +1653,7 @@ def test_get_exercise_in_todo_not_found(mock_todo_collection, mock_current_user)
 
 
 @patch("app.current_user")
-@patch("app.todo_collection")
+@patch("app.storage.todo")
 def test_get_exercise_in_todo_no_todo_item(mock_todo_collection, mock_current_user):
     """Test get exercise in todo with no todo item"""
     mock_current_user.id = "user123"
@@ -675,7 +1670,7 @@ def test_get_exercise_in_todo_no_todo_item(mock_todo_collection, mock_current_us
 
 
 ### Test get_instruction function ###
-@patch("app.exercises_collection")
+@patch("app.storage.exercises")
 def test_get_instruction_with_instruction(mock_exercises_collection):
     """Test get instructions with instruction"""
     random_exercise_id = ObjectId("507f1f77bcf86cd799439011")
@@ -698,7 +1693,7 @@ def test_get_instruction_with_instruction(mock_exercises_collection):
     )
 
 
-@patch("app.exercises_collection")
+@patch("app.storage.exercises")
 def test_get_instruction_without_instruction(mock_exercises_collection):
     """Test get instruction without instruction"""
     random_exercise_id = ObjectId("507f1f77bcf86cd799439011")
@@ -717,7 +1712,7 @@ def test_get_instruction_without_instruction(mock_exercises_collection):
     )
 
 
-@patch("app.exercises_collection")
+@patch("app.storage.exercises")
 def test_get_instruction_not_found(mock_exercises_collection):
     """Test get instruction with no result found"""
     mock_exercises_collection.find_one.return_value = None
@@ -809,7 +1804,7 @@ def test_register_missing_username_password(client):
 
 
 # existing username
-@patch("app.users_collection.find_one")
+@patch("app.storage.users.find_one")
 def test_register_existing_username(mock_find_one, client):
     """Test register with existing usernamepy"""
     # pylint: disable=redefined-outer-name
@@ -823,9 +1818,9 @@ def test_register_existing_username(mock_find_one, client):
 
 
 # successful registration
-@patch("app.users_collection.find_one")
-@patch("app.users_collection.insert_one")
-@patch("app.todo_collection.insert_one")
+@patch("app.storage.users.find_one")
+@patch("app.storage.users.insert_one")
+@patch("app.storage.todo.insert_one")
 @patch("app.generate_password_hash")
 def test_register_successful(
     mock_generate_password_hash,
@@ -885,7 +1880,7 @@ def test_signup_page(client):
 
 
 ### Test login function ###
-@patch("app.users_collection.find_one")
+@patch("app.storage.users.find_one")
 @patch("app.check_password_hash")
 @patch("app.login_user")
 def test_login_success(
@@ -909,7 +1904,7 @@ def test_login_success(
 
 
 # Invalid username
-@patch("app.users_collection.find_one")
+@patch("app.storage.users.find_one")
 def test_login_invalid_username(mock_find_one, client):
     """Test login with invalid username"""
     # pylint: disable=redefined-outer-name
@@ -927,7 +1922,7 @@ def test_login_invalid_username(mock_find_one, client):
 
 
 # Invalid password
-@patch("app.users_collection.find_one")
+@patch("app.storage.users.find_one")
 @patch("app.check_password_hash")
 def test_login_invalid_password(mock_check_password_hash, mock_find_one, client):
     """Test login with invalid password"""
@@ -950,17 +1945,110 @@ def test_login_invalid_password(mock_check_password_hash, mock_find_one, client)
     }
 
 
+@patch("app.storage.users.find_one")
+def test_login_rejected_when_hashing_busy(mock_find_one, client):
+    """Test login fails fast with 503 when the hashing pool is saturated"""
+    # pylint: disable=redefined-outer-name
+    mock_find_one.return_value = {
+        "_id": "mock_user_id",
+        "username": "testuser",
+        "password": "hashed_password",
+    }
+    with patch.object(password_hasher, "run", side_effect=PasswordHashingBusy()):
+        response = client.post(
+            "/login", data={"username": "testuser", "password": "testpassword"}
+        )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json["success"] is False
+
+
+def test_password_hasher_queue_limit():
+    """Test calls beyond the worker and queue slots are rejected"""
+    hasher = PasswordHasher(workers=0, max_queue=0)
+
+    def reenter():
+        return hasher.run(len, "x")
+
+    with pytest.raises(PasswordHashingBusy):
+        hasher.run(reenter)
+    assert hasher.run(len, "abc") == 3
+
+
+def test_password_hasher_process_pool():
+    """Test hashes computed on the pool verify in-process"""
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    try:
+        stored = hasher.run(
+            generate_password_hash, "secret", method="pbkdf2:sha256:1000"
+        )
+    finally:
+        hasher.shutdown()
+    assert check_password_hash(stored, "secret")
+
+
+def test_password_hasher_timeout_keeps_slot_until_done():
+    """Test a timed-out call holds its slot until the worker finishes it"""
+    hasher = PasswordHasher(workers=1, max_queue=0, timeout=0.01)
+    running, done = Future(), Future()
+    done.set_result("hash")
+    pool = MagicMock()
+    pool.submit.side_effect = [running, done]
+
+    with patch.object(hasher, "_get_pool", return_value=pool):
+        running.set_running_or_notify_cancel()
+        with pytest.raises(PasswordHashingBusy, match="timed out"):
+            hasher.run(len, "x")
+        with pytest.raises(PasswordHashingBusy, match="Too many"):
+            hasher.run(len, "x")
+        running.set_result(1)
+        assert hasher.run(len, "x") == "hash"
+
+
+def test_needs_rehash():
+    """Test hashes with older methods or fewer iterations are upgraded"""
+    method = "pbkdf2:sha256:600000"
+    assert needs_rehash("pbkdf2:sha256:260000$salt$hash", method)
+    assert needs_rehash("scrypt:32768:8:1$salt$hash", method)
+    assert not needs_rehash("pbkdf2:sha256:600000$salt$hash", method)
+    assert not needs_rehash("pbkdf2:sha256$salt$hash", "pbkdf2:sha256")
+    assert not needs_rehash("hashed_password", method)
+
+
+@patch("app.login_user")
+def test_login_upgrades_password_hash(mock_login_user, client):
+    """Test a successful login rehashes a password stored with fewer iterations"""
+    # pylint: disable=redefined-outer-name
+    memory = MemoryStorage()
+    old_hash = generate_password_hash("testpassword", method="pbkdf2:sha256:1000")
+    user_id = memory.insert_user({"username": "testuser", "password": old_hash})
+    with patch("app.storage", memory), patch(
+        "app.PASSWORD_HASH_METHOD", "pbkdf2:sha256:2000"
+    ):
+        response = client.post(
+            "/login", data={"username": "testuser", "password": "testpassword"}
+        )
+
+    assert response.status_code == 200
+    mock_login_user.assert_called_once()
+    new_hash = memory.get_user(user_id)["password"]
+    assert new_hash.startswith("pbkdf2:sha256:2000$")
+    assert check_password_hash(new_hash, "testpassword")
+
+
 @patch("app.current_user")
-@patch("app.search_history_collection")
+@patch("app.storage.search_history")
 def test_add_search_history(mock_search_history_collection, mock_current_user):
     """Test adding search history."""
     mock_current_user.id = "user123"
 
     content = "Test Search Content"
     add_search_history(content)
-    mock_search_history_collection.insert_one.assert_called_once()
+    search_history_buffer.flush()
+    mock_search_history_collection.insert_many.assert_called_once()
 
-    inserted_entry = mock_search_history_collection.insert_one.call_args[0][0]
+    inserted_entry = mock_search_history_collection.insert_many.call_args[0][0][0]
 
     assert inserted_entry["user_id"] == "user123"
     assert inserted_entry["content"] == content
@@ -968,7 +2056,7 @@ def test_add_search_history(mock_search_history_collection, mock_current_user):
 
 
 @patch("app.current_user")
-@patch("app.search_history_collection")
+@patch("app.storage.search_history")
 def test_get_search_history(mock_search_history_collection, mock_current_user):
     """Test getting search history"""
     mock_current_user.id = "user123"
@@ -984,7 +2072,8 @@ def test_get_search_history(mock_search_history_collection, mock_current_user):
             "time": datetime(2024, 11, 12, 11, 0, 0),
         },
     ]
-    mock_search_history_collection.find.return_value.sort.return_value = mock_results
+    mock_find = mock_search_history_collection.find
+    mock_find.return_value.sort.return_value.limit.return_value = mock_results
 
     history = get_search_history()
 
@@ -994,8 +2083,70 @@ def test_get_search_history(mock_search_history_collection, mock_current_user):
     mock_search_history_collection.find.assert_called_once_with(
         {"user_id": "user123"}, {"_id": 0, "user_id": 1, "content": 1, "time": 1}
     )
+    mock_find.return_value.sort.assert_called_once_with("time", -1)
+    mock_find.return_value.sort.return_value.limit.assert_called_once_with(20)
+
+
+def test_compact_search_history_memory():
+    """Test old searches are folded into per-user daily buckets"""
+    memory = MemoryStorage()
+    memory.insert_search_history_many(
+        [
+            {"user_id": "u1", "content": "Push Up", "time": datetime(2024, 1, 1, 8)},
+            {"user_id": "u1", "content": "push-up", "time": datetime(2024, 1, 1, 9)},
+            {"user_id": "u1", "content": "squat", "time": datetime(2024, 1, 2, 9)},
+            {"user_id": "u2", "content": "squat", "time": datetime(2024, 1, 9, 9)},
+        ]
+    )
+    compacted = run_search_history_maintenance(
+        memory, environ={}, now=datetime(2024, 1, 10)
+    )
+
+    assert compacted == 3
+    assert memory.search_history_daily["u1:2024-01-01"]["counts"] == {"pushup": 2}
+    assert memory.search_history_daily["u1:2024-01-02"]["counts"] == {"squat": 1}
+    assert len(memory.find_search_history("u2", 20)) == 1
+    assert memory.find_search_history("u1", 20) == []
+
+
+def test_compact_search_history_mongo():
+    """Test Mongo compaction folds and removes each batch in a transaction"""
+    # pylint: disable=protected-access
+    collection_client = MagicMock()
+    session = collection_client.start_session.return_value.__enter__.return_value
+    session.with_transaction.side_effect = lambda callback: callback(session)
+    mongo = MongoStorage(collection_client)
+    entry_id = ObjectId()
+    mongo.search_history = MagicMock()
+    mongo.search_history_daily = MagicMock()
+    mongo.search_history.find.return_value.sort.return_value.limit.side_effect = [
+        [
+            {
+                "_id": entry_id,
+                "user_id": "u1",
+                "content": "Squat",
+                "time": datetime(2024, 1, 1),
+            }
+        ],
+        [],
+    ]
+
+    assert mongo.compact_search_history(datetime(2024, 1, 8)) == 1
+    assert session.with_transaction.call_count == 2
+    assert mongo.search_history.find.call_args.kwargs == {"session": session}
+    update = mongo.search_history_daily.bulk_write.call_args[0][0][0]
+    assert update._filter == {"_id": "u1:2024-01-01"}
+    assert update._doc["$inc"] == {"counts.squat": 1}
+    assert mongo.search_history_daily.bulk_write.call_args.kwargs == {
+        "ordered": False,
+        "session": session,
+    }
+    mongo.search_history.delete_many.assert_called_once_with(
+        {"_id": {"$in": [entry_id]}}, session=session
+    )
 
 
+@patch("app.catalog_version.get", MagicMock(return_value={"version": 1}))
 @patch("app.get_exercise")
 def test_instructions_route(mock_get_exercise, client):
     # pylint: disable=redefined-outer-name
@@ -1019,6 +2170,161 @@ def test_instructions_route(mock_get_exercise, client):
     )
 
 
+### Test tracing ###
+def test_parse_traceparent():
+    """Test W3C traceparent parsing"""
+    trace_id, span_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    assert parse_traceparent(f"00-{trace_id}-{span_id}-01") == (
+        trace_id,
+        span_id,
+        True,
+    )
+    assert parse_traceparent(f"00-{trace_id}-{span_id}-00")[2] is False
+    assert parse_traceparent(f"00-{'0' * 32}-{span_id}-01") is None
+    assert parse_traceparent("garbage") is None
+    assert parse_traceparent(None) is None
+
+
+@patch("app.edit_exercise")
+@patch("app.requests.post")
+def test_process_audio_trace(mock_post, mock_edit_exercise, client, tmp_path):
+    """Test a voice edit is traced stage by stage and the context is propagated"""
+    # pylint: disable=redefined-outer-name
+    mock_post.return_value.json.return_value = {"transcript": "5 minutes 3 sets"}
+    mock_edit_exercise.return_value = True
+    exporter = SpanExporter("web-app", path=str(tmp_path / "spans.jsonl"))
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+    with patch.object(tracer, "exporter", exporter):
+        response = client.post(
+            "/process-audio?exercise_todo_id=1000",
+            data={"audio": (io.BytesIO(wav_bytes(0.1)), "trace_test.wav")},
+            content_type="multipart/form-data",
+            headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+        )
+    exporter.flush()
+
+    assert response.status_code == 200
+    with open(tmp_path / "spans.jsonl", encoding="utf-8") as f:
+        payload = json.loads(f.readline())
+    resource = payload["resourceSpans"][0]
+    assert resource["resource"]["attributes"][0]["value"]["stringValue"] == "web-app"
+    spans = {span["name"]: span for span in resource["scopeSpans"][0]["spans"]}
+    assert set(spans) == {
+        "convert audio",
+        "POST /transcribe",
+        "parse voice command",
+        "update exercise",
+        "POST /process-audio",
+    }
+    assert {span["traceId"] for span in spans.values()} == {trace_id}
+    server = spans["POST /process-audio"]
+    assert server["parentSpanId"] == "00f067aa0ba902b7"
+    assert spans["convert audio"]["parentSpanId"] == server["spanId"]
+    sent = parse_traceparent(mock_post.call_args.kwargs["headers"]["traceparent"])
+    assert sent[:2] == (trace_id, spans["POST /transcribe"]["spanId"])
+
+
+def test_untraced_request_has_no_spans(client):
+    """Test tracing stays off without an exporter"""
+    # pylint: disable=redefined-outer-name,unused-argument
+    assert tracer.exporter is None
+    with app.test_request_context():
+        assert not tracer.headers()
+        with tracer.span("anything") as span:
+            assert span is None
+
+
+### Test sampling profiler ###
+def profiled_app(profiler):
+    """A Flask app with a slow and a fast route under the profiler"""
+    worker = Flask("worker")
+    profiler.init_app(worker, admin_token="secret")
+
+    def busy_wait(seconds):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+
+    worker.add_url_rule("/slow", "slow", lambda: busy_wait(0.1) or "done")
+    worker.add_url_rule("/fast", "fast", lambda: "done")
+    return worker.test_client()
+
+
+def test_profiler_keeps_slow_requests(tmp_path):
+    """Test only requests over the latency threshold are kept, as folded stacks"""
+    profiler = SamplingProfiler(str(tmp_path), interval=0.001)
+    client_ = profiled_app(profiler)
+    headers = {"X-Admin-Token": "secret"}
+
+    assert client_.post("/admin/profiler", json={"enabled": True}).status_code == 403
+    client_.post(
+        "/admin/profiler",
+        json={"enabled": True, "sample_rate": 0, "slow_ms": 50},
+        headers=headers,
+    )
+    client_.get("/slow")
+    client_.get("/fast")
+
+    status = client_.get("/admin/profiler", headers=headers).json
+    assert set(status["samples"]) == {"/slow"}
+    folded = client_.get("/admin/profiler/folded?route=/slow", headers=headers)
+    assert "test.py:busy_wait" in folded.get_data(as_text=True)
+    hottest = folded.get_data(as_text=True).splitlines()[0]
+    assert int(hottest.rsplit(" ", 1)[1]) > 0
+
+    client_.post("/admin/profiler", json={"enabled": False}, headers=headers)
+    assert (tmp_path / f"slow.{os.getpid()}.folded").exists()
+
+
+def test_profiler_toggle_shared_between_workers(tmp_path):
+    """Test a toggle made in one worker is picked up by another"""
+    first = SamplingProfiler(str(tmp_path))
+    second = SamplingProfiler(str(tmp_path))
+    first.configure(enabled=True, sample_rate=1.0)
+    # pylint: disable-next=protected-access
+    second._reload()
+    assert second.settings["enabled"] is True
+    assert second.settings["sample_rate"] == 1.0
+    first.configure(enabled=False)
+    second.configure(enabled=False)
+
+
+def test_profiler_rejects_invalid_settings(tmp_path):
+    """Test bad settings get 400 and bad shared settings are ignored"""
+    profiler = SamplingProfiler(str(tmp_path))
+    client_ = profiled_app(profiler)
+    headers = {"X-Admin-Token": "secret"}
+
+    for body in (
+        {"enabled": True, "sample_rate": "abc"},
+        {"enabled": True, "sample_rate": 1.5},
+        {"enabled": "yes"},
+        {"slow_ms": -1},
+        [1, 2],
+    ):
+        response = client_.post("/admin/profiler", json=body, headers=headers)
+        assert response.status_code == 400
+    assert profiler.settings["enabled"] is False
+
+    response = client_.post(
+        "/admin/profiler",
+        json={"enabled": "false", "sample_rate": "0.5", "slow_ms": "100"},
+        headers=headers,
+    )
+    assert response.json["settings"] == {
+        "enabled": False,
+        "sample_rate": 0.5,
+        "slow_ms": 100.0,
+    }
+    assert client_.get("/fast").status_code == 200
+
+    (tmp_path / "profiler.json").write_text('{"enabled": true, "sample_rate": "x"}')
+    other = SamplingProfiler(str(tmp_path))
+    other._reload()  # pylint: disable=protected-access
+    assert other.settings["enabled"] is False
+
+
 ### Test upload_audio function ###
 @patch("app.call_speech_to_text_service")
 def test_upload_audio_conversion_error(mock_transcribe, client):
@@ -1046,22 +2352,60 @@ def test_upload_audio_no_file(client):
     assert response.json["error"] == "No audio file uploaded"
 
 
-@patch("subprocess.run")
-def test_upload_audio_success(mock_subprocess, client):
+# Stands in for ffmpeg: copies stdin to stdout, or fails on input starting "bad".
+FAKE_FFMPEG = [
+    sys.executable,
+    "-c",
+    "import sys; data = sys.stdin.buffer.read(); "
+    "sys.stdout.buffer.write(data); sys.exit(data.startswith(b'bad'))",
+]
+
+
+@patch("audio_pipe.FFMPEG_COMMAND", FAKE_FFMPEG)
+@patch("app.call_speech_to_text_service")
+def test_upload_audio_success(mock_transcribe, client):
     # pylint: disable=redefined-outer-name
     """Test successful audio upload with mocked transcription."""
-    mock_subprocess.run.side_effect = subprocess.CalledProcessError(1, "ffmpeg")
-    test_audio_path = "/tmp/test_audio.mp3"
-    with open(test_audio_path, "wb") as f:
-        f.write(b"dummy audio data")
+    mock_transcribe.return_value = "Mocked transcription"
+    data = {"audio": (io.BytesIO(b"dummy audio data"), "test_audio.mp3")}
+    response = client.post(
+        "/upload-audio", data=data, content_type="multipart/form-data"
+    )
 
-    with open(test_audio_path, "rb") as audio_file:
-        data = {"audio": (audio_file, "test_audio.mp3")}
+    assert response.status_code == 200
+    assert response.json == {"transcription": "Mocked transcription"}
+    sent = mock_transcribe.call_args.args[0]
+    assert sent[:4] == b"RIFF" and sent[44:] == b"dummy audio data"
+
+
+@patch("app.call_speech_to_text_service")
+def test_upload_audio_too_large(mock_transcribe, client):
+    # pylint: disable=redefined-outer-name
+    """Test uploads over AUDIO_MAX_BYTES are rejected without transcription."""
+    data = {"audio": (io.BytesIO(wav_bytes(0.1)), "big.wav")}
+    with patch.dict(app.config, {"AUDIO_MAX_BYTES": 1000}):
         response = client.post(
             "/upload-audio", data=data, content_type="multipart/form-data"
         )
 
-    assert response.status_code == 200
+    assert response.status_code == 413
+    mock_transcribe.assert_not_called()
+
+
+@patch("app.call_speech_to_text_service")
+def test_upload_audio_body_over_content_limit(mock_transcribe, client):
+    # pylint: disable=redefined-outer-name
+    """Test request bodies over MAX_CONTENT_LENGTH are refused before parsing."""
+    data = {"audio": (io.BytesIO(wav_bytes(0.1)), "big.wav")}
+    with patch.dict(app.config, {"MAX_CONTENT_LENGTH": 1000}):
+        response = client.post(
+            "/upload-audio", data=data, content_type="multipart/form-data"
+        )
+
+    assert response.status_code == 413
+    assert response.get_json() == {"error": "Audio file is too large"}
+    mock_transcribe.assert_not_called()
+    assert app.config["MAX_CONTENT_LENGTH"] > app.config["AUDIO_MAX_BYTES"]
 
 
 def test_upload_audio_transcription_error(client):
@@ -1080,7 +2424,160 @@ def test_upload_audio_transcription_error(client):
     assert response.status_code == 500, "Expected server error for failed transcription"
 
 
+@patch("audio_pipe.FFMPEG_COMMAND", FAKE_FFMPEG)
+def test_convert_upload_pipes_through_ffmpeg():
+    """Test uploads are hashed and piped through ffmpeg unless natively readable."""
+    with patch("audio_pipe.subprocess.Popen") as mock_popen:
+        flac = b"fLaC" + b"\x00" * 40
+        upload = convert_upload(io.BytesIO(flac), 1000)
+        assert (upload.content, upload.converted) == (flac, False)
+        opus_head = b"OpusHead\x01\x01" + b"\x00" * 9
+        ogg_opus = b"OggS" + b"\x00" * 24 + opus_head
+        assert not convert_upload(io.BytesIO(ogg_opus), 1000).converted
+        webm_opus = b"\x1a\x45\xdf\xa3" + b"\x00" * 100 + b"A_OPUS" + opus_head
+        assert convert_upload(io.BytesIO(webm_opus), 1000).content == webm_opus
+        mock_popen.assert_not_called()
+
+    assert not is_native_audio(b"OggS" + b"\x00" * 24 + b"\x01vorbis")
+    assert not is_native_audio(b"\x1a\x45\xdf\xa3" + b"\x00" * 100 + b"A_VORBIS")
+
+    data = b"compressed audio" * 10000
+    upload = convert_upload(io.BytesIO(data), 200000)
+    assert upload.converted
+    assert upload.content[:4] == b"RIFF" and upload.content[8:16] == b"WAVEfmt "
+    assert int.from_bytes(upload.content[40:44], "little") == len(data)
+    assert upload.content[44:] == data
+    assert upload.size == len(data)
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+
+    with pytest.raises(AudioTooLarge):
+        convert_upload(io.BytesIO(data), len(data) - 1)
+    with pytest.raises(AudioConversionError):
+        convert_upload(io.BytesIO(b"bad audio data"), 1000)
+    with patch("audio_pipe.FFMPEG_COMMAND", ["/nonexistent/ffmpeg"]):
+        with pytest.raises(AudioConversionError):
+            convert_upload(io.BytesIO(b"dummy audio data"), 1000)
+
+
+@patch("audio_pipe.FFMPEG_COMMAND", FAKE_FFMPEG)
+@patch("app.call_speech_to_text_service", MagicMock(return_value="set 3 groups"))
+def test_load_test_audio_uploads(client):
+    """Test the load test's upload clips take the pass-through and ffmpeg paths"""
+    # pylint: disable=redefined-outer-name
+    clips = {"upload_audio": wav_bytes(0.1), "upload_converted": converted_clip(0.1)}
+    assert is_native_audio(clips["upload_audio"][:36])
+    assert not is_native_audio(clips["upload_converted"][:36])
+    for clip in clips.values():
+        response = client.post(
+            "/upload-audio",
+            data={"audio": (io.BytesIO(clip), "recording.wav")},
+            content_type="multipart/form-data",
+        )
+        assert response.get_json() == {"transcription": "set 3 groups"}
+    assert set(clips) <= set(DEFAULT_MIX)
+
+
+def test_conversion_scheduler_bounds_running_and_waiting():
+    """Test conversions beyond the cap wait, then time out or are turned away"""
+    metrics = RequestMetrics(CONVERSION_METRICS)
+    scheduler = ConversionScheduler(1, max_queue=1, wait_timeout=0.2, metrics=metrics)
+    holding, release = threading.Event(), threading.Event()
+
+    def hold():
+        with scheduler.slot():
+            holding.set()
+            release.wait(5)
+
+    def wait_for_slot(outcome):
+        try:
+            with scheduler.slot():
+                outcome.append("ran")
+        except ConversionBusy:
+            outcome.append("timed out")
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    holding.wait(5)
+    outcome = []
+    waiter = threading.Thread(target=wait_for_slot, args=(outcome,))
+    waiter.start()
+    while scheduler.snapshot()["waiting"] == 0:
+        time.sleep(0.001)
+    with pytest.raises(ConversionBusy):
+        with scheduler.slot():
+            pass
+    waiter.join()
+    release.set()
+    holder.join()
+    assert outcome == ["timed out"]
+
+    with scheduler.slot():
+        assert scheduler.snapshot()["running"] == 1
+    assert scheduler.snapshot() == {
+        "waiting": 0,
+        "running": 0,
+        "rejected": 2,
+        "max_running": 1,
+        "max_queue": 1,
+    }
+    body = metrics.render()
+    assert 'audio_conversions_rejected_total{reason="queue_full"} 1' in body
+    assert 'audio_conversions_rejected_total{reason="timeout"} 1' in body
+    assert "audio_conversion_duration_seconds_count 2" in body
+    assert "audio_conversion_wait_seconds_count 3" in body
+
+
+def test_available_cpus_honours_cgroup_quota(tmp_path):
+    """Test the conversion cap follows the container's CPU quota"""
+    cpu_max = tmp_path / "cpu.max"
+    cpu_max.write_text("max 100000\n")
+    cpus = available_cpus(str(cpu_max))
+    assert cpus >= 1
+    cpu_max.write_text("50000 100000\n")
+    assert available_cpus(str(cpu_max)) == 1
+    assert available_cpus(str(tmp_path / "missing")) == cpus
+
+
+@patch("app.convert_upload", side_effect=ConversionBusy("full"))
+def test_upload_audio_busy(_mock_convert_upload, client):
+    # pylint: disable=redefined-outer-name
+    """Test uploads get 503 with Retry-After when no conversion slot is free."""
+    data = {"audio": (io.BytesIO(b"dummy audio data"), "test_audio.mp3")}
+    response = client.post(
+        "/upload-audio", data=data, content_type="multipart/form-data"
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
 ### Test parse_voice_command function ###
+def test_parse_voice_command_corpus():
+    """Test parse_voice_command against the labeled command corpus."""
+    corpus_path = os.path.join(os.path.dirname(__file__), "voice_command_corpus.json")
+    with open(corpus_path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    for entry in corpus:
+        assert parse_voice_command(entry["text"]) == entry["expected"], entry["text"]
+
+
+def test_scan_voice_command_spans():
+    """Test that the scanner reports the consumed spans and units."""
+    transcription = "Set twenty kilos for 3 groups"
+    matches = scan_voice_command(transcription)
+    assert [m["field"] for m in matches] == ["weight", "groups"]
+    assert matches[0]["unit"] == "kilos"
+    start, end = matches[0]["span"]
+    assert transcription[start:end] == "twenty kilos"
+
+
+def test_parse_voice_command_speed():
+    """Micro-benchmark: parsing a command should stay well under a millisecond."""
+    transcription = "Set 15 minutes, 4 groups, and weight of twenty five kilograms."
+    runs = 2000
+    elapsed = timeit.timeit(lambda: parse_voice_command(transcription), number=runs)
+    assert elapsed / runs < 0.001
+
+
 def test_parse_voice_command():
     """Test the parse_voice_command function."""
     transcription = "Use 25 kilograms for the workout."
@@ -1097,6 +2594,47 @@ def test_parse_voice_command():
     assert result == {"time": 10, "groups": 3, "weight": 50}
 
 
+### Test transcription analytics ###
+def test_transcription_analytics_resumes_from_last_id():
+    """Test that analytics aggregates new transcriptions after last_id."""
+    first_id, second_id, last_id = ObjectId(), ObjectId(), ObjectId()
+    db = MagicMock()
+    analytics = db["transcription_analytics"]
+    analytics.find_one.return_value = {"last_id": first_id}
+    db[
+        "edit_transcription"
+    ].find.return_value.sort.return_value.batch_size.return_value = [
+        {"_id": second_id, "user_id": "u1", "content": "set 20 kg for 3 groups"},
+        {"_id": last_id, "user_id": "u2", "content": "hello there"},
+    ]
+
+    processed = run_transcription_analytics(db, batch_size=10, workers=1)
+
+    assert processed == 2
+    query, projection = db["edit_transcription"].find.call_args[0]
+    assert projection == {"user_id": 1, "content": 1}
+    assert query["_id"]["$gt"] == first_id
+    settled = query["_id"]["$lt"].generation_time
+    assert datetime.now(timezone.utc) - settled >= timedelta(seconds=59)
+    mongo_client = analytics.database.client
+    session = mongo_client.start_session.return_value.__enter__.return_value
+    write = session.with_transaction.call_args.args[0]
+    write(session)
+    assert analytics.bulk_write.call_args.kwargs == {"session": session}
+    updates = analytics.bulk_write.call_args[0][0]
+    summary_filter = updates[-1]._filter  # pylint: disable=protected-access
+    assert summary_filter == {"_id": "summary", "last_id": first_id}
+    summary = updates[-1]._doc  # pylint: disable=protected-access
+    assert summary["$inc"] == {
+        "transcriptions": 2,
+        "parsed": 1,
+        "field_groups": 1,
+        "field_weight": 1,
+    }
+    assert summary["$set"] == {"last_id": last_id}
+    assert len(updates) == 3
+
+
 ### Test upload_transcription function ###
 @patch("app.insert_transcription_entry")
 @patch("app.current_user")
@@ -1116,10 +2654,10 @@ def test_upload_transcription_success(
         content_type="application/json",
     )
 
-    assert response.status_code == 200
+    assert response.status_code == 202
     response_data = response.get_json()
     assert response_data == {
-        "message": "Transcription saved successfully!",
+        "message": "Transcription queued",
         "id": "507f1f77bcf86cd799439012",
     }
     mock_insert_transcription_entry.assert_called_once_with(
@@ -1176,7 +2714,7 @@ def test_upload_transcription_unauthenticated(mock_current_user, client):
 def test_upload_transcription_save_failure(
     mock_current_user, mock_transcription_entry, client
 ):
-    """Test transcription save fail."""
+    """Test a full transcription queue asks the client to retry."""
     # pylint: disable=redefined-outer-name
     mock_current_user.is_authenticated = True
     mock_current_user.id = "507f1f77bcf86cd799439011"
@@ -1187,8 +2725,24 @@ def test_upload_transcription_save_failure(
         data=json.dumps(load),
         content_type="application/json",
     )
-    assert response.status_code == 500
-    assert response.get_json() == {"error": "Failed to save transcription"}
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json() == {
+        "error": "Too many transcriptions waiting to be saved"
+    }
+
+
+def test_shared_modules_match_source():
+    """Test the shared modules are unchanged copies of shared/."""
+    shared = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared")
+    modules = (
+        "request_metrics.py",
+        "tracing.py",
+        "profiler.py",
+        "structured_logging.py",
+    )
+    for module in modules:
+        assert filecmp.cmp(os.path.join(shared, module), module, shallow=False)
 
 
 if __name__ == "__main__":
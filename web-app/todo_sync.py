@@ -0,0 +1,84 @@
+"""
+This module builds the pages of the JSON To-Do API.
+Items are returned in exercise_todo_id order, a page at a time. The cursor
+names the last item of the previous page and the document version the first
+page was read at, so every page of one listing reports the same version.
+
+A client that passes since=<version from its last sync> gets only the items
+changed after that version, plus the ids of the items removed since. It should
+apply the removals first, then the items. When the removals it missed are no
+longer recorded, the response has "reset": true and lists every item, and the
+client should replace its copy.
+"""
+
+from bson import ObjectId
+
+from storage import REMOVED_TODO_LIMIT
+
+ITEM_FIELDS = ("exercise_id", "workout_name", "working_time", "reps", "weight")
+
+
+def parse_fields(value):
+    """Parses the fields parameter. Raises ValueError for unknown fields."""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = set(fields) - set(ITEM_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def parse_cursor(value):
+    """Returns (version, last exercise_todo_id). Raises ValueError if malformed."""
+    version, _, last_id = value.partition(".")
+    return int(version), int(last_id)
+
+
+def serialize_item(item):
+    """A To-Do item with its ObjectIds as strings."""
+    return {
+        key: str(value) if isinstance(value, ObjectId) else value
+        for key, value in item.items()
+    }
+
+
+def removals_since(removed, since):
+    """
+    Ids removed after version since, or None when some of them may have been
+    dropped from the record.
+    """
+    if len(removed) >= REMOVED_TODO_LIMIT and removed[0]["version"] > since + 1:
+        return None
+    return [entry["exercise_todo_id"] for entry in removed if entry["version"] > since]
+
+
+def todo_page(document, limit, cursor=None, since=None):
+    """Builds one page of the API response from a To-Do document (or None)."""
+    document = document or {}
+    version = document.get("version", 0)
+    items = document.get("todo", [])
+    after = None
+    if cursor:
+        version, after = parse_cursor(cursor)
+
+    page = {"version": version}
+    if since is not None:
+        removed = removals_since(document.get("removed", []), since)
+        if removed is None or since > version:
+            page["reset"] = True
+        else:
+            items = [item for item in items if item.get("version", 0) > since]
+            if after is None:
+                page["removed"] = removed
+    if after is not None:
+        items = [item for item in items if item["exercise_todo_id"] > after]
+
+    items = sorted(items, key=lambda item: item["exercise_todo_id"])
+    page["items"] = [serialize_item(item) for item in items[:limit]]
+    page["next_cursor"] = (
+        f"{version}.{items[limit - 1]['exercise_todo_id']}"
+        if len(items) > limit
+        else None
+    )
+    return page
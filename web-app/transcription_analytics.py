@@ -0,0 +1,146 @@
+"""
+Offline analytics over the voice transcriptions stored in edit_transcription.
+Streams the collection in _id order, parses transcripts with parse_voice_command
+on a process pool, and accumulates the results in the transcription_analytics
+collection. Each run resumes after the last processed _id. Entries younger than
+SETTLE_SECONDS are left for the next run: ids are assigned by the web workers
+before the insert, so a slightly older id may still be landing. A batch's
+counters and the checkpoint are written in one transaction, so a run that
+stops part-way can be rerun without counting anything twice.
+
+Usage: python transcription_analytics.py [--batch-size N] [--workers N]
+"""
+
+import argparse
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from mongo_pool import create_mongo_client
+from voice_command import parse_voice_command
+
+SUMMARY_ID = "summary"
+FIELDS = ("time", "groups", "weight")
+SETTLE_SECONDS = 60
+
+
+def summarize_batch(entries, parsed_commands):
+    """
+    Aggregates one batch of transcription entries and their parsed commands.
+    Returns the summary counters and the per-user transcript counts.
+    """
+    summary = Counter()
+    users = Counter()
+    for entry, parsed in zip(entries, parsed_commands):
+        summary["transcriptions"] += 1
+        users[entry.get("user_id")] += 1
+        found = [field for field in FIELDS if parsed[field] is not None]
+        if found:
+            summary["parsed"] += 1
+        for field in found:
+            summary[f"field_{field}"] += 1
+    return summary, users
+
+
+def summary_updates(summary, users, last_id, previous_id=None):
+    """
+    Builds the bulk upserts that fold a batch into the analytics collection.
+    The summary only matches while its checkpoint is still previous_id, so a
+    second run processing the same batch fails instead of counting it again.
+    """
+    updates = [
+        UpdateOne(
+            {"_id": f"user:{user_id}"},
+            {"$inc": {"transcriptions": count}, "$set": {"user_id": user_id}},
+            upsert=True,
+        )
+        for user_id, count in users.items()
+    ]
+    updates.append(
+        UpdateOne(
+            {"_id": SUMMARY_ID, "last_id": previous_id},
+            {"$inc": dict(summary), "$set": {"last_id": last_id}},
+            upsert=True,
+        )
+    )
+    return updates
+
+
+def pending_query(last_id, settle_seconds):
+    """Selects the transcriptions after last_id that are settle_seconds old."""
+    settled = datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+    id_range = {"$lt": ObjectId.from_datetime(settled)}
+    if last_id:
+        id_range["$gt"] = last_id
+    return {"_id": id_range}
+
+
+def run(db, batch_size=1000, workers=None, settle_seconds=SETTLE_SECONDS):
+    """
+    Processes every transcription added since the last run and at least
+    settle_seconds ago. Returns the number of transcriptions processed.
+    """
+    transcriptions = db["edit_transcription"]
+    analytics = db["transcription_analytics"]
+
+    state = analytics.find_one({"_id": SUMMARY_ID}, {"last_id": 1}) or {}
+    last_id = state.get("last_id")
+    query = pending_query(last_id, settle_seconds)
+    cursor = (
+        transcriptions.find(query, {"user_id": 1, "content": 1})
+        .sort("_id", 1)
+        .batch_size(batch_size)
+    )
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, batch_size // (4 * workers))
+    processed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for entry in cursor:
+            batch.append(entry)
+            if len(batch) == batch_size:
+                last_id = process_batch(pool, analytics, batch, chunksize, last_id)
+                processed += len(batch)
+                batch = []
+        if batch:
+            process_batch(pool, analytics, batch, chunksize, last_id)
+            processed += len(batch)
+    return processed
+
+
+def process_batch(pool, analytics, batch, chunksize, previous_id):
+    """
+    Parses one batch on the pool and records its aggregates in a transaction.
+    Returns the batch's last _id, the new checkpoint.
+    """
+    contents = [entry.get("content") or "" for entry in batch]
+    parsed_commands = list(pool.map(parse_voice_command, contents, chunksize=chunksize))
+    summary, users = summarize_batch(batch, parsed_commands)
+    last_id = batch[-1]["_id"]
+    updates = summary_updates(summary, users, last_id, previous_id)
+    with analytics.database.client.start_session() as session:
+        session.with_transaction(lambda s: analytics.bulk_write(updates, session=s))
+    return last_id
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = create_mongo_client(os.getenv("MONGO_URI"))
+    processed = run(client["fitness_db"], args.batch_size, args.workers)
+    print(f"Processed {processed} transcriptions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+This module parses spoken workout commands such as
+"Set 15 minutes, 4 groups, and weight of twenty kilos" in a single pass.
+"""
+
+import re
+
+UNITS = {
+    "ZERO": 0,
+    "ONE": 1,
+    "TWO": 2,
+    "THREE": 3,
+    "FOUR": 4,
+    "FIVE": 5,
+    "SIX": 6,
+    "SEVEN": 7,
+    "EIGHT": 8,
+    "NINE": 9,
+    "TEN": 10,
+    "ELEVEN": 11,
+    "TWELVE": 12,
+    "THIRTEEN": 13,
+    "FOURTEEN": 14,
+    "FIFTEEN": 15,
+    "SIXTEEN": 16,
+    "SEVENTEEN": 17,
+    "EIGHTEEN": 18,
+    "NINETEEN": 19,
+}
+TENS = {
+    "TWENTY": 20,
+    "THIRTY": 30,
+    "FORTY": 40,
+    "FIFTY": 50,
+    "SIXTY": 60,
+    "SEVENTY": 70,
+    "EIGHTY": 80,
+    "NINETY": 90,
+}
+
+KG_PER_POUND = 0.45359237
+
+_WORD = "|".join(sorted([*UNITS, *TENS, "HUNDRED"], key=len, reverse=True))
+_NUMBER = rf"\d+(?:\.\d+)?|(?:{_WORD})(?:[\s-]+(?:and[\s-]+)?(?:{_WORD}))*"
+
+# One alternation per field; the unit decides which field a number belongs to.
+VOICE_COMMAND_PATTERN = re.compile(
+    rf"\b(?P<number>{_NUMBER})\s*(?:"
+    r"(?P<time>minutes?|mins?)"
+    r"|(?P<groups>groups?|sets?|reps?|repetitions?)"
+    r"|(?P<kg>kilograms?|kilos?|kgs?)"
+    r"|(?P<lb>pounds?|lbs?)"
+    r")\b",
+    re.IGNORECASE,
+)
+
+FIELDS = {"time": "time", "groups": "groups", "kg": "weight", "lb": "weight"}
+
+
+def words_to_number(text: str):
+    """
+    Converts digits or spelled-out numbers ("twenty five", "one hundred and ten")
+    to an int, or a float when the value has a fractional part.
+    """
+    if text[0].isdigit():
+        value = float(text)
+        return int(value) if value.is_integer() else value
+
+    total = 0
+    for word in re.split(r"[\s-]+", text.upper()):
+        if word == "HUNDRED":
+            total = max(total, 1) * 100
+        elif word in TENS:
+            total += TENS[word]
+        elif word in UNITS:
+            total += UNITS[word]
+    return total
+
+
+def scan_voice_command(transcription: str):
+    """
+    Scans the transcription once and returns every recognized quantity as
+    a dictionary with its field, value, unit and the (start, end) span consumed.
+    """
+    matches = []
+    for match in VOICE_COMMAND_PATTERN.finditer(transcription):
+        unit = match.lastgroup
+        matches.append(
+            {
+                "field": FIELDS[unit],
+                "value": words_to_number(match.group("number")),
+                "unit": match.group(unit).lower(),
+                "span": match.span(),
+            }
+        )
+    return matches
+
+
+def parse_voice_command(transcription):
+    """
+    Parses the transcription to extract time, group count, and weight parameters.
+    Returns a dictionary with these extracted values; weight is in kilograms.
+    """
+    parsed = {"time": None, "groups": None, "weight": None}
+    for match in scan_voice_command(transcription):
+        if parsed[match["field"]] is not None:
+            continue
+        value = match["value"]
+        if match["unit"].startswith(("pound", "lb")):
+            value = round(value * KG_PER_POUND, 1)
+        parsed[match["field"]] = value
+    return parsed
@@ -0,0 +1,197 @@
+"""
+This module implements a write-behind buffer for log records that no request waits on.
+Records are queued on the request path and written in batches by a background thread,
+either when a batch fills up or when the flush interval passes.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _FlushRequest:  # pylint: disable=too-few-public-methods
+    """Marker asking the worker to write out what it holds and report back."""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class WriteBehindBuffer:
+    """
+    Bounded queue of records flushed with one bulk write per batch.
+    When the queue is full, the "drop" policy rejects the record at once and
+    the "block" policy waits up to block_timeout for room before rejecting it.
+    A failed batch is retried up to max_retries times, waiting retry_delay
+    seconds, doubled after each attempt, before its records are counted as lost.
+    write_many must therefore tolerate a batch that was partly written.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(
+        self,
+        name,
+        write_many,
+        *,
+        max_batch=100,
+        flush_interval=1.0,
+        max_queue=10000,
+        policy="drop",
+        block_timeout=0.05,
+        max_retries=3,
+        retry_delay=0.5,
+    ):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown write-behind policy: {policy}")
+        self.name = name
+        self.write_many = write_many
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "batches": 0,
+            "write_errors": 0,
+            "lost": 0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _ensure_started(self):
+        # Started on first use so that forked workers each get their own thread.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f"write-behind-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def put(self, record):
+        """Queues a record. Returns False if it was dropped."""
+        self._ensure_started()
+        try:
+            if self.policy == "block":
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _write(self, batch):
+        if not batch:
+            return
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_many(batch)
+                self._count("written", len(batch))
+                self._count("batches")
+                return
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._count("write_errors")
+                error = e
+            if attempt < self.max_retries:
+                logger.warning(
+                    "Write-behind flush of %d %s records failed, retrying: %s",
+                    len(batch),
+                    self.name,
+                    error,
+                )
+                time.sleep(delay)
+                delay *= 2
+        self._count("lost", len(batch))
+        logger.error(
+            "Write-behind flush of %d %s records failed %d times, dropping them: %s",
+            len(batch),
+            self.name,
+            self.max_retries + 1,
+            error,
+        )
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    self._write(batch)
+                    return
+                if isinstance(item, _FlushRequest):
+                    self._write(batch)
+                    batch = []
+                    item.done.set()
+                else:
+                    batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def flush(self, timeout=5.0):
+        """Writes out every queued record before returning."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        request = _FlushRequest()
+        self._queue.put(request, timeout=timeout)
+        request.done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Flushes the queue and stops the worker thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP, timeout=timeout)
+        self._thread.join(timeout)
+
+    def metrics(self):
+        """Returns the buffer counters and current queue depth."""
+        with self._lock:
+            metrics = dict(self.stats)
+        metrics["queue_depth"] = self._queue.qsize()
+        return metrics
+
+
+def create_write_behind_buffer(name, write_many, environ=None):
+    """
+    Builds a buffer configured by the WRITE_BEHIND_* environment variables
+    and registers it to be flushed when the process exits.
+    """
+    environ = os.environ if environ is None else environ
+    buffer = WriteBehindBuffer(
+        name,
+        write_many,
+        max_batch=int(environ.get("WRITE_BEHIND_MAX_BATCH", "100")),
+        flush_interval=float(environ.get("WRITE_BEHIND_FLUSH_INTERVAL", "1.0")),
+        max_queue=int(environ.get("WRITE_BEHIND_MAX_QUEUE", "10000")),
+        policy=environ.get("WRITE_BEHIND_POLICY", "drop"),
+        max_retries=int(environ.get("WRITE_BEHIND_MAX_RETRIES", "3")),
+    )
+    atexit.register(buffer.close)
+    return buffer